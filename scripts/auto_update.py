@@ -10,12 +10,27 @@ resources based on their configuration flags and schedule.
 import json
 import os
 import sys
-import subprocess
 import argparse
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
-from typing import Dict, List, Optional
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import capacity_plan
+from bandwidth import BUDGET_ENV, BandwidthSchedule, Governor
+from resource_graph import GraphError, depends_on, group_limits, run_graph, validate
+from retry_policy import CHECKPOINT_ENV, PERMANENT, Failure, RetryPolicy, classify
+from run_metrics import DB_ENV, TEXTFILE_ENV, MetricsStore, export_textfile, open_store
+from state_store import atomic_write_json
+from stream_runner import RunResult, WatchdogPolicy, run_streaming
+from update_schedule import DEFAULT_RETRY_INTERVAL, ScheduleState, plan
+
+DEFAULT_MAX_PARALLEL = 1
+RESOURCE_LOG_DIR = "resources"  # per-resource logs, next to the main log file
+DEFAULT_STATE_FILE = "logs/auto_update_state.json"
+MAX_SLEEP = 3600  # the daemon re-reads the configuration at least this often
 
 # Setup logging
 def setup_logging(log_file: Optional[str] = None):
@@ -54,8 +69,7 @@ def load_config(config_path: Path) -> Dict:
 def save_config(config_path: Path, config: Dict):
     """Save the updated configuration"""
     try:
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=2)
+        atomic_write_json(config_path, config)
         logging.info(f"Configuration saved to {config_path}")
     except Exception as e:
         logging.error(f"Failed to save configuration: {e}")
@@ -66,8 +80,12 @@ def execute_resource_update(
     resource_config: Dict,
     destination_path: str,
     allow_mirror_fallback: bool,
-    dry_run: bool = False
-) -> bool:
+    dry_run: bool = False,
+    watchdog: Optional[WatchdogPolicy] = None,
+    output_log: Optional[Path] = None,
+    checkpoint: Optional[str] = None,
+    extra_env: Optional[Dict[str, str]] = None
+) -> Tuple[bool, Optional[RunResult]]:
     """
     Execute update for a single resource
     
@@ -77,9 +95,15 @@ def execute_resource_update(
         destination_path: Where to download/update the resource
         allow_mirror_fallback: Whether to allow mirror fallback
         dry_run: If True, only show what would be executed
+        watchdog: Throughput policy deciding when a stalled update is killed
+        output_log: File the script's output is appended to (default: stdout)
+        checkpoint: Resume point reported by the previous attempt, passed to
+            the script in the EMERGENCY_STORAGE_CHECKPOINT variable
+        extra_env: Further environment variables for the script (bandwidth share)
         
     Returns:
-        True if successful, False otherwise
+        Tuple of (True if successful, the run's record or None if the script
+        could not be started)
     """
     script = resource_config.get('script', '')
     args = resource_config.get('args', [])
@@ -87,14 +111,14 @@ def execute_resource_update(
     
     if not script:
         logging.error(f"No script defined for {resource_id}")
-        return False
+        return False, None
     
     # Build the command
     script_path = Path(__file__).parent.parent / script
     
     if not script_path.exists():
         logging.error(f"Script not found: {script_path}")
-        return False
+        return False, None
     
     # Determine command based on script type
     if script.endswith('.py'):
@@ -116,46 +140,351 @@ def execute_resource_update(
     
     if dry_run:
         logging.info(f"[DRY RUN] Would execute: {' '.join(command)}")
-        return True
+        return True, None
     
     logging.info(f"Starting update for: {name}")
     logging.info(f"Executing: {' '.join(command)}")
+    if output_log:
+        logging.info(f"Output of {name}: {output_log}")
+    extra_env = dict(extra_env or {})
+    if checkpoint:
+        extra_env[CHECKPOINT_ENV] = checkpoint
+    env = dict(os.environ, **extra_env) if extra_env else None
     
     try:
-        result = subprocess.run(
-            command,
-            capture_output=False,
-            text=True,
-            timeout=3600  # 1 hour timeout
-        )
+        # Script output is echoed as it arrives; the watchdog only stops the
+        # update when its transfers stall, so multi-hour mirrors run to the end
+        if output_log:
+            output_log.parent.mkdir(parents=True, exist_ok=True)
+            with open(output_log, 'a') as output:
+                print(f"===== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {' '.join(command)}",
+                      file=output, flush=True)
+                result = run_streaming(command, label=name, watchdog=watchdog or WatchdogPolicy(),
+                                       env=env, echo=output)
+        else:
+            result = run_streaming(command, label=name, watchdog=watchdog or WatchdogPolicy(),
+                                   env=env, echo=sys.stdout)
         
-        if result.returncode == 0:
-            logging.info(f"✓ Successfully updated {name}")
-            return True
+        if result.timed_out:
+            logging.error(f"✗ Update for {name} aborted: {result.abort_reason}")
+            return False, result
+        elif result.returncode == 0:
+            logging.info(f"✓ Successfully updated {name} ({result.summary()})")
+            return True, result
         else:
             logging.error(f"✗ Failed to update {name} (exit code: {result.returncode})")
-            return False
+            return False, result
             
-    except subprocess.TimeoutExpired:
-        logging.error(f"✗ Update for {name} timed out")
-        return False
     except Exception as e:
         logging.error(f"✗ Error updating {name}: {e}")
+        return False, None
+
+
+def select_resources(config: Dict, resource_list: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """The listed resources in list order, or all enabled ones if no list is given"""
+    resources = config.get('resources', {})
+    if resource_list:
+        return {k: resources[k] for k in resource_list if k in resources}
+    return {k: v for k, v in resources.items() if v.get('enabled', False)}
+
+
+def due_resources(
+    config: Dict,
+    state: ScheduleState,
+    resource_list: Optional[List[str]] = None,
+    now: Optional[datetime] = None
+) -> Tuple[List[str], Optional[datetime]]:
+    """
+    Resources whose update_frequency window has come (see update_schedule)
+    
+    Args:
+        config: Complete configuration dictionary
+        state: Recorded last success/attempt times
+        resource_list: Consider only these resources (None = all enabled)
+        now: Current time (default: now)
+        
+    Returns:
+        Tuple of (due resource IDs, time the next one becomes due or None)
+    """
+    now = now or datetime.now(timezone.utc)
+    retry_interval = config.get('global_settings', {}).get('retry_interval', DEFAULT_RETRY_INTERVAL)
+    try:
+        due, upcoming, errors = plan(select_resources(config, resource_list),
+                                     config.get('schedule', {}), state, now, retry_interval)
+    except ValueError as e:
+        logging.error(f"✗ {e}")
+        return [], None
+    
+    for resource_id, error in errors.items():
+        logging.error(f"✗ {error}; {resource_id} is not scheduled")
+    for resource_id, when in upcoming.items():
+        logging.info(f"{resource_id} is up to date, next due {when.strftime('%Y-%m-%d %H:%M %Z')}")
+    for resource_id in due:
+        last_success = state.last_success(resource_id)
+        since = f"last success {last_success.strftime('%Y-%m-%d %H:%M %Z')}" if last_success else "never updated"
+        logging.info(f"{resource_id} is due ({since})")
+    
+    return due, min(upcoming.values(), default=None)
+
+
+def preflight(
+    config: Dict,
+    resource_list: Optional[List[str]] = None,
+    metrics: Optional[MetricsStore] = None,
+    force: bool = False
+) -> Optional[capacity_plan.Plan]:
+    """
+    Estimate what the run needs and decide what fits (see capacity_plan)
+    
+    Args:
+        config: Complete configuration dictionary
+        resource_list: Resources of this run (None = all enabled)
+        metrics: Run history estimates fall back to
+        force: Plan even if ``global_settings.preflight`` is missing or disabled
+        
+    Returns:
+        The plan, or None if preflight planning is not configured
+    """
+    global_settings = config.get('global_settings', {})
+    resources = select_resources(config, resource_list)
+    if not resources:
+        return None
+    max_parallel = global_settings.get('max_parallel', DEFAULT_MAX_PARALLEL)
+    if isinstance(max_parallel, bool) or not isinstance(max_parallel, int):
+        max_parallel = DEFAULT_MAX_PARALLEL
+    try:
+        settings = capacity_plan.Settings.from_config(global_settings.get('preflight'))
+        if settings is None:
+            if not force:
+                return None
+            settings = capacity_plan.Settings()
+        order = list(resources)
+        deps = {resource_id: depends_on(resource_id, resources[resource_id]) for resource_id in order}
+        destination = Path(global_settings.get('destination_path', '/mnt/external_drive'))
+        destinations = {}
+        for resource_id, resource_config in resources.items():
+            probe_path = (resource_config.get('size_probe') or {}).get('path')
+            destinations[resource_id] = destination / probe_path if probe_path else destination
+        
+        logging.info(f"Preflight: estimating {len(order)} resource(s)...")
+        # Probes ask different servers, so they run side by side
+        workers = max(1, min(len(order), max_parallel))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {resource_id: executor.submit(capacity_plan.estimate, resource_id, resources[resource_id],
+                                                    destination, metrics, settings.rsync_timeout)
+                       for resource_id in order}
+            estimates = {resource_id: future.result() for resource_id, future in futures.items()}
+        plan = capacity_plan.fit(order, estimates, deps, destinations, settings, workers)
+    except (capacity_plan.PlanError, GraphError, OSError) as e:
+        logging.error(f"✗ Preflight failed: {e}")
+        return capacity_plan.Plan(order=[], skipped={resource_id: str(e) for resource_id in resources},
+                                  refused=True)
+    
+    for line in capacity_plan.report(plan, settings):
+        logging.info(line)
+    if plan.refused:
+        logging.error(f"✗ Refusing to start: {len(plan.skipped)} resource(s) don't fit "
+                      f"(preflight.on_shortfall is '{capacity_plan.REFUSE}')")
+    return plan
+
+
+def run_resources(
+    config: Dict,
+    resource_list: Optional[List[str]] = None,
+    dry_run: bool = False,
+    log_dir: Optional[Path] = None,
+    metrics: Optional[MetricsStore] = None
+) -> Dict[str, bool]:
+    """
+    Run the preflight check, then the resources that fit
+    
+    Resources skipped by the check, and every resource of a refused run,
+    count as failed. Dry runs start no probes.
+    
+    Returns:
+        Dictionary mapping resource IDs to success/failure status
+    """
+    plan = preflight(config, resource_list, metrics) if not dry_run else None
+    if plan is None:
+        return process_resources(config, resource_list, dry_run, log_dir, metrics)
+    
+    failed = {resource_id: False for resource_id in select_resources(config, resource_list)}
+    if plan.refused:
+        return failed
+    for resource_id, reason in plan.skipped.items():
+        logging.error(f"✗ Skipping {resource_id}: {reason}")
+    results = process_resources(config, plan.order, dry_run, log_dir, metrics) if plan.order else {}
+    return {resource_id: results.get(resource_id, False) for resource_id in failed}
+
+
+def record_results(state: ScheduleState, results: Dict[str, bool], started: datetime):
+    """
+    Store the outcome of a run
+    
+    Successes count from when the run started, so changes made upstream
+    during the run are picked up by the next window. Failures count from
+    now, so retry_interval separates the end of a failed run from the
+    next attempt however long the run took.
+    """
+    finished = datetime.now(timezone.utc)
+    for resource_id, success in results.items():
+        state.record(resource_id, success, started if success else finished)
+    try:
+        state.save()
+    except OSError as e:
+        logging.error(f"Failed to save schedule state {state.path}: {e}")
+
+
+def run_daemon(
+    config_path: Path,
+    state: ScheduleState,
+    resource_list: Optional[List[str]] = None,
+    dry_run: bool = False,
+    log_dir: Optional[Path] = None,
+    metrics: Optional[MetricsStore] = None
+):
+    """
+    Keep running and update each resource whenever it is due
+    
+    Nothing is started while no resource is due; the daemon sleeps until the
+    next one is, re-reading the configuration at least every MAX_SLEEP
+    seconds. With dry_run the due resources are shown once and it returns.
+    """
+    logging.info(f"Scheduler started; schedule state: {state.path}")
+    while True:
+        config = load_config(config_path)
+        started = datetime.now(timezone.utc)
+        due, next_due = due_resources(config, state, resource_list, started)
+        if due:
+            results = run_resources(config, due, dry_run, log_dir, metrics)
+            print_summary(results)
+            if dry_run:
+                return
+            record_results(state, results, started)
+            export_textfile(metrics)
+            continue
+        if dry_run:
+            logging.info("Nothing is due")
+            return
+        
+        wait = MAX_SLEEP
+        if next_due is not None:
+            wait = min(MAX_SLEEP, max(1.0, (next_due - datetime.now(timezone.utc)).total_seconds()))
+        logging.info(f"Nothing is due; sleeping {int(wait)}s")
+        time.sleep(wait)
+
+
+def update_resource(
+    resource_id: str,
+    resource_config: Dict,
+    global_settings: Dict,
+    dry_run: bool = False,
+    log_dir: Optional[Path] = None,
+    stats: Optional[Dict] = None,
+    governor: Optional[Governor] = None
+) -> bool:
+    """
+    Update one resource, retrying failed attempts
+    
+    Args:
+        resource_id: Resource identifier
+        resource_config: Configuration dictionary for the resource
+        global_settings: The global_settings section
+        dry_run: If True, only show what would be executed
+        log_dir: Directory for per-resource output logs (None = stdout)
+        stats: Filled with attempts, bytes, exit_code and error of the run
+        governor: Bandwidth governor handing each attempt its share
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    destination_path = global_settings.get('destination_path', '/mnt/external_drive')
+    allow_mirror_fallback = global_settings.get('allow_mirror_fallback', False)
+    name = resource_config.get('name', resource_id)
+    
+    try:
+        watchdog = WatchdogPolicy.from_config(global_settings.get('watchdog'),
+                                              resource_config.get('watchdog'))
+        policy = RetryPolicy.from_config(global_settings, global_settings.get('retry'),
+                                         resource_config.get('retry'))
+    except ValueError as e:
+        logging.error(f"✗ {e} for {resource_id}")
+        if stats is not None:
+            stats["error"] = str(e)
         return False
+    
+    output_log = log_dir / f"{resource_id}.log" if log_dir and not dry_run else None
+    checkpoint = None
+    stats = stats if stats is not None else {}
+    
+    for attempt in range(1, policy.attempts + 1):
+        stats["attempts"] = attempt
+        if attempt > 1:
+            resume = f", resuming from checkpoint '{checkpoint}'" if checkpoint else ""
+            logging.info(f"Retry attempt {attempt}/{policy.attempts} for {name}{resume}")
+        # The share is taken when the attempt starts, so it follows time windows
+        bandwidth_env = governor.env() if governor else {}
+        if bandwidth_env and not dry_run:
+            logging.info(f"Bandwidth share of {name}: {int(bandwidth_env[BUDGET_ENV]) // 1024} KB/s")
+        
+        success, result = execute_resource_update(
+            resource_id,
+            resource_config,
+            destination_path,
+            allow_mirror_fallback,
+            dry_run,
+            watchdog,
+            output_log,
+            checkpoint,
+            bandwidth_env
+        )
+        if result is not None:
+            stats["exit_code"] = result.returncode
+            if result.bytes_transferred is not None:
+                stats["bytes"] = stats.get("bytes", 0) + result.bytes_transferred
+        
+        if success:
+            return True
+        
+        # Only failures retrying can fix are retried, and not back to back
+        if result is None:
+            failure = Failure(PERMANENT, "the script could not be started")
+        else:
+            failure = classify(result.returncode, result.output_tail, result.timed_out,
+                               result.abort_reason)
+            checkpoint = result.checkpoint or checkpoint
+        stats["error"] = f"{failure.kind}: {failure.reason}"
+        if not failure.transient:
+            logging.error(f"✗ Permanent failure of {name} ({failure.reason}), not retrying")
+            return False
+        if attempt < policy.attempts:
+            delay = policy.delay(attempt)
+            logging.warning(f"Transient failure of {name} ({failure.reason}), retrying in {delay:.0f}s")
+            time.sleep(delay)
+    
+    return False
 
 
 def process_resources(
     config: Dict,
     resource_list: Optional[List[str]] = None,
-    dry_run: bool = False
+    dry_run: bool = False,
+    log_dir: Optional[Path] = None,
+    metrics: Optional[MetricsStore] = None
 ) -> Dict[str, bool]:
     """
     Process all enabled resources or specified resources
     
+    Resources run concurrently, up to ``global_settings.max_parallel`` at
+    once, in the order their ``depends_on`` lists and concurrency groups
+    allow (see resource_graph).
+    
     Args:
         config: Complete configuration dictionary
         resource_list: List of specific resources to update (None = all enabled)
         dry_run: If True, only show what would be executed
+        log_dir: Directory for per-resource output logs (None = stdout)
+        metrics: Run history each resource's outcome is recorded in
         
     Returns:
         Dictionary mapping resource IDs to success/failure status
@@ -164,52 +493,82 @@ def process_resources(
     global_settings = config.get('global_settings', {})
     
     destination_path = global_settings.get('destination_path', '/mnt/external_drive')
-    allow_mirror_fallback = global_settings.get('allow_mirror_fallback', False)
-    max_retries = global_settings.get('max_retries', 3)
-    retry_failed = global_settings.get('retry_failed', True)
+    max_parallel = global_settings.get('max_parallel', DEFAULT_MAX_PARALLEL)
     
     results = {}
-    
-    # Filter resources
-    if resource_list:
-        resources_to_process = {k: v for k, v in resources.items() if k in resource_list}
-    else:
-        resources_to_process = {k: v for k, v in resources.items() if v.get('enabled', False)}
+    resources_to_process = select_resources(config, resource_list)
     
     if not resources_to_process:
         logging.warning("No resources to process")
         return results
     
-    logging.info(f"Processing {len(resources_to_process)} resource(s)")
+    try:
+        validate(resources)
+        limits = group_limits(global_settings.get('concurrency_groups'))
+        if isinstance(max_parallel, bool) or not isinstance(max_parallel, int) or max_parallel < 1:
+            raise GraphError(f"max_parallel must be a positive number, not {max_parallel!r}")
+        bandwidth = BandwidthSchedule.from_config(global_settings.get('bandwidth'), config.get('schedule'))
+    except (GraphError, ValueError) as e:
+        logging.error(f"✗ {e}")
+        return {resource_id: False for resource_id in resources_to_process}
+    # Every resource that can run at the same time gets an equal share
+    governor = Governor(bandwidth, min(max_parallel, len(resources_to_process))) if bandwidth else None
+    if governor:
+        governor.register(len(resources_to_process))
+    
+    order = list(resources_to_process)
+    deps = {}
+    for resource_id, resource_config in resources_to_process.items():
+        deps[resource_id] = depends_on(resource_id, resource_config)
+        for dep in deps[resource_id]:
+            if dep not in resources_to_process:
+                logging.info(f"{resource_id} does not wait for {dep}, which is not part of this run")
+    groups = {resource_id: resource_config.get('concurrency_group')
+              for resource_id, resource_config in resources_to_process.items()}
+    
+    logging.info(f"Processing {len(resources_to_process)} resource(s), up to {max_parallel} at once")
     logging.info(f"Destination path: {destination_path}")
+    if governor:
+        logging.info(f"Bandwidth: {governor.describe()}")
+    if log_dir and not dry_run:
+        logging.info(f"Resource logs: {log_dir}")
     logging.info("="*60)
     
-    for resource_id, resource_config in resources_to_process.items():
-        logging.info("")
-        logging.info(f"Resource: {resource_id} - {resource_config.get('name', 'Unknown')}")
-        logging.info(f"Description: {resource_config.get('description', 'N/A')}")
-        logging.info(f"Update frequency: {resource_config.get('update_frequency', 'N/A')}")
-        
-        success = False
-        attempts = 1 if not retry_failed else max_retries
-        
-        for attempt in range(1, attempts + 1):
-            if attempt > 1:
-                logging.info(f"Retry attempt {attempt}/{attempts}")
-            
-            success = execute_resource_update(
-                resource_id,
-                resource_config,
-                destination_path,
-                allow_mirror_fallback,
-                dry_run
-            )
-            
-            if success:
-                break
-        
-        results[resource_id] = success
-        logging.info("-"*60)
+    def on_start(resource_id: str):
+        # One line per resource: the headers of concurrent resources would
+        # otherwise interleave with each other's output
+        resource_config = resources_to_process[resource_id]
+        details = [f"update frequency: {resource_config.get('update_frequency', 'N/A')}"]
+        waits_for = [dep for dep in deps[resource_id] if dep in resources_to_process]
+        if waits_for:
+            details.append(f"after: {', '.join(waits_for)}")
+        if groups[resource_id]:
+            details.append(f"group: {groups[resource_id]}")
+        logging.info(f"Resource: {resource_id} - {resource_config.get('name', 'Unknown')} "
+                     f"({'; '.join(details)})")
+    
+    def on_skip(resource_id: str, failed: str):
+        logging.error(f"✗ Skipping {resource_id}: {failed} failed")
+        if governor:
+            governor.unregister()
+    
+    def run(resource_id: str) -> bool:
+        stats: Dict = {}
+        started = time.monotonic()
+        try:
+            success = update_resource(resource_id, resources_to_process[resource_id], global_settings,
+                                      dry_run, log_dir, stats, governor)
+        finally:
+            # The resources still to run share what this one used
+            if governor:
+                governor.unregister()
+        if metrics is not None and not dry_run:
+            metrics.record(resource_id, "success" if success else "failed", time.monotonic() - started,
+                           stats.get("bytes"), max(0, stats.get("attempts", 1) - 1), stats.get("exit_code"),
+                           detail=None if success else stats.get("error"))
+        return success
+    
+    results = run_graph(order, deps, groups, run, max_parallel, limits, on_start, on_skip)
     
     return results
 
@@ -256,6 +615,15 @@ Examples:
   
   # Use custom configuration file
   python3 scripts/auto_update.py --config /path/to/config.json
+  
+  # Update only the resources whose update_frequency says they are due
+  python3 scripts/auto_update.py --due
+  
+  # Keep running and update each resource when it is due
+  python3 scripts/auto_update.py --daemon
+  
+  # Check disk space and expected duration without downloading anything
+  python3 scripts/auto_update.py --plan
         """
     )
     
@@ -302,6 +670,24 @@ Examples:
         help='Show what would be executed without actually executing'
     )
     
+    parser.add_argument(
+        '--due',
+        action='store_true',
+        help='Update only resources that are due according to their update_frequency'
+    )
+    
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Keep running and update each resource whenever it is due'
+    )
+    
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help='Estimate sizes and durations, compare them with free space, and exit without downloading'
+    )
+    
     args = parser.parse_args()
     
     # Get script directory
@@ -315,11 +701,20 @@ Examples:
     config = load_config(config_path)
     
     # Setup logging
-    log_file = config.get('global_settings', {}).get('log_file')
+    global_settings = config.get('global_settings', {})
+    log_file = global_settings.get('log_file')
     if log_file:
         log_file = str(repo_root / log_file)
     setup_logging(log_file)
     
+    # Script output goes to one log file per resource, so concurrent
+    # resources don't interleave
+    log_dir = None
+    if global_settings.get('resource_log_dir'):
+        log_dir = repo_root / global_settings['resource_log_dir']
+    elif log_file:
+        log_dir = Path(log_file).parent / RESOURCE_LOG_DIR
+    
     logging.info("EmergencyStorage - Automatic Resource Updater")
     logging.info("="*60)
     logging.info(f"Configuration: {config_path}")
@@ -342,8 +737,39 @@ Examples:
         if args.resource5:
             resource_list.append('resource5')
     
+    state = ScheduleState(repo_root / global_settings.get('state_file', DEFAULT_STATE_FILE))
+    
+    # Exported, so the manual sources script run as a resource records into
+    # the same history
+    for key, variable in (('metrics_db', DB_ENV), ('metrics_textfile', TEXTFILE_ENV)):
+        value = global_settings.get(key)
+        if value:
+            os.environ[variable] = value if value == 'off' else str(repo_root / value)
+    metrics = open_store('auto_update') if not args.dry_run else None
+    
+    if args.daemon:
+        try:
+            run_daemon(config_path, state, resource_list, args.dry_run, log_dir, metrics)
+        except KeyboardInterrupt:
+            logging.info("Scheduler stopped")
+        sys.exit(0)
+    
+    started = datetime.now(timezone.utc)
+    if args.due:
+        resource_list, _ = due_resources(config, state, resource_list, started)
+        if not resource_list:
+            logging.info("Nothing is due")
+            sys.exit(0)
+    
+    if args.plan:
+        plan = preflight(config, resource_list, metrics, force=True)
+        sys.exit(1 if plan is not None and plan.refused else 0)
+    
     # Process resources
-    results = process_resources(config, resource_list, args.dry_run)
+    results = run_resources(config, resource_list, args.dry_run, log_dir, metrics)
+    if not args.dry_run:
+        record_results(state, results, started)
+        export_textfile(metrics)
     
     # Print summary
     print_summary(results)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Bandwidth Governor
+Part of EmergencyStorage - Shares one download bandwidth budget between concurrent jobs
+
+The budget is the ``bandwidth`` object of ``global_settings`` in
+``auto_update_config.json``::
+
+    "bandwidth": {
+      "limit": "20M",
+      "windows": [
+        {"days": ["mon", "tue", "wed", "thu", "fri"], "start": "08:00", "end": "18:00", "limit": "2M"},
+        {"start": "23:00", "end": "06:00", "limit": null}
+      ],
+      "min_share": "64k"
+    }
+
+``limit`` is the total in bytes per second (``null`` or 0: unlimited). During
+a window, in the timezone of the ``schedule`` section, the first matching
+window's limit applies instead; windows may run past midnight.
+
+Every job gets an equal share: the limit in force, divided by the number of
+unfinished jobs of the run (at most the number that can run at once), but
+at least ``min_share``. The share grows as the run drains.
+External tools get their share as options (``rsync --bwlimit``, ``curl``/``wget
+--limit-rate``; git has no such option and is run under ``trickle`` when it
+is installed). In-process HTTP transfers are throttled to their share, which
+follows window changes as they happen. A child process receives its share in
+``EMERGENCY_STORAGE_BANDWIDTH`` and divides it between its own jobs.
+"""
+
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, time as dtime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from state_store import load_json_state
+from stream_runner import format_rate, parse_size
+from update_schedule import schedule_timezone
+
+BUDGET_ENV = "EMERGENCY_STORAGE_BANDWIDTH"
+DEFAULT_CONFIG = Path(__file__).resolve().parent.parent / "data" / "auto_update_config.json"
+DEFAULT_MIN_SHARE = 64 * 1024  # bytes/s; smaller shares make transfers crawl into their watchdog
+RECHECK_INTERVAL = 1.0  # seconds between limit lookups of a throttled transfer
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def _rate(value, name: str) -> Optional[float]:
+    """A limit in bytes per second; None or 0 means unlimited."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = parse_size(value) if value.strip() else 0
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"Invalid bandwidth {name}: {value!r}")
+    return float(value) or None
+
+
+def _clock(value, name: str) -> dtime:
+    try:
+        hour, minute = str(value).split(":")
+        return dtime(int(hour), int(minute))
+    except ValueError:
+        raise ValueError(f"Bandwidth window {name} must be HH:MM, not {value!r}")
+
+
+class Window:
+    """A time of day (and optionally days of the week) with its own limit."""
+
+    def __init__(self, value: Dict):
+        if not isinstance(value, dict):
+            raise ValueError("Bandwidth windows must be objects")
+        self.start = _clock(value.get("start"), "start")
+        self.end = _clock(value.get("end"), "end")
+        days = value.get("days", DAYS)
+        if not isinstance(days, list) or any(str(day).lower()[:3] not in DAYS for day in days):
+            raise ValueError(f"Bandwidth window days must be a list of {', '.join(DAYS)}")
+        self.days = {DAYS.index(str(day).lower()[:3]) for day in days}
+        self.limit = _rate(value.get("limit"), "window limit")
+
+    def matches(self, moment: datetime) -> bool:
+        at = moment.time()
+        if self.start <= self.end:
+            return moment.weekday() in self.days and self.start <= at < self.end
+        # Past midnight: the early hours belong to the previous day's window
+        if at >= self.start:
+            return moment.weekday() in self.days
+        return at < self.end and (moment.weekday() - 1) % 7 in self.days
+
+
+class BandwidthSchedule:
+    """The total limit over time."""
+
+    def __init__(self, limit: Optional[float] = None, windows: Optional[List[Window]] = None,
+                 tz=timezone.utc, min_share: float = DEFAULT_MIN_SHARE):
+        self.default = limit
+        self.windows = windows or []
+        self.tz = tz
+        self.min_share = min_share
+
+    @classmethod
+    def from_config(cls, value: Optional[Dict], schedule: Optional[Dict] = None) -> Optional["BandwidthSchedule"]:
+        """
+        Parse ``global_settings.bandwidth``; None if there is none.
+
+        Raises:
+            ValueError: If a limit, window or the schedule's timezone is invalid
+        """
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            raise ValueError("bandwidth must be an object")
+        windows = value.get("windows", [])
+        if not isinstance(windows, list):
+            raise ValueError("Bandwidth windows must be a list")
+        min_share = _rate(value.get("min_share", DEFAULT_MIN_SHARE), "min_share") or 0
+        return cls(_rate(value.get("limit"), "limit"), [Window(window) for window in windows],
+                   schedule_timezone(schedule or {}), min_share)
+
+    def limit_at(self, moment: Optional[datetime] = None) -> Optional[float]:
+        """Total bytes per second allowed at a moment (None: unlimited)."""
+        moment = (moment or datetime.now(timezone.utc)).astimezone(self.tz)
+        for window in self.windows:
+            if window.matches(moment):
+                return window.limit
+        return self.default
+
+
+class Throttle:
+    """Token bucket pacing one in-process transfer (thread-safe, for segments)."""
+
+    def __init__(self, rate: Callable[[], Optional[float]]):
+        self._rate_of = rate
+        self._lock = threading.Lock()
+        self._checked = float("-inf")
+        self._rate: Optional[float] = None
+        self._last = time.monotonic()
+        self._allowance = 0.0
+
+    def consume(self, size: int):
+        """Account for ``size`` received bytes, sleeping as long as the share requires."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked >= RECHECK_INTERVAL:
+                self._checked = now
+                self._rate = self._rate_of()
+            if not self._rate:
+                self._last = now
+                return
+            # Up to one second of unused allowance may be spent in a burst
+            self._allowance = min(self._rate, self._allowance + (now - self._last) * self._rate) - size
+            self._last = now
+            wait = -self._allowance / self._rate if self._allowance < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Governor:
+    """
+    Divides a bandwidth schedule between the jobs of a run, up to ``slots`` at once.
+
+    Jobs are counted from when they are queued (register) until they finish
+    (unregister), not only while they run: the count then only goes down,
+    so a share an external tool took when it started never adds up to more
+    than the limit. In-process throttles pick up the larger share within a
+    second. Until jobs are registered, every slot counts as busy.
+    """
+
+    def __init__(self, schedule: Optional[BandwidthSchedule] = None, slots: int = 1):
+        self.schedule = schedule
+        self.slots = max(1, slots)
+        self._lock = threading.Lock()
+        self._pending: Optional[int] = None
+
+    @classmethod
+    def from_environment(cls, slots: int = 1, config_path: Optional[Path] = DEFAULT_CONFIG) -> "Governor":
+        """
+        The budget handed down in EMERGENCY_STORAGE_BANDWIDTH, or else the
+        one configured in the auto-update configuration (None: don't look).
+
+        An invalid budget only produces a warning and leaves transfers unlimited.
+        """
+        value = os.environ.get(BUDGET_ENV)
+        try:
+            if value:
+                return cls(BandwidthSchedule(_rate(value, BUDGET_ENV), min_share=0), slots)
+            if config_path is None:
+                return cls(None, slots)
+            config = load_json_state(Path(config_path), {}) or {}
+            return cls(BandwidthSchedule.from_config(config.get("global_settings", {}).get("bandwidth"),
+                                                     config.get("schedule")), slots)
+        except ValueError as e:
+            print(f"Warning: {e}; bandwidth is not limited", file=sys.stderr)
+            return cls(None, slots)
+
+    def register(self, count: int = 1):
+        """Count ``count`` more jobs, queued or running."""
+        with self._lock:
+            self._pending = (self._pending or 0) + count
+
+    def unregister(self):
+        """Stop counting a finished job; the jobs left divide its part between them."""
+        with self._lock:
+            if self._pending:
+                self._pending -= 1
+
+    def jobs(self) -> int:
+        """Number of jobs the limit is divided between now."""
+        with self._lock:
+            if self._pending is None:
+                return self.slots
+            return max(1, min(self.slots, self._pending))
+
+    def limit(self) -> Optional[float]:
+        """The total limit in force now (None: unlimited)."""
+        return self.schedule.limit_at() if self.schedule else None
+
+    def share(self) -> Optional[int]:
+        """Bytes per second one job may use now (None: unlimited)."""
+        limit = self.limit()
+        if not limit:
+            return None
+        return int(max(limit / self.jobs(), self.schedule.min_share, 1))
+
+    def env(self) -> Dict[str, str]:
+        """Environment handing a child process its share as its budget."""
+        share = self.share()
+        return {BUDGET_ENV: str(share)} if share else {}
+
+    def command(self, command: List[str]) -> List[str]:
+        """``command`` with the rate-limit options of its tool for the current share."""
+        share = self.share()
+        if not share or not command:
+            return command
+        return limit_command(command, share)
+
+    def throttle(self) -> Optional[Throttle]:
+        """A throttle for one in-process transfer, or None if nothing is limited."""
+        if self.schedule is None:
+            return None
+        return Throttle(self.share)
+
+    def describe(self) -> str:
+        limit = self.limit()
+        if not limit:
+            return "unlimited"
+        return f"{format_rate(limit)} total, {format_rate(self.share())} per job ({self.jobs()} at once)"
+
+
+def limit_command(command: List[str], rate: int) -> List[str]:
+    """
+    Add the rate limit of a tool to its command line.
+
+    rsync, curl and wget get their own options; git is wrapped in
+    ``trickle`` if it is installed. Other commands are returned unchanged.
+    """
+    tool = os.path.basename(command[0])
+    if tool == "rsync":
+        return [command[0], f"--bwlimit={max(1, rate // 1024)}"] + command[1:]
+    if tool == "curl":
+        return [command[0], "--limit-rate", str(rate)] + command[1:]
+    if tool == "wget":
+        return [command[0], f"--limit-rate={rate}"] + command[1:]
+    if tool == "git" and shutil.which("trickle"):
+        return ["trickle", "-s", "-d", str(max(1, rate // 1024))] + command
+    return command
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Capacity Planner
+Part of EmergencyStorage - Checks that an auto-update run fits on disk and in time before it starts
+
+Before any transfer, the bytes each resource will add are estimated from,
+in order of preference:
+
+- a ``size_probe`` in the resource's configuration: ``{"url": ...}`` asks an
+  HTTP server for the file's size, ``{"rsync": ...}`` runs ``rsync --dry-run
+  --stats`` against the mirror. ``path`` (relative to the destination) is
+  the local copy, whose size or content is subtracted;
+- the run history (see run_metrics.py): the median bytes of the resource's
+  recent successful runs.
+
+Estimates are compared with the free space of the filesystem each resource
+writes to, minus a reserve, and expected durations (from the history's
+throughput) with an optional time budget. Resources that don't fit are
+skipped, in configuration order, together with the resources that depend on
+them, or the whole run is refused, before anything is downloaded.
+"""
+
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import http_engine
+from run_metrics import MetricsStore
+from stream_runner import format_bytes, format_duration, parse_size
+
+SKIP = "skip"
+REFUSE = "refuse"
+DEFAULT_MARGIN = 1.1  # estimates are scaled by this before they are compared
+DEFAULT_RSYNC_TIMEOUT = 600.0  # seconds an rsync dry run may take
+HISTORY_RUNS = 5  # recent successful runs the history estimate is taken from
+
+RSYNC_TOTAL = re.compile(r"^Total transferred file size:\s*([\d.,]+\s*[kKMGTP]?)", re.M)
+
+
+class PlanError(Exception):
+    """Raised for malformed preflight settings or probes that fail."""
+
+
+@dataclass
+class Settings:
+    """The ``global_settings.preflight`` section."""
+    enabled: bool = True
+    reserve: int = 0  # bytes to leave free on every filesystem
+    margin: float = DEFAULT_MARGIN
+    max_duration: Optional[float] = None  # seconds the run must fit in
+    on_shortfall: str = SKIP
+    rsync_timeout: float = DEFAULT_RSYNC_TIMEOUT
+
+    @classmethod
+    def from_config(cls, value: Optional[Dict]) -> Optional["Settings"]:
+        """
+        Parse the preflight section; None if there is none or it is disabled.
+
+        Raises:
+            PlanError: If a setting is out of range
+        """
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            raise PlanError("preflight must be an object")
+        settings = cls()
+        settings.enabled = bool(value.get("enabled", True))
+        if not settings.enabled:
+            return None
+        for key in ("reserve", "margin", "max_duration", "rsync_timeout"):
+            if value.get(key) is None:
+                continue
+            number = value[key]
+            if key == "reserve" and isinstance(number, str):
+                number = parse_size(number)  # e.g. "20G"
+            if isinstance(number, bool) or not isinstance(number, (int, float)) or number < 0:
+                raise PlanError(f"Invalid preflight setting {key}: {value[key]!r}")
+            setattr(settings, key, number)
+        if settings.margin < 1:
+            raise PlanError("Preflight setting margin must be at least 1")
+        settings.on_shortfall = value.get("on_shortfall", SKIP)
+        if settings.on_shortfall not in (SKIP, REFUSE):
+            raise PlanError(f"Preflight setting on_shortfall must be '{SKIP}' or '{REFUSE}'")
+        return settings
+
+
+@dataclass
+class Estimate:
+    resource_id: str
+    bytes: Optional[int] = None  # bytes the update adds on disk
+    source: str = "unknown"  # "http", "rsync", "history" or "unknown"
+    duration: Optional[float] = None  # expected seconds
+    note: Optional[str] = None  # why a probe was not used
+
+
+def probe_http(url: str, local: Optional[Path]) -> int:
+    """
+    Bytes still to download for a single file: remote size minus the local copy.
+
+    Raises:
+        PlanError: If the server can't be asked or doesn't report a size
+    """
+    try:
+        _, size, _, _ = http_engine.probe(url)
+    except Exception as e:
+        raise PlanError(f"size probe of {url} failed: {e}")
+    if size is None:
+        raise PlanError(f"{url} did not report its size")
+    have = local.stat().st_size if local is not None and local.is_file() else 0
+    return max(0, size - have)
+
+
+def probe_rsync(source: str, local: Path, timeout: float = DEFAULT_RSYNC_TIMEOUT) -> int:
+    """
+    Bytes an rsync of ``source`` into ``local`` would transfer, from a dry run.
+
+    Changed files are rewritten through a temporary copy, so the transfer
+    size is also an upper bound for the space the update needs.
+
+    Raises:
+        PlanError: If rsync is missing, fails or prints no statistics
+    """
+    command = ["rsync", "-rlptD", "--delete", "--dry-run", "--stats", source, f"{local}/"]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except FileNotFoundError:
+        raise PlanError("rsync is required for rsync size probes but not installed")
+    except subprocess.TimeoutExpired:
+        raise PlanError(f"rsync dry run against {source} timed out after {timeout:.0f}s")
+    match = RSYNC_TOTAL.search(result.stdout)
+    if result.returncode != 0 or not match:
+        detail = (result.stderr.strip().splitlines() or [f"exit code {result.returncode}"])[-1]
+        raise PlanError(f"rsync dry run against {source} failed: {detail}")
+    return parse_size(match.group(1))
+
+
+def history(store: Optional[MetricsStore], resource_id: str,
+            runs: int = HISTORY_RUNS) -> Tuple[Optional[int], Optional[float], Optional[float]]:
+    """
+    Median bytes, duration and throughput of a resource's recent successful runs.
+
+    Returns:
+        Tuple of (bytes, seconds, bytes per second), each None if unknown
+    """
+    if store is None:
+        return None, None, None
+    try:
+        rows = store.runs("auto_update", resource_id, runs * 4)
+    except sqlite3.Error:
+        return None, None, None
+    rows = [row for row in rows if row["status"] == "success"][:runs]
+    sizes = [row["bytes"] for row in rows if row["bytes"] is not None]
+    durations = [row["duration"] for row in rows if row["duration"]]
+    rates = [row["throughput"] for row in rows if row["throughput"]]
+    return (int(statistics.median(sizes)) if sizes else None,
+            statistics.median(durations) if durations else None,
+            statistics.median(rates) if rates else None)
+
+
+def estimate(resource_id: str, resource_config: Dict, destination: Path,
+             store: Optional[MetricsStore] = None,
+             rsync_timeout: float = DEFAULT_RSYNC_TIMEOUT) -> Estimate:
+    """
+    Estimate the bytes and time one resource's update needs.
+
+    A failing probe falls back to the history and is noted, not raised.
+
+    Raises:
+        PlanError: If the resource's size_probe is malformed
+    """
+    result = Estimate(resource_id)
+    probe = resource_config.get("size_probe")
+    if probe is not None:
+        if not isinstance(probe, dict) or ("url" in probe) == ("rsync" in probe):
+            raise PlanError(f"size_probe of {resource_id} needs either 'url' or 'rsync'")
+        local = destination / probe["path"] if probe.get("path") else None
+        if "rsync" in probe and local is None:
+            raise PlanError(f"rsync size_probe of {resource_id} needs a 'path'")
+        try:
+            if "url" in probe:
+                result.bytes, result.source = probe_http(probe["url"], local), "http"
+            else:
+                result.bytes, result.source = probe_rsync(probe["rsync"], local, rsync_timeout), "rsync"
+        except PlanError as e:
+            result.note = str(e)
+
+    past_bytes, past_duration, past_rate = history(store, resource_id)
+    if result.bytes is None and past_bytes is not None:
+        result.bytes, result.source = past_bytes, "history"
+    if result.bytes is not None and past_rate:
+        result.duration = result.bytes / past_rate
+    else:
+        result.duration = past_duration
+    return result
+
+
+def filesystem(path: Path) -> Tuple[Path, int, int]:
+    """
+    The filesystem a (possibly not yet created) path will be on.
+
+    Returns:
+        Tuple of (nearest existing directory, device id, free bytes)
+    """
+    path = Path(path).absolute()
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    return path, path.stat().st_dev, shutil.disk_usage(path).free
+
+
+@dataclass
+class Plan:
+    order: List[str]  # resources to run, longest expected first
+    skipped: Dict[str, str] = field(default_factory=dict)  # resource id -> reason
+    estimates: Dict[str, Estimate] = field(default_factory=dict)
+    disks: Dict[int, Dict] = field(default_factory=dict)  # device -> path, free, available, planned
+    expected_duration: Optional[float] = None
+    refused: bool = False
+
+
+def fit(
+    order: List[str],
+    estimates: Dict[str, Estimate],
+    deps: Dict[str, List[str]],
+    destinations: Dict[str, Path],
+    settings: Settings,
+    max_parallel: int = 1,
+    filesystem_of: Callable[[Path], Tuple[Path, int, int]] = filesystem
+) -> Plan:
+    """
+    Choose the resources that fit on disk and in the time budget.
+
+    Disk space is handed out in configuration order, so earlier resources
+    win. Time is then filled longest-expected-first over ``max_parallel``
+    slots. Resources whose dependencies were skipped are skipped too.
+    Resources without an estimate always run.
+
+    Args:
+        order: Resource ids in configuration order
+        estimates: Resource id -> estimate
+        deps: Resource id -> ids it waits for
+        destinations: Resource id -> directory it writes to
+        settings: Reserve, margin, time budget and shortfall policy
+        max_parallel: Resources running at once
+        filesystem_of: Returns (path, device, free bytes) for a directory
+
+    Returns:
+        The plan; ``refused`` is set if anything was skipped and the policy
+        is to refuse
+    """
+    plan = Plan(order=[], estimates=estimates)
+    skipped = plan.skipped
+
+    def blocked(resource_id: str) -> Optional[str]:
+        return next((dep for dep in deps.get(resource_id, []) if dep in skipped), None)
+
+    for resource_id in order:
+        path, device, free = filesystem_of(destinations[resource_id])
+        disk = plan.disks.setdefault(device, {"path": path, "free": free,
+                                              "available": max(0, free - settings.reserve), "planned": 0})
+        dep = blocked(resource_id)
+        if dep:
+            skipped[resource_id] = f"depends on {dep}, which is skipped"
+            continue
+        size = estimates[resource_id].bytes
+        if size is None:
+            continue
+        needed = int(size * settings.margin)
+        if disk["planned"] + needed > disk["available"]:
+            left = max(0, disk["available"] - disk["planned"])
+            skipped[resource_id] = (f"needs {format_bytes(needed)}, only {format_bytes(left)} left on "
+                                    f"{disk['path']} above the {format_bytes(settings.reserve)} reserve")
+            continue
+        disk["planned"] += needed
+
+    kept = [resource_id for resource_id in order if resource_id not in skipped]
+    by_duration = sorted(kept, key=lambda r: -(estimates[r].duration or 0))
+    slots = [0.0] * max(1, max_parallel)
+    for resource_id in by_duration:
+        duration = estimates[resource_id].duration
+        if duration is None:
+            continue
+        slot = slots.index(min(slots))
+        if settings.max_duration is not None and slots[slot] + duration > settings.max_duration:
+            skipped[resource_id] = (f"expected to take {format_duration(duration)}, more than is left of the "
+                                    f"{format_duration(settings.max_duration)} time budget")
+            continue
+        slots[slot] += duration
+    plan.expected_duration = max(slots) if any(slots) else None
+
+    changed = True
+    while changed:
+        changed = False
+        for resource_id in kept:
+            dep = blocked(resource_id)
+            if resource_id not in skipped and dep:
+                skipped[resource_id] = f"depends on {dep}, which is skipped"
+                changed = True
+
+    plan.order = [resource_id for resource_id in by_duration if resource_id not in skipped]
+    plan.refused = bool(skipped) and settings.on_shortfall == REFUSE
+    return plan
+
+
+def report(plan: Plan, settings: Settings) -> List[str]:
+    """Human-readable lines describing a plan."""
+    lines = []
+    for resource_id, est in plan.estimates.items():
+        size = format_bytes(est.bytes) if est.bytes is not None else "unknown size"
+        took = f", ~{format_duration(est.duration)}" if est.duration is not None else ""
+        status = f"SKIP: {plan.skipped[resource_id]}" if resource_id in plan.skipped else "run"
+        lines.append(f"  {resource_id}: {size} ({est.source}){took} -> {status}")
+        if est.note:
+            lines.append(f"    note: {est.note}")
+    for disk in plan.disks.values():
+        lines.append(f"  {disk['path']}: {format_bytes(disk['free'])} free, "
+                     f"{format_bytes(disk['planned'])} planned, {format_bytes(settings.reserve)} reserved")
+    if plan.expected_duration is not None:
+        budget = (f" of {format_duration(settings.max_duration)} allowed"
+                  if settings.max_duration is not None else "")
+        lines.append(f"  Expected duration: {format_duration(plan.expected_duration)}{budget}")
+    return lines
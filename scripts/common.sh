@@ -27,6 +27,27 @@ log_error() {
     echo -e "${COLOR_RED}[ERROR]${COLOR_RESET} $1" >&2
 }
 
+# Report a point a failed run can resume from. auto_update.py hands the
+# last one to the next attempt in $EMERGENCY_STORAGE_CHECKPOINT.
+report_checkpoint() {
+    echo "CHECKPOINT: $1"
+}
+
+# Print the rate-limit options of rsync, curl or wget for the bandwidth share
+# (bytes per second) auto_update.py passes in $EMERGENCY_STORAGE_BANDWIDTH.
+# Prints nothing when there is no limit; use unquoted: rsync $(rate_limit_args rsync) ...
+rate_limit_args() {
+    local rate="${EMERGENCY_STORAGE_BANDWIDTH:-}"
+    if ! [[ "$rate" =~ ^[0-9]+$ ]] || [ "$rate" -eq 0 ]; then
+        return 0
+    fi
+    case "$1" in
+        rsync) echo "--bwlimit=$(( rate / 1024 > 0 ? rate / 1024 : 1 ))" ;;
+        curl) echo "--limit-rate $rate" ;;
+        wget) echo "--limit-rate=$rate" ;;
+    esac
+}
+
 # Function to validate drive path
 validate_drive_path() {
     local drive_path="$1"
@@ -4,17 +4,67 @@ Git Repositories Manager
 Part of EmergencyStorage - Clones and updates Git repositories in parallel
 
 This script reads a JSON file with a list of Git repository URLs and clones/updates them
-in parallel, logging any errors to gitlog.txt.
+in parallel, logging any errors to gitlog.txt. Log lines are written by a
+background thread (see log_writer.py), so workers never wait for the disk.
+
+Before pulling, the remote refs of every repository are listed with
+``git ls-remote`` and compared with the refs recorded after its last
+successful clone or update (githeads.json, next to gitlog.txt). Repositories
+whose upstream has not moved are not pulled at all.
+
+Repositories that declare a ``"family"`` share one object store with the
+other members of that family (see git_family.py).
+
+The duration, bytes and object count of every clone and update are kept in
+githistory.json; the next run submits the longest expected jobs first and
+can derive the number of workers from them (``--max-workers auto``).
+Every job is also recorded in the shared run history (see run_metrics.py).
+Concurrent jobs share the bandwidth budget of the auto-update configuration
+(see bandwidth.py): git has no rate-limit option, so its transfers are limited
+only if ``trickle`` is installed, while LFS objects are always throttled.
+
+With ``--bundle`` every cloned repository is also written to a full and then
+incremental ``git bundle`` snapshots for offline copies (see git_bundles.py).
+``--maintenance`` runs incremental repacks and commit-graph updates on a few
+repositories per run (see git_maintenance.py). Repositories with ``"lfs"``
+set also get their Git LFS objects, fetched in parallel (see git_lfs.py).
 """
 
 import json
+import math
 import os
+import statistics
 import sys
 import subprocess
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
+
+import log_writer
+from bandwidth import Governor
+from git_bundles import BundleError, BundleIndex, restore, snapshot
+import git_lfs
+from git_family import FamilyError, FamilyStore, family_of
+from git_maintenance import maintain, select_repositories
+from run_metrics import MetricsStore, export_textfile, open_store
+from state_store import atomic_write_json, load_json_state
+from stream_runner import WatchdogPolicy, format_bytes, parse_size, run_streaming
+
+
+HEADS_FILE = "githeads.json"  # remote refs recorded after each successful clone/update
+HISTORY_FILE = "githistory.json"  # duration, bytes and objects of the last clone/update
+DEFAULT_WORKERS = 4
+MAX_SUGGESTED_WORKERS = 16
+BUNDLE_DIR = ".bundles"  # default bundle directory inside the destination
+MAINTENANCE_FILE = "gitmaintenance.json"  # what the maintenance stage did, per repository
+DEFAULT_MAINTENANCE_REPOS = 5
+DEFAULT_MAINTENANCE_TIME = 600  # seconds
+LS_REMOTE_TIMEOUT = 60  # seconds for listing the refs of one remote
+TRACKED_REFS = ("HEAD", "refs/heads/", "refs/tags/")  # refs that a pull can bring in
+PARTIAL_FILTERS = {"blobless": "blob:none", "treeless": "tree:0"}
 
 
 def load_repositories(config_path: Path) -> Dict:
@@ -24,16 +74,13 @@ def load_repositories(config_path: Path) -> Dict:
 
 
 def save_repositories(config_path: Path, config: Dict):
-    """Save the Git repositories configuration."""
-    with open(config_path, 'w') as f:
-        json.dump(config, f, indent=2)
+    """Save the Git repositories configuration atomically."""
+    atomic_write_json(config_path, config)
 
 
 def log_to_file(log_path: Path, message: str):
-    """Append a message to the log file."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(log_path, 'a') as f:
-        f.write(f"[{timestamp}] {message}\n")
+    """Queue a message for the log file; it is written by a background thread."""
+    log_writer.get_writer(log_path).write(message)
 
 
 def repo_exists(dest_dir: Path, repo_name: str) -> bool:
@@ -43,14 +90,196 @@ def repo_exists(dest_dir: Path, repo_name: str) -> bool:
     return repo_path.exists() and git_dir.exists() and git_dir.is_dir()
 
 
-def clone_repository(repo_info: Dict, dest_dir: Path, log_path: Path) -> Tuple[bool, str, str]:
+def verify_args(repo_info: Dict) -> List[str]:
+    """
+    Git options that check every received object while it is written.
+    
+    Git names objects by their hash and recomputes it while indexing a pack;
+    with ``"verify": true`` received objects are additionally fsck-checked
+    during the transfer, so no separate verification pass is needed.
+    """
+    if repo_info.get("verify", False):
+        return ["-c", "transfer.fsckObjects=true"]
+    return []
+
+
+def sync_family(repo_info: Dict, dest_dir: Path, log_path: Path,
+                governor: Optional[Governor] = None) -> Optional[FamilyStore]:
+    """
+    Fetch a family member's refs into the family's shared object store.
+    
+    Failures are logged as warnings only; the member is then cloned or
+    pulled on its own as if it had no family.
+    
+    Args:
+        repo_info: Repository configuration
+        dest_dir: Destination directory for repositories
+        log_path: Path to the log file
+        governor: Optional bandwidth governor limiting the fetch
+        
+    Returns:
+        The family store, or None if the repository has no usable family
+    """
+    url = repo_info.get("url", "")
+    name = repo_info.get("name", "")
+    try:
+        family = family_of(repo_info)
+    except FamilyError as e:
+        log_to_file(log_path, f"WARNING: {url} - {e}, using an independent clone")
+        return None
+    if family is None:
+        return None
+    
+    store = FamilyStore(dest_dir, family)
+    try:
+        with store.lock:
+            store.ensure()
+            command = store.fetch_command(name, url, verify_args(repo_info))
+            result = run_streaming(governor.command(command) if governor else command,
+                                   label=f"{family}/{name}",
+                                   watchdog=WatchdogPolicy.from_config(repo_info.get("watchdog")))
+    except (OSError, subprocess.CalledProcessError) as e:
+        log_to_file(log_path, f"WARNING: {url} - Could not prepare family store '{family}': {e}")
+        return None
+    if result.returncode != 0:
+        reason = result.abort_reason or result.output.strip() or f"return code {result.returncode}"
+        log_to_file(log_path, f"WARNING: {url} - Family store fetch failed: {reason}")
+        return None
+    log_to_file(log_path, f"INFO: Fetched {name} into family store '{family}' ({result.summary()})")
+    return store
+
+
+def size_args(repo_info: Dict) -> List[str]:
+    """
+    Clone arguments for the size options of a repository.
+    
+    ``"partial"`` makes a blobless (``blob:none``) or treeless (``tree:0``)
+    partial clone, or passes any other value as a raw ``--filter`` spec.
+    ``"sparse"`` checks out only the listed directories. ``"deepen": N``
+    starts with the last N commits; every later run fetches N more.
+    
+    Raises:
+        ValueError: If an option has an invalid value
+    """
+    args = []
+    partial = repo_info.get("partial")
+    if partial:
+        if not isinstance(partial, str):
+            raise ValueError(f"Invalid partial clone filter {partial!r}")
+        args.append(f"--filter={PARTIAL_FILTERS.get(partial, partial)}")
+    if sparse_paths(repo_info):
+        args.append("--sparse")
+    deepen = deepen_step(repo_info)
+    if deepen:
+        args += ["--depth", str(deepen)]
+    return args
+
+
+def sparse_paths(repo_info: Dict) -> List[str]:
+    """Directories to check out for a sparse repository (empty: everything)."""
+    paths = repo_info.get("sparse", [])
+    if not isinstance(paths, list) or not all(isinstance(path, str) and path for path in paths):
+        raise ValueError("sparse must be a list of directory paths")
+    return paths
+
+
+def deepen_step(repo_info: Dict) -> int:
+    """Commits fetched per run in progressive mode (0: not progressive)."""
+    step = repo_info.get("deepen", 0)
+    if isinstance(step, bool) or not isinstance(step, int) or step < 0:
+        raise ValueError(f"deepen must be a positive number of commits, not {step!r}")
+    return step
+
+
+def is_shallow(repo_path: Path) -> bool:
+    """True while a repository's history is still cut off."""
+    return (repo_path / ".git" / "shallow").exists()
+
+
+def apply_sparse(repo_info: Dict, repo_path: Path):
+    """(Re)apply the configured sparse-checkout directories."""
+    paths = sparse_paths(repo_info)
+    if paths:
+        subprocess.run(["git", "-C", str(repo_path), "sparse-checkout", "set", "--"] + paths,
+                       check=True, capture_output=True, text=True)
+
+
+def deepen_repository(repo_info: Dict, repo_path: Path, log_path: Path,
+                      governor: Optional[Governor] = None):
+    """
+    Fetch the next increment of history for a progressive repository.
+    
+    Each increment is kept once fetched, so a run cut short by the watchdog
+    loses at most the increment in flight. Once the full history is present
+    git removes the shallow marker and nothing more is done.
+    """
+    step = deepen_step(repo_info)
+    if not step or not is_shallow(repo_path):
+        return
+    url = repo_info.get("url", "")
+    name = repo_info.get("name", "")
+    command = (["git", "-C", str(repo_path)] + verify_args(repo_info)
+               + ["fetch", "--progress", f"--deepen={step}"])
+    if governor:
+        command = governor.command(command)
+    result = run_streaming(command, label=f"{name} (deepen)",
+                           watchdog=WatchdogPolicy.from_config(repo_info.get("watchdog")))
+    if result.returncode != 0:
+        reason = result.abort_reason or result.output.strip() or f"return code {result.returncode}"
+        log_to_file(log_path, f"WARNING: {url} - Deepening stopped, kept the history fetched so far: {reason}")
+    elif is_shallow(repo_path):
+        log_to_file(log_path, f"INFO: Deepened {name} by {step} commits ({result.summary()})")
+    else:
+        log_to_file(log_path, f"INFO: {name} now has its full history")
+
+
+def sync_lfs(repo_info: Dict, repo_path: Path, log_path: Path,
+             governor: Optional[Governor] = None) -> Optional[str]:
+    """
+    Fetch the missing Git LFS objects of a repository that has ``"lfs"`` set.
+    
+    Args:
+        repo_info: Repository configuration
+        repo_path: Cloned repository
+        log_path: Path to the log file
+        governor: Optional bandwidth governor throttling the object downloads
+        
+    Returns:
+        Error message if objects are missing afterwards, else None
+    """
+    options = git_lfs.LFSOptions.from_config(repo_info.get("lfs"))
+    if options is None:
+        return None
+    url = repo_info.get("url", "")
+    name = repo_info.get("name", "")
+    try:
+        result = git_lfs.fetch(repo_path, url, options, sparse_paths(repo_info) or None,
+                               governor.throttle() if governor else None)
+    except (git_lfs.LFSError, subprocess.CalledProcessError) as e:
+        return f"LFS fetch failed: {e}"
+    for oid, reason in result.failed:
+        log_to_file(log_path, f"ERROR: {url} - LFS object {oid} failed: {reason}")
+    if result.failed:
+        return f"LFS fetch incomplete: {result.summary()}"
+    log_to_file(log_path, f"INFO: LFS objects of {name}: {result.summary()} ({format_bytes(result.bytes)})")
+    if result.fetched and not git_lfs.checkout(repo_path):
+        log_to_file(log_path, f"INFO: git-lfs is not installed; {name} keeps pointer files, "
+                              f"objects are in .git/lfs/objects")
+    return None
+
+
+def clone_repository(repo_info: Dict, dest_dir: Path, log_path: Path,
+                     stats: Optional[Dict] = None,
+                     governor: Optional[Governor] = None) -> Tuple[bool, str, str]:
     """
     Clone a Git repository.
     
     Args:
-        repo_info: Dictionary containing url, name, clone_args, enabled
+        repo_info: Dictionary containing url, name, clone_args, enabled, watchdog, verify
         dest_dir: Destination directory for cloning
         log_path: Path to the log file
+        stats: Optional dict that receives the bytes and objects transferred
+        governor: Optional bandwidth governor limiting the transfer
         
     Returns:
         Tuple of (success, repo_url, error_message)
@@ -69,32 +298,44 @@ def clone_repository(repo_info: Dict, dest_dir: Path, log_path: Path) -> Tuple[b
         return (False, url, error_msg)
     
     try:
-        # Build the clone command
-        command = ["git", "clone"] + clone_args + [url, str(dest_dir / name)]
+        # Family members borrow the objects already fetched into the shared store
+        store = sync_family(repo_info, dest_dir, log_path, governor)
+        family_args = store.clone_args() if store else []
+        
+        # Build the clone command; --progress makes git report progress without a tty
+        command = (["git"] + verify_args(repo_info) + ["clone", "--progress"] + family_args
+                   + size_args(repo_info) + clone_args + [url, str(dest_dir / name)])
+        if governor:
+            command = governor.command(command)
         
         print(f"  Cloning: {url}")
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=600  # 10 minute timeout for clone
-        )
-        
-        if result.returncode == 0:
-            print(f"  ✓ Successfully cloned: {name}")
-            log_to_file(log_path, f"SUCCESS: Cloned {url} to {name}")
+        # Killed only when the transfer stalls, so large clones are never cut short
+        result = run_streaming(command, label=name,
+                               watchdog=WatchdogPolicy.from_config(repo_info.get("watchdog")))
+        if stats is not None:
+            stats.update(bytes=result.bytes_transferred, objects=result.objects)
+        
+        if result.timed_out:
+            error_msg = f"Clone operation aborted: {result.abort_reason}"
+            print(f"  ✗ Stalled: {name}")
+            log_to_file(log_path, f"ERROR: {url} - {error_msg}")
+            return (False, url, error_msg)
+        elif result.returncode == 0:
+            apply_sparse(repo_info, dest_dir / name)
+            lfs_error = sync_lfs(repo_info, dest_dir / name, log_path, governor)
+            if lfs_error:
+                print(f"  ✗ Cloned without all LFS objects: {name} - {lfs_error}")
+                log_to_file(log_path, f"ERROR: {url} - {lfs_error}")
+                return (False, url, lfs_error)
+            print(f"  ✓ Successfully cloned: {name} ({result.summary()})")
+            log_to_file(log_path, f"SUCCESS: Cloned {url} to {name} ({result.summary()})")
             return (True, url, "")
         else:
-            error_msg = result.stderr.strip() if result.stderr else f"Clone failed with return code {result.returncode}"
+            error_msg = result.output.strip() or f"Clone failed with return code {result.returncode}"
             print(f"  ✗ Failed to clone: {name} - {error_msg[:100]}")
             log_to_file(log_path, f"ERROR: Failed to clone {url} - {error_msg}")
             return (False, url, error_msg)
             
-    except subprocess.TimeoutExpired:
-        error_msg = "Clone operation timed out after 10 minutes"
-        print(f"  ✗ Timeout: {name}")
-        log_to_file(log_path, f"ERROR: {url} - {error_msg}")
-        return (False, url, error_msg)
     except Exception as e:
         error_msg = str(e)
         print(f"  ✗ Error cloning {name}: {error_msg}")
@@ -102,14 +343,18 @@ def clone_repository(repo_info: Dict, dest_dir: Path, log_path: Path) -> Tuple[b
         return (False, url, error_msg)
 
 
-def update_repository(repo_info: Dict, dest_dir: Path, log_path: Path) -> Tuple[bool, str, str]:
+def update_repository(repo_info: Dict, dest_dir: Path, log_path: Path,
+                      stats: Optional[Dict] = None,
+                      governor: Optional[Governor] = None) -> Tuple[bool, str, str]:
     """
     Update (pull) a Git repository.
     
     Args:
-        repo_info: Dictionary containing url, name, clone_args, enabled
+        repo_info: Dictionary containing url, name, clone_args, enabled, watchdog, verify
         dest_dir: Destination directory containing repositories
         log_path: Path to the log file
+        stats: Optional dict that receives the bytes and objects transferred
+        governor: Optional bandwidth governor limiting the transfer
         
     Returns:
         Tuple of (success, repo_url, error_message)
@@ -135,32 +380,47 @@ def update_repository(repo_info: Dict, dest_dir: Path, log_path: Path) -> Tuple[
         return (False, url, error_msg)
     
     try:
+        # Objects already fetched into the family store are not transferred again
+        store = sync_family(repo_info, dest_dir, log_path, governor)
+        if store and not store.is_member(repo_path):
+            log_to_file(log_path, f"INFO: {name} was cloned before joining family '{store.family}'; "
+                                  f"re-clone it to share objects")
+        
+        # Pick up changes to the sparse-checkout directories
+        apply_sparse(repo_info, repo_path)
+        
         # Run git pull
-        command = ["git", "-C", str(repo_path), "pull"]
+        command = ["git", "-C", str(repo_path)] + verify_args(repo_info) + ["pull", "--progress"]
+        if governor:
+            command = governor.command(command)
         
         print(f"  Updating: {url}")
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minute timeout for pull
-        )
-        
-        if result.returncode == 0:
-            print(f"  ✓ Successfully updated: {name}")
-            log_to_file(log_path, f"SUCCESS: Updated {url} ({name})")
+        result = run_streaming(command, label=name,
+                               watchdog=WatchdogPolicy.from_config(repo_info.get("watchdog")))
+        if stats is not None:
+            stats.update(bytes=result.bytes_transferred, objects=result.objects)
+        
+        if result.timed_out:
+            error_msg = f"Pull operation aborted: {result.abort_reason}"
+            print(f"  ✗ Stalled: {name}")
+            log_to_file(log_path, f"ERROR: {url} - {error_msg}")
+            return (False, url, error_msg)
+        elif result.returncode == 0:
+            deepen_repository(repo_info, repo_path, log_path, governor)
+            lfs_error = sync_lfs(repo_info, repo_path, log_path, governor)
+            if lfs_error:
+                print(f"  ✗ Updated without all LFS objects: {name} - {lfs_error}")
+                log_to_file(log_path, f"ERROR: {url} - {lfs_error}")
+                return (False, url, lfs_error)
+            print(f"  ✓ Successfully updated: {name} ({result.summary()})")
+            log_to_file(log_path, f"SUCCESS: Updated {url} ({name}) ({result.summary()})")
             return (True, url, "")
         else:
-            error_msg = result.stderr.strip() if result.stderr else f"Pull failed with return code {result.returncode}"
+            error_msg = result.output.strip() or f"Pull failed with return code {result.returncode}"
             print(f"  ✗ Failed to update: {name} - {error_msg[:100]}")
             log_to_file(log_path, f"ERROR: Failed to update {url} - {error_msg}")
             return (False, url, error_msg)
             
-    except subprocess.TimeoutExpired:
-        error_msg = "Pull operation timed out after 5 minutes"
-        print(f"  ✗ Timeout: {name}")
-        log_to_file(log_path, f"ERROR: {url} - {error_msg}")
-        return (False, url, error_msg)
     except Exception as e:
         error_msg = str(e)
         print(f"  ✗ Error updating {name}: {error_msg}")
@@ -168,19 +428,244 @@ def update_repository(repo_info: Dict, dest_dir: Path, log_path: Path) -> Tuple[
         return (False, url, error_msg)
 
 
+def heads_path(log_path: Path) -> Path:
+    """Return the recorded-heads state file kept next to the log file."""
+    return log_path.with_name(HEADS_FILE)
+
+
+def history_path(log_path: Path) -> Path:
+    """Return the run-history file kept next to the log file."""
+    return log_path.with_name(HISTORY_FILE)
+
+
+def remote_refs(url: str) -> Optional[Dict[str, str]]:
+    """
+    List the branch and tag heads of a remote without fetching anything.
+    
+    Args:
+        url: Repository URL
+        
+    Returns:
+        Mapping of ref name to object id, or None if the remote can't be listed
+    """
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    try:
+        result = subprocess.run(["git", "ls-remote", url], capture_output=True, text=True,
+                                timeout=LS_REMOTE_TIMEOUT, stdin=subprocess.DEVNULL, env=env)
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+    if result.returncode != 0:
+        return None
+    refs = {}
+    for line in result.stdout.splitlines():
+        sha, _, ref = line.partition("\t")
+        if ref.startswith(TRACKED_REFS):
+            refs[ref] = sha
+    return refs
+
+
+def still_deepening(repo_info: Dict, repo_path: Path) -> bool:
+    """True for a progressive repository whose history is not complete yet."""
+    return bool(repo_info.get("deepen")) and is_shallow(repo_path)
+
+
+def detect_remote_changes(plan: List[Tuple[Dict, str, str]], heads: Dict, dest_dir: Path,
+                          max_workers: int = 4, skip_unchanged: bool = True) -> Tuple[List[Tuple[Dict, str, str]], Dict[str, Dict[str, str]]]:
+    """
+    Drop updates of repositories whose remote refs haven't moved.
+    
+    The refs of every repository about to be cloned or updated are listed
+    concurrently. An update is skipped when the listing matches what was
+    recorded after the last success for the same URL; repositories without
+    a record, whose remote can't be listed, or that are still being deepened
+    are updated as planned.
+    
+    Args:
+        plan: Output of plan_repositories()
+        heads: Recorded state, name -> {"url": ..., "refs": {...}}
+        dest_dir: Destination directory for repositories
+        max_workers: Number of concurrent ls-remote calls
+        skip_unchanged: If False, only list the refs and keep the plan as is
+        
+    Returns:
+        Tuple of (revised plan, listed refs by repository name)
+    """
+    targets = [repo_info for repo_info, action, _ in plan if action != "skip"]
+    if not targets:
+        return plan, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = executor.map(lambda repo_info: remote_refs(repo_info.get("url", "")), targets)
+        refs_by_name = {repo_info.get("name", ""): refs for repo_info, refs in zip(targets, listings)}
+    
+    revised = []
+    for repo_info, action, reason in plan:
+        name = repo_info.get("name", "")
+        refs = refs_by_name.get(name)
+        recorded = heads.get(name, {})
+        if (skip_unchanged and action == "update" and refs is not None and recorded.get("url") == repo_info.get("url")
+                and recorded.get("refs") == refs and not still_deepening(repo_info, dest_dir / name)):
+            revised.append((repo_info, "skip", "unchanged upstream"))
+        else:
+            revised.append((repo_info, action, reason))
+    return revised, {name: refs for name, refs in refs_by_name.items() if refs is not None}
+
+
+class RunHistory:
+    """
+    Per-repository record of the last clone and the last update.
+    
+    Each record holds the wall-clock duration of the whole job, the bytes and
+    objects received and the outcome. Workers record concurrently; the file
+    is written once at the end of a run.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.data: Dict[str, Dict[str, Dict]] = load_json_state(path, {})
+        self._lock = threading.Lock()
+    
+    def record(self, name: str, action: str, duration: float, success: bool, stats: Dict):
+        with self._lock:
+            self.data.setdefault(name, {})[action] = {
+                "duration": round(duration, 3),
+                "bytes": stats.get("bytes"),
+                "objects": stats.get("objects"),
+                "outcome": "success" if success else "failed",
+                "finished": datetime.now().isoformat(timespec="seconds"),
+            }
+    
+    def expected(self, name: str, action: str) -> Optional[float]:
+        """Expected duration of a job; the other action's time is a fallback."""
+        records = self.data.get(name, {})
+        record = records.get(action) or records.get("update" if action == "clone" else "clone")
+        return record["duration"] if record else None
+    
+    def save(self):
+        with self._lock:
+            atomic_write_json(self.path, self.data)
+
+
+def schedule_jobs(jobs: List[Tuple[Dict, str]], history: RunHistory) -> List[Tuple[Dict, str, float]]:
+    """
+    Order jobs longest-expected-first.
+    
+    Starting the long jobs first keeps one giant repository from running
+    alone after everything else has finished. Jobs without history are
+    assumed to take the median of the known ones; ties keep config order.
+    
+    Returns:
+        List of (repo_info, action, expected seconds)
+    """
+    expected = [history.expected(repo_info.get("name", ""), action) for repo_info, action in jobs]
+    known = [value for value in expected if value is not None]
+    fallback = statistics.median(known) if known else 0.0
+    scheduled = [(repo_info, action, fallback if value is None else value)
+                 for (repo_info, action), value in zip(jobs, expected)]
+    return sorted(scheduled, key=lambda job: -job[2])
+
+
+def suggest_workers(estimates: List[float]) -> Optional[int]:
+    """
+    Smallest worker count at which the longest job alone bounds the run.
+    
+    With longest-first scheduling the run takes at least as long as the
+    longest job and about total/workers; more workers than total/longest
+    cannot make it shorter.
+    """
+    longest = max(estimates, default=0.0)
+    if longest <= 0:
+        return None
+    return max(1, min(len(estimates), MAX_SUGGESTED_WORKERS, math.ceil(sum(estimates) / longest)))
+
+
+# Functions carrying out each planned action
+ACTIONS = {"clone": clone_repository, "update": update_repository}
+
+
+def run_job(action: str, repo_info: Dict, dest_dir: Path, log_path: Path,
+            history: RunHistory, metrics: Optional[MetricsStore] = None,
+            governor: Optional[Governor] = None) -> Tuple[bool, str, str]:
+    """Run one planned action and record its duration and transfer in the history."""
+    stats: Dict = {}
+    started = time.monotonic()
+    try:
+        success, url, error_msg = ACTIONS[action](repo_info, dest_dir, log_path, stats, governor)
+    finally:
+        # The jobs still to run share what this one used
+        if governor:
+            governor.unregister()
+    duration = time.monotonic() - started
+    history.record(repo_info.get("name", ""), action, duration, success, stats)
+    if metrics is not None:
+        metrics.record(repo_info.get("name", ""), "success" if success else "failed", duration,
+                       stats.get("bytes"), action=action, detail=None if success else error_msg[:500])
+    return success, url, error_msg
+
+
+OPERATION_LABELS = {"clone": "clone", "update": "update", "both": "clone-or-update"}
+
+
+def plan_repositories(repositories: List[Dict], dest_dir: Path,
+                      operation: str = "both") -> List[Tuple[Dict, str, str]]:
+    """
+    Assign every repository exactly one action in a single pass.
+    
+    Missing repositories are cloned and existing ones updated, as far as
+    ``operation`` allows; a repository cloned in this run is never pulled
+    again right afterwards.
+    
+    Args:
+        repositories: Repository entries from the configuration
+        dest_dir: Destination directory for repositories
+        operation: "clone", "update" or "both"
+        
+    Returns:
+        List of (repo_info, action, reason) with action "clone", "update" or "skip"
+    """
+    plan = []
+    seen = set()
+    for repo_info in repositories:
+        name = repo_info.get("name", "")
+        if not repo_info.get("enabled", True):
+            plan.append((repo_info, "skip", "disabled"))
+            continue
+        if name and name in seen:
+            plan.append((repo_info, "skip", "duplicate name"))
+            continue
+        seen.add(name)
+        
+        if name and repo_exists(dest_dir, name):
+            if operation == "clone":
+                plan.append((repo_info, "skip", "already exists"))
+            else:
+                plan.append((repo_info, "update", ""))
+        elif operation == "update":
+            plan.append((repo_info, "skip", "not cloned yet"))
+        else:
+            plan.append((repo_info, "clone", ""))
+    return plan
+
+
 def process_repositories(config_path: Path, dest_dir: Path, log_path: Path, 
-                         operation: str = "clone", max_workers: int = 4, dry_run: bool = False):
+                         operation: str = "both", max_workers: Optional[int] = DEFAULT_WORKERS,
+                         dry_run: bool = False, check_remote: bool = True):
     """
     Process Git repositories in parallel.
     
+    Every repository gets one planned action (clone, update or skip) and all
+    clones and updates run in the same worker pool.
+    
     Args:
         config_path: Path to the Git repositories JSON configuration
         dest_dir: Destination directory for repositories
         log_path: Path to the log file
-        operation: Either "clone" or "update"
-        max_workers: Maximum number of parallel workers
+        operation: "clone", "update" or "both"
+        max_workers: Maximum number of parallel workers, or None to use the
+            number suggested by the run history
         dry_run: If True, only show what would be done
+        check_remote: Skip updates of repositories whose remote refs are unchanged
     """
+    label = OPERATION_LABELS[operation]
     try:
         # Load configuration
         config = load_repositories(config_path)
@@ -192,79 +677,94 @@ def process_repositories(config_path: Path, dest_dir: Path, log_path: Path,
         
         # Initialize log file
         if not dry_run:
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            log_path.parent.mkdir(parents=True, exist_ok=True)
             log_to_file(log_path, f"{'='*60}")
-            log_to_file(log_path, f"Starting {operation} operation")
+            log_to_file(log_path, f"Starting {label} operation")
             log_to_file(log_path, f"{'='*60}")
         
         print(f"Found {len(repositories)} repository/repositories")
-        print(f"Operation: {operation}")
+        print(f"Operation: {label}")
         print(f"Destination: {dest_dir}")
         print(f"Log file: {log_path}")
-        print(f"Max parallel workers: {max_workers}")
+        print(f"Max parallel workers: {max_workers or 'auto'}")
         print()
         
+        plan = plan_repositories(repositories, dest_dir, operation)
+        
         if dry_run:
             print("[DRY RUN] Would process the following repositories:")
-            for repo_info in repositories:
-                if repo_info.get("enabled", True):
-                    print(f"  - {repo_info.get('name', 'unknown')}: {repo_info.get('url', 'unknown')}")
+            for repo_info, action, reason in plan:
+                if reason != "disabled":
+                    detail = f" ({reason})" if reason else ""
+                    print(f"  - {action}{detail} {repo_info.get('name', 'unknown')}: "
+                          f"{repo_info.get('url', 'unknown')}")
             return
         
-        # Create destination directory if it doesn't exist
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Determine which operation to perform
-        if operation == "clone":
-            # Filter out repositories that already exist
-            repos_to_process = []
-            for repo_info in repositories:
-                if not repo_info.get("enabled", True):
-                    continue
-                name = repo_info.get("name", "")
-                if repo_exists(dest_dir, name):
-                    print(f"  Skipping (already exists): {name}")
-                    log_to_file(log_path, f"INFO: Skipping {repo_info.get('url', '')} - already exists")
-                else:
-                    repos_to_process.append(repo_info)
-            operation_func = clone_repository
-        else:  # update
-            # Only update repositories that exist
-            repos_to_process = []
-            for repo_info in repositories:
-                if not repo_info.get("enabled", True):
-                    continue
-                name = repo_info.get("name", "")
-                if repo_exists(dest_dir, name):
-                    repos_to_process.append(repo_info)
-                else:
-                    print(f"  Skipping (not cloned yet): {name}")
-                    log_to_file(log_path, f"INFO: Skipping {repo_info.get('url', '')} - not cloned yet")
-            operation_func = update_repository
+        heads = load_json_state(heads_path(log_path), {})
+        plan, listed = detect_remote_changes(plan, heads, dest_dir, max_workers or DEFAULT_WORKERS,
+                                             skip_unchanged=check_remote)
         
-        if not repos_to_process:
-            print(f"No repositories to {operation}")
+        jobs = []
+        for repo_info, action, reason in plan:
+            if action != "skip":
+                jobs.append((repo_info, action))
+            elif reason != "disabled":
+                print(f"  Skipping ({reason}): {repo_info.get('name', '')}")
+                log_to_file(log_path, f"INFO: Skipping {repo_info.get('url', '')} - {reason}")
+        
+        if not jobs:
+            print(f"No repositories to {label}")
             return
         
-        print(f"Processing {len(repos_to_process)} repositories in parallel...")
+        history = RunHistory(history_path(log_path))
+        scheduled = schedule_jobs(jobs, history)
+        suggested = suggest_workers([expected for _, _, expected in scheduled])
+        if suggested:
+            print(f"Suggested --max-workers from run history: {suggested} "
+                  f"(longest job ~{scheduled[0][2]:.0f}s, all jobs ~{sum(job[2] for job in scheduled):.0f}s)")
+        if max_workers is None:
+            max_workers = suggested or DEFAULT_WORKERS
+            print(f"Using {max_workers} worker(s)")
+        
+        # Concurrent jobs share the bandwidth budget equally
+        governor = Governor.from_environment(min(max_workers, len(jobs)))
+        governor.register(len(jobs))
+        if governor.limit():
+            print(f"Bandwidth: {governor.describe()}")
+        
+        clones = sum(1 for _, action in jobs if action == "clone")
+        print(f"Processing {len(jobs)} repositories in parallel "
+              f"({clones} to clone, {len(jobs) - clones} to update)...")
         print()
         
         # Process repositories in parallel
         success_count = 0
         failed_count = 0
         errors = []
+        metrics = open_store("git_repos")
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             # Submit all tasks
+            # Longest expected jobs first; the pool starts them in submission order
             future_to_repo = {
-                executor.submit(operation_func, repo_info, dest_dir, log_path): repo_info
-                for repo_info in repos_to_process
+                executor.submit(run_job, action, repo_info, dest_dir, log_path, history, metrics,
+                                governor): repo_info
+                for repo_info, action, _ in scheduled
             }
             
             # Process completed tasks
             for future in as_completed(future_to_repo):
                 success, url, error_msg = future.result()
+                name = future_to_repo[future].get("name", "")
                 if success:
                     success_count += 1
+                    # Refs were listed before the job ran, so an upstream change
+                    # during the job is picked up next time rather than missed
+                    if name in listed:
+                        heads[name] = {"url": url, "refs": listed[name]}
+                    else:
+                        heads.pop(name, None)
                 else:
                     failed_count += 1
                     errors.append((url, error_msg))
@@ -272,11 +772,11 @@ def process_repositories(config_path: Path, dest_dir: Path, log_path: Path,
         # Summary
         print()
         print("="*60)
-        print(f"{operation.capitalize()} Operation Summary")
+        print(f"{label.capitalize()} Operation Summary")
         print("="*60)
         print(f"  Successful: {success_count}")
         print(f"  Failed: {failed_count}")
-        print(f"  Total processed: {len(repos_to_process)}")
+        print(f"  Total processed: {len(jobs)}")
         print()
         
         if errors:
@@ -285,6 +785,10 @@ def process_repositories(config_path: Path, dest_dir: Path, log_path: Path,
                 print(f"  ✗ {url}")
                 print(f"    Error: {error_msg[:200]}")
         
+        atomic_write_json(heads_path(log_path), heads)
+        history.save()
+        export_textfile(metrics)
+        
         # Log summary
         if not dry_run:
             log_to_file(log_path, f"{'='*60}")
@@ -304,6 +808,111 @@ def process_repositories(config_path: Path, dest_dir: Path, log_path: Path,
         sys.exit(1)
 
 
+def snapshot_repositories(config_path: Path, dest_dir: Path, bundle_dir: Path, log_path: Path,
+                          full: bool = False):
+    """
+    Write the next bundle snapshot of every cloned repository.
+    
+    Bundles are written one repository at a time, so the archive drive sees
+    sequential writes. The index is saved after every repository.
+    
+    Args:
+        config_path: Path to the Git repositories JSON configuration
+        dest_dir: Directory containing the cloned repositories
+        bundle_dir: Directory holding the bundles and index.json
+        log_path: Path to the log file
+        full: Start a new full bundle chain for every repository
+    """
+    repositories = load_repositories(config_path).get("repositories", [])
+    index = BundleIndex(bundle_dir)
+    counts = {"full": 0, "incremental": 0, "unchanged": 0, "failed": 0}
+    
+    print()
+    print(f"Writing bundle snapshots to {bundle_dir}...")
+    for repo_info in repositories:
+        name = repo_info.get("name", "")
+        url = repo_info.get("url", "")
+        if not repo_info.get("enabled", True) or not name or not repo_exists(dest_dir, name):
+            continue
+        try:
+            kind, path = snapshot(dest_dir / name, name, url, index, full)
+        except BundleError as e:
+            counts["failed"] += 1
+            print(f"  ✗ Bundle failed: {name} - {e}")
+            log_to_file(log_path, f"ERROR: Failed to bundle {url} - {e}")
+            continue
+        counts[kind] += 1
+        if path:
+            size = index.repositories[name]["bundles"][-1]["size"]
+            print(f"  ✓ {kind.capitalize()} bundle: {name} ({format_bytes(size)})")
+            log_to_file(log_path, f"SUCCESS: Wrote {kind} bundle of {name} to {path}")
+        index.save()
+    
+    print(f"Bundles: {counts['full']} full, {counts['incremental']} incremental, "
+          f"{counts['unchanged']} unchanged, {counts['failed']} failed")
+    index.save()
+
+
+def maintain_repositories(config_path: Path, dest_dir: Path, log_path: Path,
+                          budget: int = DEFAULT_MAINTENANCE_REPOS,
+                          time_box: float = DEFAULT_MAINTENANCE_TIME):
+    """
+    Run maintenance on the repositories that waited longest for it.
+    
+    At most ``budget`` repositories are maintained, one at a time, and work
+    stops when ``time_box`` seconds are used up; the remaining repositories
+    come first next time. What was done is recorded in gitmaintenance.json.
+    
+    Args:
+        config_path: Path to the Git repositories JSON configuration
+        dest_dir: Directory containing the cloned repositories
+        log_path: Path to the log file
+        budget: Maximum number of repositories per run
+        time_box: Maximum seconds for the whole stage
+    """
+    repositories = load_repositories(config_path).get("repositories", [])
+    names = [repo_info.get("name", "") for repo_info in repositories
+             if repo_info.get("enabled", True) and repo_info.get("name") and repo_exists(dest_dir, repo_info["name"])]
+    state_path = log_path.with_name(MAINTENANCE_FILE)
+    state = load_json_state(state_path, {})
+    selected = select_repositories(list(dict.fromkeys(names)), state, budget)
+    if not selected:
+        return
+    
+    print()
+    print(f"Maintaining {len(selected)} of {len(names)} repositories (time box {time_box:.0f}s)...")
+    deadline = time.monotonic() + time_box
+    for name in selected:
+        if time.monotonic() >= deadline:
+            print("  Time box used up; the rest is maintained next run")
+            log_to_file(log_path, "INFO: Maintenance time box used up")
+            break
+        record = maintain(dest_dir / name, deadline)
+        state[name] = record
+        atomic_write_json(state_path, state)
+        summary = (f"{', '.join(record['steps']) or 'no steps'}; loose objects {record['loose_before']} -> "
+                   f"{record['loose_after']}, packs {record['packs_before']} -> {record['packs_after']}")
+        if record["outcome"] == "success":
+            print(f"  ✓ Maintained: {name} ({summary})")
+            log_to_file(log_path, f"SUCCESS: Maintained {name} ({summary})")
+        elif record["outcome"] == "failed":
+            print(f"  ✗ Maintenance failed: {name} - {record['error'][:100]}")
+            log_to_file(log_path, f"ERROR: Maintenance of {name} failed - {record['error']}")
+        else:
+            print(f"  Stopped maintenance of {name}: {record['outcome']} ({summary})")
+            log_to_file(log_path, f"WARNING: Maintenance of {name} stopped: {record['outcome']} ({summary})")
+
+
+def workers_arg(value: str) -> Optional[int]:
+    """Parse --max-workers: a positive number or 'auto' (None)."""
+    if value == "auto":
+        return None
+    workers = int(value)
+    if workers < 1:
+        raise ValueError(value)
+    return workers
+
+
 def main():
     """Main execution function"""
     import argparse
@@ -338,15 +947,82 @@ def main():
     )
     parser.add_argument(
         "--max-workers",
-        type=int,
-        default=4,
-        help="Maximum number of parallel workers (default: 4)"
+        type=workers_arg,
+        default=DEFAULT_WORKERS,
+        help=f"Maximum number of parallel workers, or 'auto' to use the number suggested "
+             f"by the run history (default: {DEFAULT_WORKERS})"
     )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         help="Show what would be done without actually doing it"
     )
+    parser.add_argument(
+        "--log-format",
+        choices=log_writer.FORMATS,
+        default="text",
+        help="Log file format: text lines or JSON lines (default: text; json defaults to gitlog.jsonl)"
+    )
+    parser.add_argument(
+        "--log-max-bytes",
+        type=parse_size,
+        default=log_writer.DEFAULT_MAX_BYTES,
+        help="Rotate the log file when it would grow past this size, e.g. 10M; 0 disables (default: 10M)"
+    )
+    parser.add_argument(
+        "--log-backups",
+        type=int,
+        default=log_writer.DEFAULT_BACKUPS,
+        help=f"Number of rotated log files to keep (default: {log_writer.DEFAULT_BACKUPS})"
+    )
+    parser.add_argument(
+        "--maintenance",
+        action="store_true",
+        help="After processing, repack and refresh the commit-graph of the least recently maintained repositories"
+    )
+    parser.add_argument(
+        "--maintenance-repos",
+        type=int,
+        default=DEFAULT_MAINTENANCE_REPOS,
+        help=f"Repositories maintained per run (default: {DEFAULT_MAINTENANCE_REPOS})"
+    )
+    parser.add_argument(
+        "--maintenance-time",
+        type=float,
+        default=DEFAULT_MAINTENANCE_TIME,
+        help=f"Time box in seconds for the maintenance stage (default: {DEFAULT_MAINTENANCE_TIME})"
+    )
+    parser.add_argument(
+        "--bundle",
+        action="store_true",
+        help="After processing, write a full or incremental git bundle of every cloned repository"
+    )
+    parser.add_argument(
+        "--bundle-full",
+        action="store_true",
+        help="With --bundle, start new full bundles instead of incremental ones"
+    )
+    parser.add_argument(
+        "--bundle-dir",
+        type=str,
+        default=None,
+        help="Directory for bundles and their index.json (default: .bundles in destination directory)"
+    )
+    parser.add_argument(
+        "--restore",
+        metavar="NAME",
+        help="Restore repository NAME from its bundles into --restore-to, without network access"
+    )
+    parser.add_argument(
+        "--restore-to",
+        metavar="DIR",
+        help="Target directory for --restore"
+    )
+    parser.add_argument(
+        "--always-pull",
+        action="store_true",
+        help="Pull every existing repository, even if its remote refs are unchanged"
+    )
     
     args = parser.parse_args()
     
@@ -357,7 +1033,21 @@ def main():
     # Default paths
     config_path = Path(args.config) if args.config else repo_root / "data" / "git_repositories.json"
     dest_dir = Path(args.dest) if args.dest else repo_root / "git_repos"
-    log_path = Path(args.log) if args.log else dest_dir / "gitlog.txt"
+    default_log = "gitlog.jsonl" if args.log_format == "json" else "gitlog.txt"
+    log_path = Path(args.log) if args.log else dest_dir / default_log
+    log_writer.configure(args.log_format, args.log_max_bytes, args.log_backups)
+    bundle_dir = Path(args.bundle_dir) if args.bundle_dir else dest_dir / BUNDLE_DIR
+    
+    if args.restore:
+        if not args.restore_to:
+            parser.error("--restore requires --restore-to")
+        try:
+            restore(BundleIndex(bundle_dir), args.restore, Path(args.restore_to))
+        except BundleError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"✓ Restored {args.restore} from {bundle_dir} into {args.restore_to}")
+        return
     
     print("Git Repositories Manager")
     print("="*60)
@@ -365,23 +1055,24 @@ def main():
     print(f"Destination: {dest_dir}")
     print(f"Log file: {log_path}")
     print(f"Operation: {args.operation}")
-    print(f"Max workers: {args.max_workers}")
+    print(f"Max workers: {args.max_workers or 'auto'}")
     if args.dry_run:
         print("Mode: DRY RUN (no actual changes)")
     print("="*60)
     print()
     
-    # Perform operation(s)
-    if args.operation in ["clone", "both"]:
-        print("Starting clone operation...")
-        print()
-        process_repositories(config_path, dest_dir, log_path, "clone", args.max_workers, args.dry_run)
-        print()
-    
-    if args.operation in ["update", "both"]:
-        print("Starting update operation...")
-        print()
-        process_repositories(config_path, dest_dir, log_path, "update", args.max_workers, args.dry_run)
+    # Plan and perform all clones and updates in one pass
+    print(f"Starting {OPERATION_LABELS[args.operation]} operation...")
+    print()
+    try:
+        process_repositories(config_path, dest_dir, log_path, args.operation, args.max_workers, args.dry_run,
+                             check_remote=not args.always_pull)
+        if args.maintenance and not args.dry_run:
+            maintain_repositories(config_path, dest_dir, log_path, args.maintenance_repos, args.maintenance_time)
+        if args.bundle and not args.dry_run:
+            snapshot_repositories(config_path, dest_dir, bundle_dir, log_path, args.bundle_full)
+    finally:
+        log_writer.close_all()
 
 
 if __name__ == "__main__":
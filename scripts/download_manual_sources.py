@@ -3,16 +3,72 @@
 Manual Sources Downloader
 Part of EmergencyStorage - Downloads files from manually configured sources
 
-This script reads a JSON file where keys are download methods (wget, curl, rsync, git, etc.)
-and executes commands with smart fallback to alternative URLs/flags.
+This script reads a JSON file listing sources, each with a stable ID, a download method
+(wget, curl, rsync, git, etc.) and optional tags, and executes commands with smart
+fallback to alternative URLs/flags. The older layout keyed by method name is still
+supported (see source_index.py). The ``http`` method is handled in-process by the
+native HTTP engine (see http_engine.py).
+
+Every processed source is recorded in the shared run history (see
+run_metrics.py) with its attempts and the bytes transferred.
+
+Downloads share the bandwidth budget of the auto-update configuration, or
+the one auto_update.py hands down (see bandwidth.py): each of the ``--jobs``
+parallel downloads gets an equal share.
 """
 
 import json
 import os
+import socket
 import sys
 import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import http_engine
+from bandwidth import Governor
+from run_metrics import MetricsStore, export_textfile, open_store
+from source_index import Source, SourceIndex, is_legacy, migrate
+from state_store import ConfigStore, atomic_write_json
+from stream_runner import Watchdog, WatchdogPolicy, format_bytes, run_streaming
+
+# Methods handled in-process instead of by spawning an external tool
+NATIVE_METHODS = ("http",)
+
+PROGRESS_INTERVAL = 5.0  # seconds between progress lines for native downloads
+
+PROBE_TIMEOUT = 10.0  # seconds a racing probe may take before it is abandoned
+RACE_GRACE = 2.0  # seconds to keep ranking other candidates after the first one answered
+
+# Default ports for probing non-HTTP sources
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21, "rsync": 873, "git": 9418, "ssh": 22}
+
+
+@dataclass
+class SourceOptions:
+    """Per-source settings applied to every download attempt of a source."""
+    watchdog: WatchdogPolicy = field(default_factory=WatchdogPolicy)
+    checksum: Optional[http_engine.Checksum] = None
+    output: Optional[str] = None  # file to verify when an external tool downloads it
+    governor: Optional[Governor] = None  # bandwidth share of each attempt
+
+    @classmethod
+    def from_source(cls, source_info: Dict) -> "SourceOptions":
+        """
+        Read the optional watchdog, sha256/md5 and file fields of a source.
+
+        Raises:
+            ValueError: If a setting is invalid
+        """
+        return cls(WatchdogPolicy.from_config(source_info.get("watchdog")),
+                   http_engine.Checksum.from_config(source_info),
+                   source_info.get("file"))
 
 
 def build_command(method: str, url_field: str) -> List[str]:
@@ -30,7 +86,133 @@ def build_command(method: str, url_field: str) -> List[str]:
     return [method] + parts
 
 
-def execute_download(method: str, url_field: str, dry_run: bool = False) -> bool:
+def parse_http_args(url_field: str) -> Tuple[str, Path, bool, int]:
+    """
+    Parse the url field of an ``http`` source.
+    
+    Supported flags are ``-O``/``--output PATH``, ``--segments N`` and
+    ``--no-resume``; the remaining token is the URL.
+    
+    Args:
+        url_field: The url field containing flags and URL
+        
+    Returns:
+        Tuple of (url, destination path, resume, segments)
+    """
+    parts = url_field.strip().split()
+    url = ""
+    output = None
+    resume = True
+    segments = 1
+    i = 0
+    while i < len(parts):
+        part = parts[i]
+        if part in ("-O", "--output") and i + 1 < len(parts):
+            output = parts[i + 1]
+            i += 1
+        elif part == "--segments" and i + 1 < len(parts):
+            segments = int(parts[i + 1])
+            i += 1
+        elif part == "--no-resume":
+            resume = False
+        else:
+            url = part
+        i += 1
+    
+    if not url:
+        raise ValueError(f"No URL in url field: {url_field}")
+    
+    dest = Path(output) if output else Path(http_engine.filename_from_url(url))
+    return url, dest, resume, segments
+
+
+def tally(stats: Optional[Dict], transferred: Optional[int] = None, exit_code: Optional[int] = None):
+    """Add one download attempt's transfer and exit code to a source's run stats."""
+    if stats is None:
+        return
+    if transferred:
+        stats["bytes"] = stats.get("bytes", 0) + transferred
+    if exit_code is not None:
+        stats["exit_code"] = exit_code
+
+
+def execute_native_download(url_field: str, cache: Optional[http_engine.MetadataCache] = None,
+                            scope: str = "http",
+                            options: Optional[SourceOptions] = None,
+                            stats: Optional[Dict] = None) -> bool:
+    """
+    Download an ``http`` source with the in-process HTTP engine.
+    
+    A connection that goes silent is ended by the socket timeout; the
+    watchdog additionally aborts transfers that trickle in below its floor.
+    A configured checksum is computed while the file is written.
+    
+    Args:
+        url_field: The url field containing flags and URL
+        cache: Validator cache for conditional requests
+        scope: Source ID, used to scope cache entries
+        options: Watchdog and checksum settings of the source
+        stats: Run stats the bytes written are added to
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        url, dest, resume, segments = parse_http_args(url_field)
+    except ValueError as e:
+        print(f"  ✗ {e}")
+        return False
+    
+    options = options or SourceOptions()
+    throttle = options.governor.throttle() if options.governor else None
+    last_report = [time.monotonic()]
+    guard = Watchdog(options.watchdog)
+    last_bytes = [None, time.monotonic()]  # bytes on disk, time they last grew
+    
+    def progress(done: int, total):
+        now = time.monotonic()
+        if done != last_bytes[0]:
+            last_bytes[:] = [done, now]
+        reason = guard.check(done, now - last_bytes[1])
+        if reason:
+            raise http_engine.DownloadAborted(f"watchdog: {reason}")
+        if now - last_report[0] >= PROGRESS_INTERVAL:
+            last_report[0] = now
+            of_total = f" of {format_bytes(total)}" if total else ""
+            # Like the streaming runner's, on stderr so parallel runs don't hold it back
+            print(f"  [{dest.name}] {format_bytes(done)}{of_total}", file=sys.stderr, flush=True)
+    
+    try:
+        print(f"  Fetching: {url} -> {dest}")
+        if segments > 1:
+            result = http_engine.segmented_download(url, dest, segments, progress=progress,
+                                                    checksum=options.checksum, throttle=throttle,
+                                                    resume=resume, cache=cache,
+                                                    cache_key=cache_key(scope, url))
+        else:
+            result = http_engine.download(url, dest, resume=resume, progress=progress,
+                                          cache=cache, cache_key=cache_key(scope, url),
+                                          checksum=options.checksum, throttle=throttle)
+        tally(stats, result.bytes_written)
+        if result.status == 304:
+            print("  ✓ Not modified since last download (304), nothing transferred")
+        elif result.resumed:
+            print(f"  ✓ Resumed download, {format_bytes(result.bytes_written)} transferred")
+        else:
+            print(f"  ✓ Downloaded {format_bytes(result.bytes_written)}")
+        if result.digest:
+            print(f"  ✓ {options.checksum.algorithm} verified")
+        return True
+    except Exception as e:
+        print(f"  ✗ Download failed: {e}")
+        return False
+
+
+def execute_download(method: str, url_field: str, dry_run: bool = False,
+                     cache: Optional[http_engine.MetadataCache] = None,
+                     options: Optional[SourceOptions] = None,
+                     scope: Optional[str] = None,
+                     stats: Optional[Dict] = None) -> bool:
     """
     Execute the download command.
     
@@ -38,57 +220,174 @@ def execute_download(method: str, url_field: str, dry_run: bool = False) -> bool
         method: Download method (wget, curl, rsync, git, etc.)
         url_field: The url field containing flags and URL
         dry_run: If True, only show what would be executed
+        cache: Validator cache for conditional requests (native methods)
+        options: Watchdog and checksum settings of the source
+        scope: Source ID scoping validator cache entries (defaults to the method)
+        stats: Run stats counting attempts, bytes transferred and the last exit code
         
     Returns:
         True if successful, False otherwise
     """
+    options = options or SourceOptions()
     command = build_command(method, url_field)
+    if options.governor:
+        command = options.governor.command(command)
     
     if dry_run:
         print(f"  [DRY RUN] Would execute: {' '.join(command)}")
         return True
     
+    if stats is not None:
+        stats["attempts"] = stats.get("attempts", 0) + 1
+    if method in NATIVE_METHODS:
+        return execute_native_download(url_field, cache, scope or method, options, stats)
+    
     try:
         print(f"  Executing: {' '.join(command)}")
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minute timeout
-        )
+        # Output is streamed so progress is visible while the tool runs; the
+        # watchdog only kills it when the transfer stalls, however long it takes
+        result = run_streaming(command, label=method, watchdog=options.watchdog)
+        tally(stats, result.bytes_transferred, result.returncode)
         
-        if result.returncode == 0:
-            print("  ✓ Command executed successfully")
+        if result.timed_out:
+            print(f"  ✗ Command aborted, {result.abort_reason} ({result.summary()})")
+            return False
+        elif result.returncode == 0:
+            print(f"  ✓ Command executed successfully: {result.summary()}")
+            if options.checksum:
+                return verify_output(method, url_field, options)
             return True
         else:
             print(f"  ✗ Command failed with return code {result.returncode}")
-            if result.stderr:
-                print(f"  Error: {result.stderr[:200]}")
+            if result.output_tail:
+                print(f"  Error: {result.output[-200:]}")
             return False
             
-    except subprocess.TimeoutExpired:
-        print("  ✗ Command timed out")
-        return False
     except Exception as e:
         print(f"  ✗ Error executing command: {e}")
         return False
 
 
-def try_alternatives(method: str, source_info: Dict, config: Dict, config_path: Path, dry_run: bool = False) -> bool:
+def _flag_value(parts: List[str], names: Tuple[str, ...]) -> Optional[str]:
+    """Return the value given to any of the flags ``names`` as ``-f value`` or ``--flag=value``."""
+    value = None
+    for i, part in enumerate(parts):
+        if part in names and i + 1 < len(parts):
+            value = parts[i + 1]
+        elif "=" in part and part.split("=", 1)[0] in names:
+            value = part.split("=", 1)[1]
+    return value
+
+
+def output_path(method: str, url_field: str) -> Optional[Path]:
     """
-    Try alternative URLs/flags if the main URL fails.
+    Work out which file an external tool writes for a url field.
+    
+    Understands wget's -O/-P, curl's -o/-O and rsync's destination argument.
+    
+    Args:
+        method: Download method
+        url_field: The url field containing flags and URL
+        
+    Returns:
+        Path of the downloaded file, or None if it cannot be determined
+    """
+    parts = url_field.strip().split()
+    url = extract_url(url_field)
+    if method == "wget":
+        output = _flag_value(parts, ("-O", "--output-document"))
+        if output:
+            return Path(output)
+        prefix = _flag_value(parts, ("-P", "--directory-prefix")) or "."
+        return Path(prefix) / http_engine.filename_from_url(url) if url else None
+    if method == "curl":
+        output = _flag_value(parts, ("-o", "--output"))
+        if output:
+            return Path(output)
+        if url and ("-O" in parts or "--remote-name" in parts):
+            return Path(http_engine.filename_from_url(url))
+        return None
+    if method == "rsync":
+        paths = [part for part in parts if not part.startswith("-")]
+        if len(paths) < 2:
+            return None
+        source, dest = paths[-2], Path(paths[-1])
+        if paths[-1].endswith("/") or dest.is_dir():
+            return dest / os.path.basename(source.rstrip("/"))
+        return dest
+    return None
+
+
+def second_read(method: str, url_field: str) -> Optional[str]:
+    """
+    Why the checksum of a download can't be computed while it streams, if so.
+    
+    Args:
+        method: Download method
+        url_field: The url field that will be downloaded
+        
+    Returns:
+        The reason the finished file has to be read again, or None
+    """
+    if method not in NATIVE_METHODS:
+        return f"{method} writes the file itself"
+    try:
+        segments = parse_http_args(url_field)[3]
+    except ValueError:
+        return None
+    return "segments arrive out of order" if segments > 1 else None
+
+
+def verify_output(method: str, url_field: str, options: SourceOptions) -> bool:
+    """
+    Check the file an external tool downloaded against the source checksum.
+    
+    External tools write the file themselves, so it is read back once; a
+    file that doesn't match is deleted.
     
     Args:
         method: Download method
-        source_info: Dictionary containing url, updateFile, downloaded, alternative
-        config: The already loaded configuration dictionary
-        config_path: Path to the JSON configuration file
+        url_field: The url field that was downloaded
+        options: Settings holding the checksum and optional file path
+        
+    Returns:
+        True if the file matches, False otherwise
+    """
+    checksum = options.checksum
+    path = Path(options.output) if options.output else output_path(method, url_field)
+    if path is None or not path.is_file():
+        print(f"  ✗ Cannot verify {checksum.algorithm}: downloaded file not found "
+              f"(set \"file\" for this source)")
+        return False
+    try:
+        checksum.verify(http_engine.hash_file(checksum.hasher(), path), path)
+    except http_engine.ChecksumMismatch as e:
+        print(f"  ✗ {e}")
+        return False
+    print(f"  ✓ {checksum.algorithm} verified: {path}")
+    return True
+
+
+def try_alternatives(source: Source, store: ConfigStore, dry_run: bool = False,
+                     cache: Optional[http_engine.MetadataCache] = None,
+                     options: Optional[SourceOptions] = None,
+                     stats: Optional[Dict] = None) -> bool:
+    """
+    Try alternative URLs/flags if the main URL fails.
+    
+    Args:
+        source: Indexed source (url, updateFile, downloaded, alternative)
+        store: Journaled configuration store
         dry_run: If True, only show what would be executed
+        cache: Validator cache for conditional requests
+        options: Watchdog and checksum settings for each attempt
+        stats: Run stats of the source (see execute_download)
         
     Returns:
         True if any attempt succeeded, False otherwise
     """
-    alternatives = source_info.get("alternative", [])
+    method, source_info = source.method, source.info
+    alternatives = list(source_info.get("alternative", []))
     
     if not alternatives:
         return False
@@ -98,25 +397,164 @@ def try_alternatives(method: str, source_info: Dict, config: Dict, config_path:
     for i, alt_url in enumerate(alternatives):
         print(f"  Alternative {i+1}/{len(alternatives)}: {alt_url}")
         
-        if execute_download(method, alt_url, dry_run):
+        if execute_download(method, alt_url, dry_run, cache, options, source.id, stats):
             # Swap the working alternative with the failed main URL
             if not dry_run:
                 print(f"  → Updating config: moving working alternative to main URL")
-                old_url = source_info["url"]
-                source_info["url"] = alt_url
-                # Add failed URL to end of alternatives
-                alternatives.remove(alt_url)
-                alternatives.append(old_url)
-                source_info["alternative"] = alternatives
-                
-                # Save updated config (config already passed in, no need to reload)
-                save_config(config_path, config)
+                with store.lock:
+                    old_url = source_info["url"]
+                    # Add failed URL to end of alternatives
+                    alternatives.remove(alt_url)
+                    alternatives.append(old_url)
+                    
+                    # Journal the swap; the config file is rewritten once at the end of the run
+                    store.record(source.key_path + ["url"], alt_url)
+                    store.record(source.key_path + ["alternative"], alternatives)
             
             return True
     
     return False
 
 
+def probe_target(url_field: str) -> Optional[Tuple[str, int]]:
+    """
+    Find the host and port a url field connects to.
+    
+    Args:
+        url_field: The url field containing flags and URL
+        
+    Returns:
+        Tuple of (host, port), or None if no remote target was found
+    """
+    for part in url_field.strip().split():
+        if "://" in part:
+            parsed = urlparse(part)
+            if parsed.hostname:
+                port = parsed.port or DEFAULT_PORTS.get(parsed.scheme.lower())
+                if port:
+                    return parsed.hostname, port
+        elif "@" in part and ":" in part.split("@", 1)[1]:
+            return part.split("@", 1)[1].split(":", 1)[0], DEFAULT_PORTS["ssh"]
+    return None
+
+
+def probe_latency(url_field: str, timeout: float = PROBE_TIMEOUT) -> Optional[float]:
+    """
+    Measure how quickly a candidate URL responds.
+    
+    HTTP(S) URLs are probed with a HEAD request (time to response headers);
+    other targets with a TCP connect to the service port.
+    
+    Args:
+        url_field: The url field containing flags and URL
+        timeout: Seconds before the probe gives up
+        
+    Returns:
+        Latency in seconds, or None if the candidate is unreachable
+    """
+    start = time.monotonic()
+    url = extract_url(url_field)
+    try:
+        if url:
+            pool = http_engine.ConnectionPool(max_idle_per_host=0, timeout=timeout)
+            response = http_engine.open_url(url, method="HEAD", pool=pool)
+            response.close()
+            if response.status >= 400 and response.status != 405:
+                return None
+        else:
+            target = probe_target(url_field)
+            if target is None:
+                return None
+            socket.create_connection(target, timeout=timeout).close()
+    except Exception:
+        return None
+    return time.monotonic() - start
+
+
+def rank_candidates(candidates: List[str]) -> List[Tuple[str, Optional[float]]]:
+    """
+    Probe all candidates concurrently and order them fastest first.
+    
+    Once the first candidate answers, the others get RACE_GRACE seconds to
+    finish; probes still running after that are abandoned and ranked after
+    every candidate that answered, in their original order, followed by the
+    unreachable ones.
+    
+    Args:
+        candidates: url fields to race (main URL first)
+        
+    Returns:
+        List of (url_field, latency or None) in the order to try them
+    """
+    latencies: Dict[int, Optional[float]] = {}
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    try:
+        futures = {executor.submit(probe_latency, c): i for i, c in enumerate(candidates)}
+        pending = set(futures)
+        deadline = time.monotonic() + PROBE_TIMEOUT
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                latencies[futures[future]] = future.result()
+                if future.result() is not None:
+                    deadline = min(deadline, time.monotonic() + RACE_GRACE)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    answered = sorted((i for i in latencies if latencies[i] is not None), key=lambda i: latencies[i])
+    abandoned = [i for i in range(len(candidates)) if i not in latencies]
+    unreachable = [i for i in range(len(candidates)) if i in latencies and latencies[i] is None]
+    return [(candidates[i], latencies.get(i)) for i in answered + abandoned + unreachable]
+
+
+def race_download(source: Source, store: ConfigStore,
+                  cache: Optional[http_engine.MetadataCache] = None,
+                  options: Optional[SourceOptions] = None,
+                  stats: Optional[Dict] = None) -> Optional[str]:
+    """
+    Race the main URL against its alternatives and download from the fastest.
+    
+    All candidates are probed concurrently and tried fastest first. When the
+    download succeeds, the winner becomes the main URL and the alternatives
+    are reordered by measured latency, so the best URL stays first.
+    
+    Args:
+        source: Indexed source (url, updateFile, downloaded, alternative)
+        store: Journaled configuration store
+        cache: Validator cache for conditional requests
+        options: Watchdog and checksum settings for each attempt
+        stats: Run stats of the source (see execute_download)
+        
+    Returns:
+        The url field that was downloaded, or None if every candidate failed
+    """
+    method, source_info = source.method, source.info
+    candidates = [source_info["url"]] + list(source_info.get("alternative", []))
+    print(f"  Racing {len(candidates)} candidate(s)...")
+    ranked = rank_candidates(candidates)
+    for url_field, latency in ranked:
+        shown = f"{latency * 1000:.0f} ms" if latency is not None else "no answer"
+        print(f"    {shown:>10}  {url_field}")
+    
+    for url_field, _ in ranked:
+        print(f"  Trying: {url_field}")
+        if not execute_download(method, url_field, False, cache, options, source.id, stats):
+            continue
+        
+        order = [url_field] + [c for c, _ in ranked if c != url_field]
+        if order != candidates:
+            print(f"  → Updating config: ordering URLs by measured latency")
+            with store.lock:
+                store.record(source.key_path + ["url"], order[0])
+                store.record(source.key_path + ["alternative"], order[1:])
+        return url_field
+    
+    return None
+
+
 def load_config(config_path: Path) -> Dict:
     """Load the JSON configuration."""
     with open(config_path, 'r') as f:
@@ -124,29 +562,24 @@ def load_config(config_path: Path) -> Dict:
 
 
 def save_config(config_path: Path, config: Dict):
-    """Save the JSON configuration."""
-    with open(config_path, 'w') as f:
-        json.dump(config, f, indent=2)
+    """Save the JSON configuration atomically."""
+    atomic_write_json(config_path, config)
 
 
-def update_downloaded_status(config: Dict, config_path: Path, method: str, status: bool):
+def update_downloaded_status(store: ConfigStore, source: Source, status: bool):
     """
     Update the downloaded status for a specific source.
     
+    Only this source's entry is journaled; the rest of the config is untouched.
+    
     Args:
-        config: The already loaded configuration dictionary
-        config_path: Path to the JSON configuration file
-        method: The download method key
+        store: Journaled configuration store
+        source: The indexed source
         status: Downloaded status (True/False)
     """
     try:
-        if method in config:
-            config[method]["downloaded"] = status
-            save_config(config_path, config)
-            print(f"  Updated downloaded status to {status}")
-        else:
-            print(f"  Warning: Method '{method}' not found in config", file=sys.stderr)
-            
+        store.record(source.key_path + ["downloaded"], status)
+        print(f"  Updated downloaded status to {status}")
     except Exception as e:
         print(f"  Warning: Could not update downloaded status: {e}", file=sys.stderr)
 
@@ -176,75 +609,370 @@ def should_download(source_info: Dict) -> bool:
     return True
 
 
-def process_manual_sources(config_path: Path, dry_run: bool = False):
+def extract_url(url_field: str) -> str:
+    """
+    Return the first http(s) URL in a url field, or an empty string.
+    
+    Args:
+        url_field: The url field containing flags and URL
+    """
+    for part in url_field.strip().split():
+        if part.lower().startswith(("http://", "https://")):
+            return part
+    return ""
+
+
+def cache_key(scope: str, url: str) -> str:
+    """Key of a source's validator cache entry; scoped by source ID so each local copy is tracked."""
+    return f"{scope} {url}"
+
+
+def check_unchanged(source: Source, cache: http_engine.MetadataCache) -> Tuple[bool, Dict]:
+    """
+    Revalidate an ``updateFile`` source with a conditional HEAD.
+    
+    External tools can't make conditional requests themselves, so the check
+    is done up front with the cached ETag/Last-Modified of the main URL.
+    Sources not downloaded yet, or whose output file is gone, only fetch
+    validators to remember. Native methods revalidate inside the download
+    itself.
+    
+    Args:
+        source: Indexed source (url, updateFile, downloaded, alternative)
+        cache: Validator cache
+        
+    Returns:
+        Tuple of (unchanged, validators to remember after a successful download)
+    """
+    source_info = source.info
+    url = extract_url(source_info.get("url", ""))
+    if source.method in NATIVE_METHODS or not url or not source_info.get("updateFile"):
+        return False, {}
+    
+    # A 304 only means the local copy is current if there still is one
+    output = output_path(source.method, source_info.get("url", ""))
+    conditional = bool(source_info.get("downloaded")) and (output is None or output.exists())
+    try:
+        validators = http_engine.check_modified(url, cache, cache_key=cache_key(source.id, url),
+                                                conditional=conditional)
+    except Exception as e:
+        print(f"  Could not revalidate {url}: {e}")
+        return False, {}
+    
+    if validators is None:
+        return True, {}
+    return False, validators
+
+
+def extract_host(url_field: str) -> str:
+    """
+    Extract the remote host a url field points at.
+    
+    Understands scheme URLs (https://, rsync://, ...) as well as
+    scp-style ``user@host:/path`` targets used by rsync and git.
+    
+    Args:
+        url_field: The url field containing flags and URL
+        
+    Returns:
+        Lower-cased host name, or an empty string if none was found
+    """
+    for part in url_field.strip().split():
+        if "://" in part:
+            host = urlparse(part).hostname
+            if host:
+                return host.lower()
+        elif "@" in part and ":" in part.split("@", 1)[1]:
+            return part.split("@", 1)[1].split(":", 1)[0].lower()
+    return ""
+
+
+def source_host(source: Source) -> str:
+    """The host a source's main URL points at."""
+    return extract_host(source.info.get("url", ""))
+
+
+class HostQueue:
+    """
+    Hands out sources for submission, at most ``per_host`` at a time per host.
+    
+    Sources of a busy host wait here instead of in the pool, so a pool
+    thread never sits idle behind a host limit while other hosts have work.
+    Only the submitting thread uses it.
+    """
+    
+    def __init__(self, sources: List[Source], per_host: int):
+        self.per_host = max(1, per_host)
+        self._waiting: Dict[str, Deque[Source]] = {}
+        self._running: Dict[str, int] = {}
+        for source in sources:
+            self._waiting.setdefault(source_host(source), deque()).append(source)
+    
+    def ready(self, limit: int) -> List[Source]:
+        """Up to ``limit`` sources that may start now, round-robin across hosts."""
+        ready: List[Source] = []
+        added = True
+        while added and len(ready) < limit:
+            added = False
+            for host, queue in self._waiting.items():
+                if len(ready) < limit and queue and self._running.get(host, 0) < self.per_host:
+                    ready.append(queue.popleft())
+                    self._running[host] = self._running.get(host, 0) + 1
+                    added = True
+        return ready
+    
+    def done(self, source: Source):
+        """Free the host slot of a finished source."""
+        self._running[source_host(source)] -= 1
+
+
+class JobOutput:
+    """
+    Per-thread stdout buffer for parallel runs.
+    
+    Worker threads write into their own buffer, which is printed as one
+    block when the job finishes so concurrent sources don't interleave.
+    Progress lines go to stderr unbuffered, so long jobs don't go silent.
+    """
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+    
+    def write(self, text: str) -> int:
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            with self._lock:
+                return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+    
+    def flush(self):
+        if getattr(self._local, "buffer", None) is None:
+            self.stream.flush()
+    
+    def begin(self):
+        """Start buffering output of the calling thread."""
+        self._local.buffer = []
+    
+    def end(self):
+        """Print and drop the calling thread's buffered output."""
+        buffer = self._local.buffer
+        self._local.buffer = None
+        with self._lock:
+            self.stream.write("".join(buffer) + "\n")
+            self.stream.flush()
+
+
+def process_source(source: Source, store: ConfigStore, dry_run: bool = False,
+                   cache: Optional[http_engine.MetadataCache] = None, race: bool = False,
+                   stats: Optional[Dict] = None, governor: Optional[Governor] = None) -> str:
+    """
+    Process a single manual source.
+    
+    Args:
+        source: Indexed source (url, updateFile, downloaded, alternative)
+        store: Journaled configuration store
+        dry_run: If True, only show what would be executed
+        cache: Validator cache for conditional requests
+        race: Probe the main URL and alternatives concurrently and use the fastest
+        stats: Filled with attempts, bytes transferred and the last exit code
+        governor: Bandwidth governor limiting every attempt
+        
+    Returns:
+        One of "downloaded", "skipped", "failed" or "invalid"
+    """
+    method, source_info = source.method, source.info
+    try:
+        options = SourceOptions.from_source(source_info)
+    except ValueError as e:
+        print(f"Warning: {e} for source '{source.id}', skipping")
+        return "invalid"
+    options.governor = governor
+    
+    if source.id == method:
+        print(f"Processing: {method}")
+    else:
+        print(f"Processing: {source.id} ({method})")
+    url_field = source_info.get("url", "")
+    print(f"  URL field: {url_field}")
+    
+    # Check if should download
+    if not should_download(source_info):
+        print(f"  Skipping (already downloaded, updateFile=false)")
+        return "skipped"
+    
+    reason = second_read(method, url_field) if options.checksum else None
+    if reason:
+        print(f"  Warning: {options.checksum.algorithm} needs a second read of the file ({reason})")
+    
+    # Skip the transfer if the server says the file hasn't changed
+    validators = {}
+    if cache is not None and not dry_run:
+        unchanged, validators = check_unchanged(source, cache)
+        if unchanged:
+            print("  ✓ Not modified since last download (304), nothing transferred")
+            return "downloaded"
+    
+    def remember(downloaded: str):
+        # The validators belong to the main URL; another winner gets its own next run
+        if validators and downloaded == url_field:
+            cache.remember(cache_key(source.id, extract_url(url_field)), validators.get("etag"),
+                           validators.get("last_modified"), validators.get("content_length"))
+    
+    if race and source_info.get("alternative") and not dry_run:
+        winner = race_download(source, store, cache, options, stats)
+        if winner is None:
+            return "failed"
+        remember(winner)
+        update_downloaded_status(store, source, True)
+        return "downloaded"
+    
+    # Try main URL
+    success = execute_download(method, url_field, dry_run, cache, options, source.id, stats)
+    
+    if success:
+        remember(url_field)
+    
+    # If failed, try alternatives
+    if not success and not dry_run:
+        print("  Main URL failed, trying alternatives...")
+        success = try_alternatives(source, store, dry_run, cache, options, stats)
+    
+    if not success:
+        return "failed"
+    
+    if not dry_run:
+        update_downloaded_status(store, source, True)
+    return "downloaded"
+
+
+def http_cache_path(config_path: Path) -> Path:
+    """Return the validator cache file kept next to a sources config."""
+    return config_path.with_name(config_path.stem + ".http_cache.json")
+
+
+def record_source(metrics: Optional[MetricsStore], source: Source, outcome: str,
+                  duration: float, stats: Dict):
+    """Record a downloaded or failed source in the run history; skips aren't runs."""
+    if metrics is None or outcome not in ("downloaded", "failed"):
+        return
+    metrics.record(source.id, "success" if outcome == "downloaded" else "failed", duration,
+                   stats.get("bytes"), max(0, stats.get("attempts", 1) - 1), stats.get("exit_code"),
+                   action=source.method)
+
+
+def process_manual_sources(config_path: Path, dry_run: bool = False,
+                           jobs: int = 1, per_host: int = 2, race: bool = False,
+                           ids: Optional[List[str]] = None, tags: Optional[List[str]] = None):
     """
     Process manual sources configuration and execute downloads.
     
     Args:
         config_path: Path to the manual sources JSON configuration
         dry_run: If True, only show what would be downloaded without actually downloading
+        jobs: Number of sources to download in parallel (1 = sequential)
+        per_host: Maximum parallel downloads against the same host
+        race: Race each source's main URL against its alternatives
+        ids: Only process the sources with these IDs
+        tags: Only process the sources with these tags
     """
+    store = None
+    cache = http_engine.MetadataCache(http_cache_path(config_path))
     try:
-        config = load_config(config_path)
+        store = ConfigStore.load(config_path)
+        index = SourceIndex(store.data)
         
-        if not config:
+        for error in index.errors:
+            print(f"Warning: {error}, skipping")
+        if not index:
             print("No sources found in configuration")
             return
         
-        print(f"Found {len(config)} download source(s)")
+        try:
+            selected = index.select(ids, tags)
+        except KeyError as e:
+            print(f"Error: {e.args[0]}", file=sys.stderr)
+            sys.exit(1)
+        
+        if ids or tags:
+            print(f"Selected {len(selected)} of {len(index)} download source(s)")
+        else:
+            print(f"Found {len(index)} download source(s)")
+        if jobs > 1:
+            print(f"Parallel jobs: {jobs} (max {per_host} per host)")
+        governor = Governor.from_environment(max(1, min(jobs, len(selected))))
+        governor.register(len(selected))
+        if governor.limit():
+            print(f"Bandwidth: {governor.describe()}")
         print()
         
-        # Process each method
-        downloaded_count = 0
-        skipped_count = 0
-        failed_count = 0
+        counts = {"downloaded": 0, "skipped": 0, "failed": 0, "invalid": 0}
+        metrics = open_store("manual_sources") if not dry_run else None
         
-        for method, source_info in config.items():
-            # Validate source_info structure
-            if not isinstance(source_info, dict):
-                print(f"Warning: Invalid structure for method '{method}', skipping")
-                continue
-            
-            if "url" not in source_info:
-                print(f"Warning: No URL for method '{method}', skipping")
-                continue
-            
-            print(f"Processing: {method}")
-            url_field = source_info.get("url", "")
-            print(f"  URL field: {url_field}")
-            
-            # Check if should download
-            if not should_download(source_info):
-                print(f"  Skipping (already downloaded, updateFile=false)")
-                skipped_count += 1
-                print()
-                continue
-            
-            # Try main URL
-            success = execute_download(method, url_field, dry_run)
-            
-            # If failed, try alternatives
-            if not success and not dry_run:
-                print("  Main URL failed, trying alternatives...")
-                success = try_alternatives(method, source_info, config, config_path, dry_run)
+        def measured(source: Source) -> str:
+            stats: Dict = {}
+            started = time.monotonic()
+            try:
+                outcome = process_source(source, store, dry_run, cache, race, stats, governor)
+            finally:
+                governor.unregister()
+            record_source(metrics, source, outcome, time.monotonic() - started, stats)
+            return outcome
+        
+        if jobs <= 1:
+            for source in selected:
+                outcome = measured(source)
+                counts[outcome] += 1
+                if outcome != "invalid":
+                    print()
+        else:
+            hosts = HostQueue(selected, per_host)
+            output = JobOutput(sys.stdout)
             
-            if success:
-                downloaded_count += 1
-                if not dry_run:
-                    update_downloaded_status(config, config_path, method, True)
-            else:
-                failed_count += 1
+            def run(source: Source) -> str:
+                output.begin()
+                try:
+                    return measured(source)
+                finally:
+                    output.end()
             
-            print()
+            sys.stdout = output
+            try:
+                with ThreadPoolExecutor(max_workers=jobs) as executor:
+                    future_to_source: Dict = {}
+                    
+                    def submit():
+                        # A source is only submitted once its host has a free slot
+                        for source in hosts.ready(jobs - len(future_to_source)):
+                            future_to_source[executor.submit(run, source)] = source
+                    
+                    submit()
+                    while future_to_source:
+                        finished, _ = wait(future_to_source, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            source = future_to_source.pop(future)
+                            hosts.done(source)
+                            try:
+                                outcome = future.result()
+                            except Exception as e:
+                                print(f"  ✗ Error processing {source.id}: {e}")
+                                outcome = "failed"
+                            counts[outcome] += 1
+                        submit()
+            finally:
+                sys.stdout = output.stream
         
         # Summary
         print("="*50)
         print("Download Summary")
         print("="*50)
-        print(f"  Downloaded: {downloaded_count}")
-        print(f"  Skipped: {skipped_count}")
-        print(f"  Failed: {failed_count}")
-        print(f"  Total: {len(config)}")
+        print(f"  Downloaded: {counts['downloaded']}")
+        print(f"  Skipped: {counts['skipped']}")
+        print(f"  Failed: {counts['failed']}")
+        print(f"  Total: {len(selected)}")
+        export_textfile(metrics)
         
     except FileNotFoundError:
         print(f"Error: Configuration file not found: {config_path}", file=sys.stderr)
@@ -255,6 +983,37 @@ def process_manual_sources(config_path: Path, dry_run: bool = False):
     except Exception as e:
         print(f"Error processing manual sources: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        # Fold all journaled status changes into the config with one atomic write
+        if store is not None and store.pending:
+            try:
+                store.compact()
+            except Exception as e:
+                print(f"Warning: Could not save configuration: {e}", file=sys.stderr)
+        try:
+            cache.save()
+        except Exception as e:
+            print(f"Warning: Could not save HTTP cache: {e}", file=sys.stderr)
+
+
+def migrate_config(config_path: Path) -> bool:
+    """
+    Rewrite a method-keyed config in the list layout.
+    
+    Source IDs become the old method keys, so cached validators stay valid.
+    
+    Args:
+        config_path: Path to the manual sources JSON configuration
+        
+    Returns:
+        True if the file was converted, False if it already used the list layout
+    """
+    store = ConfigStore.load(config_path)
+    if not is_legacy(store.data):
+        return False
+    store.data = migrate(store.data)
+    store.compact()
+    return True
 
 
 def main():
@@ -275,6 +1034,42 @@ def main():
         action="store_true",
         help="Show what would be downloaded without actually downloading"
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of sources to download in parallel (default: 1, sequential)"
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=2,
+        help="Maximum parallel downloads against the same host (default: 2)"
+    )
+    parser.add_argument(
+        "--race",
+        action="store_true",
+        help="Probe main URL and alternatives concurrently and download from the fastest"
+    )
+    parser.add_argument(
+        "--id",
+        action="append",
+        dest="ids",
+        metavar="ID",
+        help="Only process the source with this ID (can be repeated)"
+    )
+    parser.add_argument(
+        "--tag",
+        action="append",
+        dest="tags",
+        metavar="TAG",
+        help="Only process sources with this tag (can be repeated)"
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Convert a config keyed by method name to the list layout and exit"
+    )
     
     args = parser.parse_args()
     
@@ -285,6 +1080,16 @@ def main():
     # Default path
     config_path = Path(args.config) if args.config else repo_root / "data" / "manual_sources.json"
     
+    if args.migrate:
+        try:
+            converted = migrate_config(config_path)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error: Could not migrate {config_path}: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Converted {config_path} to the list layout" if converted
+              else f"{config_path} already uses the list layout")
+        return
+    
     print("Manual Sources Downloader")
     print("="*50)
     print(f"Configuration: {config_path}")
@@ -294,7 +1099,9 @@ def main():
     print()
     
     # Process downloads
-    process_manual_sources(config_path, dry_run=args.dry_run)
+    process_manual_sources(config_path, dry_run=args.dry_run,
+                           jobs=args.jobs, per_host=args.per_host, race=args.race,
+                           ids=args.ids, tags=args.tags)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Git Bundle Snapshots
+Part of EmergencyStorage - Offline, copyable snapshots of cloned repositories
+
+Each repository is written once as a full ``git bundle`` and afterwards as
+incremental bundles holding only what was added since the tips recorded for
+the previous bundle. ``index.json`` in the bundle directory lists every
+repository's chain of bundles (paths relative to the directory, size,
+SHA-256) and the tips of the newest one, so the directory can be copied to
+another drive as a handful of large files and checked without git.
+
+Restoring clones the full bundle and fetches the incremental ones in order;
+no network is needed.
+"""
+
+import hashlib
+import shutil
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from http_engine import hash_file
+from state_store import atomic_write_json, load_json_state
+
+INDEX_FILE = "index.json"
+TIP_REFS = ["refs/heads", "refs/remotes", "refs/tags"]
+
+
+class BundleError(Exception):
+    """Raised when a snapshot can't be written or restored."""
+
+
+def _git(args: List[str], input_text: Optional[str] = None) -> str:
+    result = subprocess.run(["git"] + args, input=input_text, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise BundleError(result.stderr.strip() or f"git {args[0]} failed with return code {result.returncode}")
+    return result.stdout
+
+
+def repo_tips(repo_path: Path) -> Dict[str, str]:
+    """Branch, remote-tracking and tag tips of a repository, ref -> object id."""
+    output = _git(["-C", str(repo_path), "for-each-ref", "--format=%(objectname) %(refname)"] + TIP_REFS)
+    tips = {}
+    for line in output.splitlines():
+        sha, _, ref = line.partition(" ")
+        tips[ref] = sha
+    return tips
+
+
+def file_sha256(path: Path) -> str:
+    return hash_file(hashlib.sha256(), path).hexdigest()
+
+
+class BundleIndex:
+    """``index.json`` of a bundle directory."""
+
+    def __init__(self, bundle_dir: Path):
+        self.bundle_dir = Path(bundle_dir)
+        self.path = self.bundle_dir / INDEX_FILE
+        self.data = load_json_state(self.path, None) or {"version": 1, "repositories": {}}
+
+    @property
+    def repositories(self) -> Dict[str, Dict]:
+        return self.data["repositories"]
+
+    def save(self):
+        self.bundle_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self.path, self.data)
+
+
+def snapshot(repo_path: Path, name: str, url: str, index: BundleIndex,
+             full: bool = False) -> Tuple[str, Optional[Path]]:
+    """
+    Write the next bundle of a repository.
+
+    An incremental bundle excludes everything reachable from the tips
+    recorded last time. A full bundle is written for a new repository, when
+    ``full`` is set, or when the incremental one can't be built (e.g. a
+    recorded tip no longer exists); it starts a new chain and the files of
+    the old chain are deleted.
+
+    Args:
+        repo_path: Cloned repository
+        name: Repository name (subdirectory of the bundle directory)
+        url: Upstream URL, recorded so a restore can point back to it
+        index: Bundle index, updated in memory
+        full: Start a new chain even if one exists
+
+    Returns:
+        Tuple of ("full" | "incremental" | "unchanged", bundle path or None)
+    """
+    entry = index.repositories.get(name)
+    tips = repo_tips(repo_path)
+    if not tips:
+        raise BundleError(f"{name} has no refs to bundle")
+    if entry and not full and entry.get("tips") == tips:
+        return ("unchanged", None)
+
+    sequence = (entry or {}).get("sequence", 0) + 1
+    directory = index.bundle_dir / name
+    directory.mkdir(parents=True, exist_ok=True)
+
+    kind = "full"
+    if entry and entry.get("bundles") and not full:
+        kind = "incremental"
+        target = directory / f"{sequence:04d}-incremental.bundle"
+        excluded = "".join(f"^{sha}\n" for sha in sorted(set(entry["tips"].values())))
+        try:
+            _git(["-C", str(repo_path), "bundle", "create", "-q", str(target), "--all", "--stdin"], excluded)
+        except BundleError as e:
+            if "empty bundle" in str(e):
+                # Only refs were moved or deleted; nothing new to store
+                entry["tips"] = tips
+                return ("unchanged", None)
+            kind = "full"
+    if kind == "full":
+        target = directory / f"{sequence:04d}-full.bundle"
+        _git(["-C", str(repo_path), "bundle", "create", "-q", str(target), "--all"])
+
+    record = {
+        "file": target.relative_to(index.bundle_dir).as_posix(),
+        "kind": kind,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "size": target.stat().st_size,
+        "sha256": file_sha256(target),
+        "refs": len(tips),
+    }
+    if kind == "full":
+        for old in (entry or {}).get("bundles", []):
+            (index.bundle_dir / old["file"]).unlink(missing_ok=True)
+        bundles = [record]
+    else:
+        bundles = entry["bundles"] + [record]
+    index.repositories[name] = {"url": url, "sequence": sequence, "tips": tips, "bundles": bundles}
+    return (kind, target)
+
+
+def verify(index: BundleIndex, name: str) -> List[Path]:
+    """
+    Check every bundle of a repository against the size and SHA-256 in the index.
+
+    Returns:
+        Bundle paths in restore order
+
+    Raises:
+        BundleError: If the repository is unknown or a bundle is missing or damaged
+    """
+    entry = index.repositories.get(name)
+    if not entry or not entry.get("bundles"):
+        raise BundleError(f"No bundles recorded for '{name}'")
+    paths = []
+    for record in entry["bundles"]:
+        path = index.bundle_dir / record["file"]
+        if not path.is_file() or path.stat().st_size != record["size"]:
+            raise BundleError(f"Bundle {record['file']} is missing or truncated")
+        if file_sha256(path) != record["sha256"]:
+            raise BundleError(f"Bundle {record['file']} does not match its SHA-256")
+        paths.append(path)
+    return paths
+
+
+def restore(index: BundleIndex, name: str, target: Path):
+    """
+    Rebuild a repository from its bundles, without network access.
+
+    The full bundle is cloned, each incremental bundle is fetched into the
+    remote-tracking branches and tags, the checked-out branch is moved to
+    the newest tip and ``origin`` is pointed back at the upstream URL.
+
+    Raises:
+        BundleError: If verification or a git step fails
+    """
+    target = Path(target)
+    if target.exists() and any(target.iterdir()):
+        raise BundleError(f"Restore target {target} is not empty")
+    paths = verify(index, name)
+    try:
+        _git(["clone", "-q", str(paths[0]), str(target)])
+        for path in paths:
+            _git(["-C", str(target), "fetch", "-q", str(path),
+                  "+refs/remotes/origin/*:refs/remotes/origin/*", "^refs/remotes/origin/HEAD"])
+            _git(["-C", str(target), "fetch", "-q", str(path),
+                  "+refs/heads/*:refs/remotes/origin/*", "+refs/tags/*:refs/tags/*"])
+        branch = _git(["-C", str(target), "symbolic-ref", "--short", "HEAD"]).strip()
+        _git(["-C", str(target), "reset", "-q", "--hard", f"refs/remotes/origin/{branch}"])
+        url = index.repositories[name].get("url")
+        if url:
+            _git(["-C", str(target), "remote", "set-url", "origin", url])
+    except BundleError:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
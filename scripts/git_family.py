@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Git Repository Families
+Part of EmergencyStorage - Shared object stores for forks and related repositories
+
+Repositories in ``git_repositories.json`` that declare the same ``"family"``
+share one bare object store under ``<dest>/.families/<family>.git``. Each
+member's refs are fetched into the store first, in a namespace of its own
+(``refs/members/<name>/...``), and the member is then cloned with
+``--reference`` to the store, so objects common to the family are downloaded
+and stored once.
+
+Safeguards:
+
+- Members borrow objects only from the store, never from each other, so
+  deleting a member directory cannot break another member.
+- The store keeps refs for every member and is configured never to prune
+  or auto-gc, so objects a member still uses are never removed from it.
+- Shallow and partial clones are not joined to a family; a failed store
+  fetch falls back to an ordinary independent clone.
+"""
+
+import re
+import subprocess
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+FAMILY_DIR = ".families"
+FAMILY_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+SHALLOW_ARGS = ("--depth", "--shallow-since", "--shallow-exclude")
+
+# Settings that keep the store from ever dropping objects members borrow
+STORE_CONFIG = {
+    "gc.auto": "0",
+    "gc.pruneExpire": "never",
+    "gc.reflogExpireUnreachable": "never",
+    "core.logAllRefUpdates": "true",
+}
+
+_locks: Dict[Path, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+class FamilyError(Exception):
+    """Raised for an invalid family declaration."""
+
+
+def family_of(repo_info: Dict) -> Optional[str]:
+    """
+    Return the family a repository belongs to, or None.
+
+    Raises:
+        FamilyError: If the family name is unusable or the clone is shallow or partial
+    """
+    family = repo_info.get("family")
+    if not family:
+        return None
+    if not isinstance(family, str) or not FAMILY_NAME.match(family):
+        raise FamilyError(f"Invalid family name {family!r}")
+    if repo_info.get("deepen") or any(str(arg).startswith(SHALLOW_ARGS)
+                                      for arg in repo_info.get("clone_args", [])):
+        raise FamilyError(f"Shallow clones can't share the '{family}' object store")
+    if repo_info.get("partial") or any(str(arg).startswith("--filter")
+                                       for arg in repo_info.get("clone_args", [])):
+        raise FamilyError(f"Partial clones can't share the '{family}' object store")
+    return family
+
+
+class FamilyStore:
+    """The shared bare repository of one family."""
+
+    def __init__(self, dest_dir: Path, family: str):
+        self.family = family
+        self.path = Path(dest_dir) / FAMILY_DIR / f"{family}.git"
+        with _locks_guard:
+            # Fetches into one store are serialised; members of different
+            # families still run in parallel
+            self.lock = _locks.setdefault(self.path, threading.Lock())
+
+    def ensure(self):
+        """Create the store if needed and (re)apply its safety settings."""
+        if not (self.path / "objects").is_dir():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _git(["init", "-q", "--bare", str(self.path)])
+        for key, value in STORE_CONFIG.items():
+            _git(["--git-dir", str(self.path), "config", key, value])
+
+    def fetch_command(self, name: str, url: str, git_options: Optional[List[str]] = None) -> List[str]:
+        """Command fetching a member's branches and tags into its namespace."""
+        prefix = f"refs/members/{name}"
+        return (["git", "--git-dir", str(self.path)] + (git_options or [])
+                + ["fetch", "--progress", "--no-tags", "--prune", url,
+                   f"+refs/heads/*:{prefix}/heads/*", f"+refs/tags/*:{prefix}/tags/*"])
+
+    def clone_args(self) -> List[str]:
+        """Extra ``git clone`` arguments that attach a new member."""
+        return ["--reference", str(self.path)]
+
+    def is_member(self, repo_path: Path) -> bool:
+        """True if the repository at ``repo_path`` borrows from this store."""
+        alternates = Path(repo_path) / ".git" / "objects" / "info" / "alternates"
+        try:
+            lines = alternates.read_text().splitlines()
+        except OSError:
+            return False
+        objects = (self.path / "objects").resolve()
+        return any(Path(line.strip()).resolve() == objects for line in lines if line.strip())
+
+
+def _git(args: List[str]):
+    subprocess.run(["git"] + args, check=True, capture_output=True, text=True)
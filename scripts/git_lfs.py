@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Git LFS Object Fetch
+Part of EmergencyStorage - Parallel download of Git LFS objects for archived repositories
+
+Repositories that keep large files in Git LFS only contain small pointer
+files. This module finds the pointers in the checked-out commit, asks the
+LFS server for download URLs through the batch API and downloads the
+objects concurrently with the native HTTP engine into git-lfs's own store
+(``.git/lfs/objects/aa/bb/<oid>``):
+
+- Objects already in the store are skipped without contacting the server.
+- Downloads go to ``.git/lfs/incomplete/<oid>`` first, so an interrupted
+  transfer is resumed with a Range request on the next run.
+- Every object is checked against its SHA-256 oid while it is written and
+  only then moved into the store.
+
+If the ``git-lfs`` command is installed, ``git lfs checkout`` then replaces
+the pointer files in the working tree; otherwise the pointers stay and the
+objects wait in the store (``git lfs checkout`` works offline later).
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from http_engine import Checksum, ConnectionPool, HTTPDownloadError, download, open_url
+
+POINTER_VERSION = b"version https://git-lfs.github.com/spec/v1"
+MAX_POINTER_SIZE = 1024  # pointer files are ~130 bytes
+DEFAULT_CONCURRENCY = 8
+BATCH_SIZE = 100  # objects per batch API request
+LFS_MEDIA_TYPE = "application/vnd.git-lfs+json"
+
+
+class LFSError(Exception):
+    """Raised when the LFS server can't be used at all."""
+
+
+@dataclass
+class LFSObject:
+    oid: str
+    size: int
+
+
+@dataclass
+class LFSOptions:
+    """Per-repository ``"lfs"`` setting: ``true`` or ``{"concurrency": 8, "url": ...}``."""
+    concurrency: int = DEFAULT_CONCURRENCY
+    url: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, value) -> Optional["LFSOptions"]:
+        """
+        Raises:
+            ValueError: If the setting is malformed
+        """
+        if not value:
+            return None
+        if value is True:
+            return cls()
+        if not isinstance(value, dict):
+            raise ValueError(f"Invalid lfs setting {value!r}")
+        concurrency = value.get("concurrency", DEFAULT_CONCURRENCY)
+        if isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError(f"lfs concurrency must be a positive number, not {concurrency!r}")
+        return cls(concurrency, value.get("url"))
+
+
+@dataclass
+class LFSResult:
+    present: int = 0
+    fetched: int = 0
+    bytes: int = 0
+    failed: List[Tuple[str, str]] = field(default_factory=list)  # (oid, reason)
+
+    def summary(self) -> str:
+        text = f"{self.fetched} fetched, {self.present} already present"
+        if self.failed:
+            text += f", {len(self.failed)} failed"
+        return text
+
+
+def parse_pointer(data: bytes) -> Optional[LFSObject]:
+    """Return the object a pointer file refers to, or None if it isn't one."""
+    if not data.startswith(POINTER_VERSION):
+        return None
+    oid = re.search(rb"^oid sha256:([0-9a-f]{64})$", data, re.MULTILINE)
+    size = re.search(rb"^size (\d+)$", data, re.MULTILINE)
+    if not oid or not size:
+        return None
+    return LFSObject(oid.group(1).decode(), int(size.group(1)))
+
+
+def find_pointers(repo_path: Path, paths: Optional[List[str]] = None) -> List[LFSObject]:
+    """
+    LFS objects referenced by pointer files in HEAD.
+
+    Only blobs small enough to be pointers are read, in one ``cat-file``
+    batch.
+
+    Args:
+        repo_path: Repository working tree
+        paths: Limit the search to these directories (e.g. the sparse set)
+    """
+    listing = subprocess.run(["git", "-C", str(repo_path), "ls-tree", "-r", "-l", "HEAD", "--"] + (paths or []),
+                             capture_output=True, text=True, check=True).stdout
+    candidates = []
+    for line in listing.splitlines():
+        meta, _, _ = line.partition("\t")
+        parts = meta.split()
+        if len(parts) == 4 and parts[1] == "blob" and parts[3].isdigit() and int(parts[3]) <= MAX_POINTER_SIZE:
+            candidates.append(parts[2])
+    if not candidates:
+        return []
+
+    output = subprocess.run(["git", "-C", str(repo_path), "cat-file", "--batch"],
+                            input="\n".join(candidates).encode() + b"\n",
+                            capture_output=True, check=True).stdout
+    objects: Dict[str, LFSObject] = {}
+    position = 0
+    for _ in candidates:
+        header_end = output.index(b"\n", position)
+        header = output[position:header_end].split()
+        if len(header) < 3:  # "<sha> missing"
+            position = header_end + 1
+            continue
+        size = int(header[2])
+        content = output[header_end + 1:header_end + 1 + size]
+        position = header_end + 1 + size + 1
+        pointer = parse_pointer(content)
+        if pointer:
+            objects[pointer.oid] = pointer
+    return list(objects.values())
+
+
+def lfs_dir(repo_path: Path) -> Path:
+    return repo_path / ".git" / "lfs"
+
+
+def object_path(repo_path: Path, oid: str) -> Path:
+    return lfs_dir(repo_path) / "objects" / oid[:2] / oid[2:4] / oid
+
+
+def endpoint(url: str, options: LFSOptions) -> Optional[str]:
+    """The LFS API endpoint: the configured one or the one derived from an HTTP(S) remote URL."""
+    if options.url:
+        return options.url.rstrip("/")
+    if not url.startswith(("http://", "https://")):
+        return None
+    url = url.rstrip("/")
+    return f"{url}/info/lfs" if url.endswith(".git") else f"{url}.git/info/lfs"
+
+
+def batch(api: str, objects: List[LFSObject], pool: ConnectionPool) -> List[Dict]:
+    """
+    Ask the batch API for download actions.
+
+    Raises:
+        LFSError: If the request fails
+    """
+    body = json.dumps({"operation": "download", "transfers": ["basic"],
+                       "objects": [{"oid": o.oid, "size": o.size} for o in objects]}).encode()
+    headers = {"Accept": LFS_MEDIA_TYPE, "Content-Type": LFS_MEDIA_TYPE}
+    try:
+        response = open_url(f"{api}/objects/batch", method="POST", headers=headers, pool=pool, body=body)
+    except (OSError, HTTPDownloadError) as e:
+        raise LFSError(f"LFS batch request failed: {e}")
+    try:
+        data = b""
+        while True:
+            chunk = response.read(65536)
+            if not chunk:
+                break
+            data += chunk
+        if response.status != 200:
+            raise LFSError(f"LFS batch request failed with HTTP {response.status}")
+    finally:
+        response.close()
+    try:
+        return json.loads(data).get("objects", [])
+    except ValueError:
+        raise LFSError("LFS server sent an invalid batch response")
+
+
+def fetch_object(repo_path: Path, item: Dict, pool: ConnectionPool, throttle=None):
+    """
+    Download one object into the store.
+
+    Raises:
+        HTTPDownloadError: If the download fails or the content doesn't match the oid
+    """
+    oid = item["oid"]
+    action = (item.get("actions") or {}).get("download")
+    if not action:
+        error = item.get("error", {})
+        raise HTTPDownloadError(error.get("message") or "no download action")
+    partial = lfs_dir(repo_path) / "incomplete" / oid
+    download(action["href"], partial, pool=pool, headers=action.get("header"),
+             checksum=Checksum("sha256", oid), throttle=throttle)
+    target = object_path(repo_path, oid)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(partial, target)
+
+
+def fetch(repo_path: Path, url: str, options: LFSOptions, paths: Optional[List[str]] = None,
+          throttle=None) -> LFSResult:
+    """
+    Fetch the missing LFS objects of a repository's checked-out commit.
+
+    Args:
+        repo_path: Repository working tree
+        url: Remote URL (used to derive the LFS endpoint)
+        options: Concurrency and endpoint settings
+        paths: Limit to these directories
+        throttle: Bandwidth throttle shared by all object downloads
+
+    Returns:
+        Counts of present, fetched and failed objects
+
+    Raises:
+        LFSError: If there are objects to fetch but no usable LFS endpoint
+    """
+    result = LFSResult()
+    missing = []
+    for obj in find_pointers(repo_path, paths):
+        target = object_path(repo_path, obj.oid)
+        if target.exists() and target.stat().st_size == obj.size:
+            result.present += 1
+        else:
+            missing.append(obj)
+    if not missing:
+        return result
+
+    api = endpoint(url, options)
+    if not api:
+        raise LFSError(f"No LFS endpoint for {url}; set \"lfs\": {{\"url\": ...}}")
+    pool = ConnectionPool(max_idle_per_host=options.concurrency)
+    sizes = {obj.oid: obj.size for obj in missing}
+    try:
+        with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+            futures = []
+            for start in range(0, len(missing), BATCH_SIZE):
+                for item in batch(api, missing[start:start + BATCH_SIZE], pool):
+                    if item.get("oid") in sizes:
+                        future = executor.submit(fetch_object, repo_path, item, pool, throttle)
+                        futures.append((item["oid"], future))
+            for oid, future in futures:
+                try:
+                    future.result()
+                    result.fetched += 1
+                    result.bytes += sizes[oid]
+                except (OSError, HTTPDownloadError) as e:
+                    result.failed.append((oid, str(e)))
+    finally:
+        pool.close()
+    answered = {oid for oid, _ in futures}
+    result.failed += [(oid, "not in batch response") for oid in sizes if oid not in answered]
+    return result
+
+
+def checkout(repo_path: Path) -> bool:
+    """Replace pointer files with their content if git-lfs is installed."""
+    if not shutil.which("git-lfs"):
+        return False
+    subprocess.run(["git", "-C", str(repo_path), "lfs", "checkout"], capture_output=True, check=True)
+    return True
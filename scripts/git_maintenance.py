@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Git Repository Maintenance
+Part of EmergencyStorage - Keeps fetches fast on repositories that are pulled for years
+
+Repositories that are pulled daily collect loose objects and many small
+packs. The maintenance steps here are the incremental ones that git's own
+``maintenance`` command uses, run one repository at a time:
+
+1. ``repack -d -l``: pack loose objects into one new pack, leaving existing
+   packs (and objects borrowed from a family store) alone
+2. ``multi-pack-index write``/``expire``: index all packs together and drop
+   packs whose objects are all in newer ones
+3. ``multi-pack-index repack``: merge the small packs into one, in batches
+   no bigger than the second-largest pack
+4. ``commit-graph write --reachable --split``: append to the commit-graph
+
+None of these rewrites the large packs, so the cost stays proportional to
+what arrived since the last run.
+"""
+
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class TimeBoxExceeded(Exception):
+    """Raised when a maintenance step runs into the end of the time box."""
+
+
+def object_stats(repo_path: Path) -> Dict[str, int]:
+    """Loose object and pack counts from ``git count-objects -v``."""
+    result = subprocess.run(["git", "-C", str(repo_path), "count-objects", "-v"],
+                            capture_output=True, text=True)
+    stats = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition(":")
+        if value.strip().isdigit():
+            stats[key.strip()] = int(value)
+    return {"loose": stats.get("count", 0), "packs": stats.get("packs", 0)}
+
+
+def pack_sizes(repo_path: Path) -> List[int]:
+    pack_dir = repo_path / ".git" / "objects" / "pack"
+    return sorted((pack.stat().st_size for pack in pack_dir.glob("*.pack")), reverse=True)
+
+
+def maintenance_steps(repo_path: Path) -> List[Tuple[str, Callable[[], Optional[List[str]]]]]:
+    """
+    The steps for a repository as (name, builder). Each builder is called
+    right before its step, as it depends on the packs the earlier steps left,
+    and returns the git arguments or None to skip the step.
+    """
+    return [("repack", lambda: ["repack", "-d", "-l", "-q"]),
+            ("multi-pack-index", lambda: ["multi-pack-index", "write"] if pack_sizes(repo_path) else None),
+            ("expire", lambda: ["multi-pack-index", "expire"] if pack_sizes(repo_path) else None),
+            ("incremental-repack", lambda: _repack_batch(repo_path)),
+            ("commit-graph", lambda: ["commit-graph", "write", "--reachable", "--split"])]
+
+
+def _repack_batch(repo_path: Path) -> Optional[List[str]]:
+    sizes = pack_sizes(repo_path)
+    if len(sizes) < 3:
+        return None
+    # Like git maintenance: batches stay below the second-largest pack, so
+    # the big packs are never rewritten
+    return ["multi-pack-index", "repack", f"--batch-size={sizes[1] + 1}"]
+
+
+def maintain(repo_path: Path, deadline: float) -> Dict:
+    """
+    Run the maintenance steps on one repository.
+
+    Args:
+        repo_path: Repository working tree
+        deadline: ``time.monotonic()`` value at which work must stop
+
+    Returns:
+        Record of the run: steps completed, outcome, object counts before and
+        after, duration
+    """
+    started = time.monotonic()
+    before = object_stats(repo_path)
+    done = []
+    outcome = "success"
+    error = None
+    for name, build in maintenance_steps(repo_path):
+        args = build()
+        if args is None:
+            continue
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise TimeBoxExceeded()
+            result = subprocess.run(["git", "-C", str(repo_path)] + args, capture_output=True,
+                                    text=True, timeout=remaining)
+        except (TimeBoxExceeded, subprocess.TimeoutExpired):
+            outcome = "time box reached"
+            break
+        if result.returncode != 0:
+            outcome = "failed"
+            error = f"{name}: {result.stderr.strip() or f'return code {result.returncode}'}"
+            break
+        done.append(name)
+    after = object_stats(repo_path)
+    record = {
+        "last_run": datetime.now().isoformat(timespec="seconds"),
+        "duration": round(time.monotonic() - started, 3),
+        "steps": done,
+        "outcome": outcome,
+        "loose_before": before["loose"],
+        "loose_after": after["loose"],
+        "packs_before": before["packs"],
+        "packs_after": after["packs"],
+    }
+    if error:
+        record["error"] = error
+    return record
+
+
+def select_repositories(names: List[str], state: Dict[str, Dict], budget: int) -> List[str]:
+    """
+    Pick up to ``budget`` repositories, never-maintained first, then the
+    longest-unmaintained; ties keep the given order.
+    """
+    return sorted(names, key=lambda name: state.get(name, {}).get("last_run", ""))[:budget]
@@ -0,0 +1,881 @@
+#!/usr/bin/env python3
+"""
+Native HTTP Download Engine
+Part of EmergencyStorage - In-process HTTP(S) downloads with resume and connection reuse
+
+Downloads are streamed to disk in large fixed-size buffers over keep-alive
+connections that are pooled per host, so many files from the same server share
+one TCP/TLS session instead of spawning a wget/curl process each. Partial files
+are resumed with HTTP Range requests.
+
+Very large files can be fetched in segments: the file is split into byte
+ranges that are downloaded concurrently into a preallocated file, and only
+segments that failed are retried.
+
+A MetadataCache remembers ETag/Last-Modified/Content-Length per URL so repeat
+downloads can be made conditional; an unchanged file costs one 304 round trip.
+
+An expected SHA-256/MD5 digest can be given per download. It is computed from
+the chunks as they are written, so verification needs no second pass over
+the file; a mismatch deletes the file and raises ChecksumMismatch. Only data
+not received in order is read back: the part of a resumed file already on
+disk, a file a 416 answer shows to be complete, and segmented downloads.
+
+A ``throttle`` (see bandwidth.py) paces a download to its bandwidth share.
+"""
+
+import hashlib
+import http.client
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from state_store import atomic_write_json, load_json_state
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MiB write buffer
+DEFAULT_TIMEOUT = 60
+MAX_REDIRECTS = 10
+USER_AGENT = "EmergencyStorage/1.0"
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024  # don't split files into pieces smaller than this
+SEGMENT_STATE_INTERVAL = 5.0  # seconds between segment state checkpoints
+CHECKSUM_ALGORITHMS = {"sha256": 64, "md5": 32}  # supported digests and their hex length
+
+PoolKey = Tuple[str, str, int]
+
+
+class HTTPDownloadError(Exception):
+    """Raised when a download cannot be completed."""
+
+
+class ChecksumMismatch(HTTPDownloadError):
+    """Raised when downloaded data does not match its expected digest."""
+
+
+class DownloadAborted(HTTPDownloadError):
+    """Raised by a progress callback (e.g. a watchdog) to stop a download without retrying."""
+
+
+class ResourceChanged(HTTPDownloadError):
+    """Raised when a resource changes upstream while its ranges are being downloaded."""
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of a single download."""
+    url: str
+    path: Path
+    status: int
+    bytes_written: int
+    total_size: Optional[int]
+    resumed: bool = False
+    digest: Optional[str] = None
+
+
+@dataclass
+class Checksum:
+    """Expected digest of a download."""
+    algorithm: str
+    expected: str
+
+    @classmethod
+    def from_config(cls, info: Dict) -> Optional["Checksum"]:
+        """
+        Read optional ``sha256``/``md5`` fields (SHA-256 wins if both are set).
+
+        Raises:
+            ValueError: If a digest is not a hex string of the right length
+        """
+        for algorithm, length in CHECKSUM_ALGORITHMS.items():
+            value = info.get(algorithm)
+            if value is None:
+                continue
+            value = str(value).strip().lower()
+            if not re.fullmatch(f"[0-9a-f]{{{length}}}", value):
+                raise ValueError(f"Invalid {algorithm} checksum: {info.get(algorithm)!r}")
+            return cls(algorithm, value)
+        return None
+
+    def hasher(self):
+        return hashlib.new(self.algorithm)
+
+    def verify(self, hasher, path: Path) -> str:
+        """
+        Compare a finished digest with the expected one.
+
+        On a mismatch the file is deleted, so it is neither kept nor resumed.
+
+        Returns:
+            The hex digest
+
+        Raises:
+            ChecksumMismatch: If the digests differ
+        """
+        actual = hasher.hexdigest()
+        if actual != self.expected:
+            Path(path).unlink(missing_ok=True)
+            raise ChecksumMismatch(
+                f"{self.algorithm} mismatch for {Path(path).name}: expected {self.expected}, got {actual}")
+        return actual
+
+
+def hash_file(hasher, path: Path, length: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Feed the first ``length`` bytes of a file (all of it by default) into ``hasher``."""
+    with open(path, "rb") as f:
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections, keyed by scheme/host/port.
+
+    Idle connections are handed back out to the next request for the same
+    host. Connections whose response asked to close are discarded.
+    """
+
+    def __init__(self, max_idle_per_host: int = 4, timeout: float = DEFAULT_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[PoolKey, List[http.client.HTTPConnection]] = {}
+
+    def acquire(self, key: PoolKey) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Get a connection for ``key``.
+
+        Returns:
+            Tuple of (connection, reused) where reused tells whether the
+            connection came from the idle pool
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self.connect(key), False
+
+    def connect(self, key: PoolKey) -> http.client.HTTPConnection:
+        """Open a new, unpooled connection for ``key``."""
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def release(self, key: PoolKey, conn: http.client.HTTPConnection, reusable: bool = True):
+        """Return a connection to the pool, closing it if it can't be reused."""
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle_per_host:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+_default_pool: Optional[ConnectionPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool() -> ConnectionPool:
+    """Return the process-wide connection pool."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool()
+        return _default_pool
+
+
+def pool_key(url: str) -> Tuple[PoolKey, str]:
+    """
+    Split a URL into its pool key and request target.
+
+    Returns:
+        Tuple of ((scheme, host, port), path_with_query)
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        raise HTTPDownloadError(f"Unsupported URL: {url}")
+    port = parts.port or (443 if scheme == "https" else 80)
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    return (scheme, parts.hostname, port), target
+
+
+class Response:
+    """An open response together with the pooled connection it came from."""
+
+    def __init__(self, pool: ConnectionPool, key: PoolKey, conn: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse, url: str):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+
+    def header(self, name: str) -> Optional[str]:
+        return self.response.getheader(name)
+
+    def read(self, size: int) -> bytes:
+        return self.response.read(size)
+
+    def close(self):
+        """Release the connection, keeping it alive if the body was fully read."""
+        reusable = self.response.isclosed() and not self.response.will_close
+        if not reusable:
+            self.response.close()
+        self.pool.release(self.key, self.conn, reusable)
+
+
+def open_url(url: str, method: str = "GET", headers: Optional[Dict[str, str]] = None,
+             pool: Optional[ConnectionPool] = None, body: Optional[bytes] = None) -> Response:
+    """
+    Send a request over a pooled connection, following redirects.
+
+    Args:
+        url: http:// or https:// URL
+        method: HTTP method
+        headers: Extra request headers
+        pool: Connection pool (defaults to the process-wide pool)
+        body: Request body (dropped when a 303 redirect turns the request into a GET)
+
+    Returns:
+        Open Response; callers must close() it
+    """
+    pool = pool or default_pool()
+    request_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+    request_headers.update(headers or {})
+
+    for _ in range(MAX_REDIRECTS + 1):
+        key, target = pool_key(url)
+        conn, reused = pool.acquire(key)
+        try:
+            conn.request(method, target, body=body, headers=request_headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection; retry on a fresh one
+            conn = pool.connect(key)
+            try:
+                conn.request(method, target, body=body, headers=request_headers)
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+            location = urljoin(url, response.getheader("Location"))
+            response.read()
+            pool.release(key, conn, not response.will_close)
+            if response.status == 303:
+                method = "GET"
+                body = None
+            url = location
+            continue
+
+        return Response(pool, key, conn, response, url)
+
+    raise HTTPDownloadError(f"Too many redirects for {url}")
+
+
+class MetadataCache:
+    """
+    Persistent per-URL cache of response validators.
+
+    Entries hold ``etag``, ``last_modified`` and ``content_length`` and are
+    used to build If-None-Match/If-Modified-Since/If-Range headers. Keys are
+    normally the URL; callers that keep several local copies of one URL use
+    distinct keys so each copy is revalidated on its own.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict] = load_json_state(self.path, {})
+        self.dirty = False
+
+    def get(self, url: str) -> Dict:
+        with self.lock:
+            return dict(self.entries.get(url, {}))
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """Headers asking the server to answer 304 if ``url`` is unchanged."""
+        entry = self.get(url)
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def remember(self, url: str, etag: Optional[str], last_modified: Optional[str],
+                 content_length: Optional[int]):
+        """Store validators for ``url``; entries without any validator are dropped."""
+        with self.lock:
+            if etag or last_modified:
+                self.entries[url] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "content_length": content_length,
+                }
+            else:
+                self.entries.pop(url, None)
+            self.dirty = True
+
+    def forget(self, url: str):
+        with self.lock:
+            if self.entries.pop(url, None) is not None:
+                self.dirty = True
+
+    def save(self):
+        """Write the cache to disk if it changed."""
+        with self.lock:
+            if self.dirty:
+                atomic_write_json(self.path, self.entries)
+                self.dirty = False
+
+
+def check_modified(url: str, cache: MetadataCache, pool: Optional[ConnectionPool] = None,
+                   cache_key: Optional[str] = None, conditional: bool = True) -> Optional[Dict]:
+    """
+    Ask the server whether ``url`` changed since it was cached, using a conditional HEAD.
+
+    Args:
+        url: http:// or https:// URL
+        cache: Validator cache
+        pool: Connection pool (defaults to the process-wide pool)
+        cache_key: Cache entry to use (defaults to the URL)
+        conditional: Send the cached validators; if False only fetch fresh ones
+
+    Returns:
+        None if the server answered 304 Not Modified, otherwise the current
+        validators (possibly empty) to remember once the download succeeded
+    """
+    headers = cache.conditional_headers(cache_key or url) if conditional else {}
+    response = open_url(url, method="HEAD", headers=headers, pool=pool)
+    try:
+        if response.status == 304:
+            return None
+        if response.status != 200:
+            return {}
+        length = response.header("Content-Length")
+        return {
+            "etag": response.header("ETag"),
+            "last_modified": response.header("Last-Modified"),
+            "content_length": int(length) if length is not None else None,
+        }
+    finally:
+        response.close()
+
+
+def if_range_value(validators: Dict) -> Optional[str]:
+    """The If-Range validator for cached ``etag``/``last_modified``: a strong ETag, else the date."""
+    etag = validators.get("etag")
+    return etag if etag and not etag.startswith("W/") else validators.get("last_modified")
+
+
+def unsatisfied_range_size(value: Optional[str]) -> Optional[int]:
+    """The size in a 416 response's ``Content-Range: bytes */N`` header."""
+    match = re.match(r"^bytes \*/(\d+)$", (value or "").strip())
+    return int(match.group(1)) if match else None
+
+
+def filename_from_url(url: str) -> str:
+    """Derive a local file name from a URL, like wget does."""
+    name = os.path.basename(urlsplit(url).path)
+    return name or "index.html"
+
+
+def download(url: str, dest: Path, pool: Optional[ConnectionPool] = None,
+             resume: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE,
+             headers: Optional[Dict[str, str]] = None,
+             progress: Optional[Callable[[int, Optional[int]], None]] = None,
+             cache: Optional[MetadataCache] = None,
+             cache_key: Optional[str] = None,
+             checksum: Optional[Checksum] = None,
+             throttle=None) -> DownloadResult:
+    """
+    Download a URL to ``dest``, resuming a partial file with a Range request.
+
+    With a ``cache``, a complete local copy is revalidated with
+    If-None-Match/If-Modified-Since (a 304 transfers nothing), and a partial
+    copy is only resumed if the server still has the same version (If-Range).
+    A partial copy the server answers with 416 is complete only if it has the
+    size the server reports; otherwise it is downloaded again from the start.
+
+    With a ``checksum``, the digest is updated with every chunk written; only
+    the already present part of a resumed file, or a file found complete on a
+    416, is read back. An unchanged (304) file was verified when it was
+    downloaded and is not hashed again.
+
+    Args:
+        url: http:// or https:// URL
+        dest: Destination file
+        pool: Connection pool (defaults to the process-wide pool)
+        resume: Continue an existing partial file instead of starting over
+        chunk_size: Size of the read/write buffer in bytes
+        headers: Extra request headers
+        progress: Called as progress(bytes_on_disk, total_size) after every chunk
+        cache: Validator cache for conditional requests
+        cache_key: Cache entry to use (defaults to the URL)
+        checksum: Expected digest of the complete file
+        throttle: Object whose ``consume(bytes)`` paces the transfer
+
+    Returns:
+        DownloadResult describing what was transferred (status 304 if unchanged)
+
+    Raises:
+        HTTPDownloadError: On HTTP errors or incomplete transfers
+        ChecksumMismatch: If the file does not match ``checksum``
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    offset = dest.stat().st_size if resume and dest.exists() else 0
+    cache_key = cache_key or url
+    entry = cache.get(cache_key) if cache and dest.exists() else {}
+
+    request_headers = dict(headers or {})
+    if entry and entry.get("content_length") == dest.stat().st_size:
+        # Complete copy on disk: only transfer it again if upstream changed
+        request_headers.update(cache.conditional_headers(cache_key))
+        offset = 0
+    elif offset:
+        request_headers["Range"] = f"bytes={offset}-"
+        validator = if_range_value(entry)
+        if validator:
+            request_headers["If-Range"] = validator
+
+    response = open_url(url, headers=request_headers, pool=pool)
+    if response.status == 416 and offset:
+        try:
+            response.read(chunk_size)
+            remote_size = unsatisfied_range_size(response.header("Content-Range"))
+        finally:
+            response.close()
+        if remote_size == offset:
+            # Requested range starts exactly at the end: the file is already complete
+            digest = None
+            if checksum:
+                digest = checksum.verify(hash_file(checksum.hasher(), dest), dest)
+            return DownloadResult(response.url, dest, response.status, 0, offset, resumed=True,
+                                  digest=digest)
+        # The local file is larger than the remote one (or of another version): start over
+        if cache:
+            cache.forget(cache_key)
+        return download(url, dest, pool=pool, resume=False, chunk_size=chunk_size, headers=headers,
+                        progress=progress, cache=cache, cache_key=cache_key, checksum=checksum,
+                        throttle=throttle)
+
+    try:
+        if response.status == 304:
+            response.read(chunk_size)
+            size = dest.stat().st_size
+            return DownloadResult(response.url, dest, response.status, 0, size, resumed=False)
+
+        if response.status not in (200, 206):
+            response.read(chunk_size)
+            raise HTTPDownloadError(f"HTTP {response.status} for {response.url}")
+
+        resumed = response.status == 206
+        if not resumed:
+            offset = 0
+
+        length = response.header("Content-Length")
+        total = offset + int(length) if length is not None else None
+
+        hasher = None
+        if checksum:
+            hasher = checksum.hasher()
+            if resumed:
+                hash_file(hasher, dest, offset, chunk_size)
+
+        written = 0
+        with open(dest, "ab" if resumed else "wb") as f:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if hasher:
+                    hasher.update(chunk)
+                written += len(chunk)
+                if progress:
+                    progress(offset + written, total)
+                if throttle:
+                    throttle.consume(len(chunk))
+
+        if total is not None and offset + written < total:
+            raise HTTPDownloadError(
+                f"Incomplete download of {response.url}: {offset + written} of {total} bytes")
+
+        digest = None
+        if checksum:
+            try:
+                digest = checksum.verify(hasher, dest)
+            except ChecksumMismatch:
+                if cache:
+                    cache.forget(cache_key)
+                raise
+
+        if cache:
+            cache.remember(cache_key, response.header("ETag"), response.header("Last-Modified"),
+                           offset + written)
+
+        return DownloadResult(response.url, dest, response.status, written, total, resumed, digest)
+    finally:
+        response.close()
+
+
+def probe(url: str, pool: Optional[ConnectionPool] = None) -> Tuple[str, Optional[int], bool, Dict]:
+    """
+    Find the final URL, size, Range support and validators of a resource.
+
+    Sends a one-byte Range request, which works on servers that don't
+    answer HEAD properly and resolves redirects once for all segments.
+
+    Returns:
+        Tuple of (final_url, size or None, accepts_ranges, validators), where
+        validators holds the ``etag`` and ``last_modified`` of the response
+    """
+    response = open_url(url, headers={"Range": "bytes=0-0"}, pool=pool)
+    try:
+        validators = {"etag": response.header("ETag"), "last_modified": response.header("Last-Modified")}
+        if response.status == 206:
+            match = re.match(r"bytes\s+\d+-\d+/(\d+)", response.header("Content-Range") or "")
+            response.read(DEFAULT_CHUNK_SIZE)
+            if match:
+                return response.url, int(match.group(1)), True, validators
+            return response.url, None, False, validators
+        if response.status == 200:
+            length = response.header("Content-Length")
+            return response.url, int(length) if length is not None else None, False, validators
+        raise HTTPDownloadError(f"HTTP {response.status} for {response.url}")
+    finally:
+        response.close()
+
+
+def segment_state_path(dest: Path) -> Path:
+    """Return the file recording segment progress for ``dest``."""
+    dest = Path(dest)
+    return dest.with_name(dest.name + ".segments")
+
+
+def plan_segments(size: int, count: int, start: int = 0,
+                  min_size: int = MIN_SEGMENT_SIZE) -> List[List[int]]:
+    """
+    Split ``[start, size)`` into up to ``count`` byte ranges of at least ``min_size``.
+
+    Returns:
+        List of [first_byte, last_byte, bytes_done] entries
+    """
+    remaining = size - start
+    count = max(1, min(count, remaining // max(1, min_size)))
+    step = -(-remaining // count)
+    segments = []
+    if start:
+        segments.append([0, start - 1, start])
+    for first in range(start, size, step):
+        segments.append([first, min(first + step, size) - 1, 0])
+    return segments
+
+
+def segmented_download(url: str, dest: Path, segments: int = 4,
+                       pool: Optional[ConnectionPool] = None, max_retries: int = 3,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       min_segment_size: int = MIN_SEGMENT_SIZE,
+                       progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                       checksum: Optional[Checksum] = None,
+                       throttle=None, resume: bool = True,
+                       cache: Optional[MetadataCache] = None,
+                       cache_key: Optional[str] = None) -> DownloadResult:
+    """
+    Download a URL over several concurrent Range requests.
+
+    The destination is sized up front and every segment writes into its own
+    region of it. Progress is checkpointed to a ``.segments`` file next to
+    the destination together with the size and ETag/Last-Modified of the
+    resource, and an interrupted download resumes only the unfinished ranges
+    if all of them still match. Every range request carries If-Range, so a
+    resource that changes mid-transfer is downloaded again from the start.
+
+    A local file without segment state is only trusted if ``cache`` holds the
+    same validators for it: a complete copy is then not transferred again
+    (status 304), and a shorter one (e.g. from ``curl -C -``) is treated as
+    one finished leading segment. Any other file is truncated and downloaded
+    from the start, as is everything from a server that sends no validators.
+    Falls back to download() when the server doesn't support ranges.
+
+    Segments arrive out of order, so a ``checksum`` is computed in one
+    sequential read once all of them are written, while the data is
+    usually still in the page cache.
+
+    Args:
+        url: http:// or https:// URL
+        dest: Destination file
+        segments: Number of concurrent connections
+        pool: Connection pool (defaults to the process-wide pool)
+        max_retries: Times a failed segment is retried before giving up
+        chunk_size: Size of the read/write buffer in bytes
+        min_segment_size: Smallest byte range worth its own connection
+        progress: Called as progress(bytes_on_disk, total_size)
+        checksum: Expected digest of the complete file
+        throttle: Object whose ``consume(bytes)`` paces all segments together
+        resume: Continue an interrupted or partial download instead of starting over
+        cache: Validator cache for the local copy
+        cache_key: Cache entry to use (defaults to the URL)
+
+    Returns:
+        DownloadResult describing what was transferred (status 304 if unchanged)
+
+    Raises:
+        HTTPDownloadError: If some segments still fail after all retries
+        ChecksumMismatch: If the file does not match ``checksum``
+        DownloadAborted: If ``progress`` aborted the download; the other
+            segments are stopped and nothing is retried
+        ResourceChanged: If the resource changed again during the fresh
+            download that followed a change
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    pool = pool or default_pool()
+    cache_key = cache_key or url
+    final_url, size, ranges, validators = probe(url, pool)
+
+    if not ranges or not size or segments <= 1:
+        return download(final_url, dest, pool=pool, resume=resume, chunk_size=chunk_size,
+                        progress=progress, cache=cache, cache_key=cache_key, checksum=checksum,
+                        throttle=throttle)
+
+    state_file = segment_state_path(dest)
+    if_range = if_range_value(validators)
+    plan = None
+    if resume and if_range and dest.exists():
+        state = load_json_state(state_file, {})
+        entry = cache.get(cache_key) if cache else {}
+        if state:
+            if state.get("size") == size and all(state.get(k) == validators[k] for k in validators):
+                plan = state.get("segments")
+        elif entry.get("content_length") == size and all(entry.get(k) == validators[k] for k in validators):
+            existing = dest.stat().st_size
+            if existing == size:
+                return DownloadResult(final_url, dest, 304, 0, size, resumed=False)
+            if existing < size:
+                plan = plan_segments(size, segments, existing, min_segment_size)
+    fresh = plan is None
+    if fresh:
+        plan = plan_segments(size, segments, min_size=min_segment_size)
+
+    lock = threading.Lock()
+    stop = threading.Event()
+    already_done = sum(seg[2] for seg in plan)
+    last_checkpoint = [time.monotonic()]
+
+    def checkpoint(force: bool = False):
+        now = time.monotonic()
+        if force or now - last_checkpoint[0] >= SEGMENT_STATE_INTERVAL:
+            last_checkpoint[0] = now
+            atomic_write_json(state_file, {"url": url, "size": size, **validators, "segments": plan})
+
+    def fetch(segment: List[int]):
+        first, last, _ = segment
+        if first + segment[2] > last:
+            return
+        headers = {"Range": f"bytes={first + segment[2]}-{last}"}
+        if if_range:
+            headers["If-Range"] = if_range
+        response = open_url(final_url, headers=headers, pool=pool)
+        try:
+            if response.status == 200 and if_range:
+                # If-Range didn't match: the server sends the new version in full
+                raise ResourceChanged(f"{final_url} changed upstream during the download")
+            if response.status != 206:
+                raise HTTPDownloadError(f"HTTP {response.status} for range of {final_url}")
+            while first + segment[2] <= last:
+                if stop.is_set():
+                    raise DownloadAborted(f"Segment {first}-{last} stopped")
+                chunk = response.read(min(chunk_size, last - first - segment[2] + 1))
+                if not chunk:
+                    raise HTTPDownloadError(f"Connection closed in segment {first}-{last}")
+                os.pwrite(fd, chunk, first + segment[2])
+                with lock:
+                    segment[2] += len(chunk)
+                    if progress:
+                        progress(sum(seg[2] for seg in plan), size)
+                    checkpoint()
+                if throttle:
+                    throttle.consume(len(chunk))
+        finally:
+            response.close()
+
+    try:
+        # Anything not resumed is truncated first, so no stale bytes survive in it
+        with open(dest, 'w+b' if fresh else 'r+b') as f:
+            f.truncate(size)
+            fd = f.fileno()
+            with lock:
+                checkpoint(force=True)
+
+            errors: List[Exception] = []
+            for _ in range(max_retries + 1):
+                pending = [seg for seg in plan if seg[0] + seg[2] <= seg[1]]
+                if not pending:
+                    break
+                errors = []
+                try:
+                    with ThreadPoolExecutor(max_workers=min(segments, len(pending))) as executor:
+                        futures = [executor.submit(fetch, seg) for seg in pending]
+                        for future in futures:
+                            try:
+                                future.result()
+                            except (DownloadAborted, ResourceChanged):
+                                # Not a segment failure: stop the others and don't retry
+                                stop.set()
+                                for other in futures:
+                                    other.cancel()
+                                raise
+                            except Exception as e:
+                                errors.append(e)
+                finally:
+                    with lock:
+                        checkpoint(force=True)
+
+            pending = [seg for seg in plan if seg[0] + seg[2] <= seg[1]]
+            if pending:
+                raise HTTPDownloadError(
+                    f"{len(pending)} segment(s) of {final_url} failed after {max_retries} retries: {errors[-1]}")
+            f.flush()
+            os.fsync(fd)
+    except ResourceChanged:
+        state_file.unlink(missing_ok=True)
+        if cache:
+            cache.forget(cache_key)
+        if not resume:
+            raise
+        return segmented_download(url, dest, segments, pool=pool, max_retries=max_retries,
+                                  chunk_size=chunk_size, min_segment_size=min_segment_size,
+                                  progress=progress, checksum=checksum, throttle=throttle,
+                                  resume=False, cache=cache, cache_key=cache_key)
+
+    state_file.unlink()
+    digest = None
+    if checksum:
+        try:
+            digest = checksum.verify(hash_file(checksum.hasher(), dest), dest)
+        except ChecksumMismatch:
+            if cache:
+                cache.forget(cache_key)
+            raise
+    if cache:
+        cache.remember(cache_key, validators["etag"], validators["last_modified"], size)
+    written = size - already_done
+    return DownloadResult(final_url, dest, 206, written, size, resumed=already_done > 0, digest=digest)
+
+
+def main():
+    """Command-line entry point used by the shell download scripts"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Download a file with the native HTTP engine"
+    )
+    parser.add_argument("url", help="http:// or https:// URL to download")
+    parser.add_argument("dest", help="Destination file")
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="Number of concurrent byte-range connections (default: 1)"
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="Validator cache; a re-run then skips an unchanged file and resumes a partial one"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries for failed segments (default: 3)"
+    )
+    for algorithm in CHECKSUM_ALGORITHMS:
+        parser.add_argument(
+            f"--{algorithm}",
+            metavar="HEX",
+            help=f"Expected {algorithm} digest; the file is deleted if it doesn't match"
+        )
+
+    args = parser.parse_args()
+    try:
+        checksum = Checksum.from_config({"sha256": args.sha256, "md5": args.md5})
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Shell scripts run by auto_update.py pass their bandwidth share down
+    from bandwidth import Governor
+    governor = Governor.from_environment(config_path=None)
+    throttle = governor.throttle()
+    if throttle:
+        print(f"  Bandwidth: {governor.describe()}", flush=True)
+    last_report = [0.0]
+
+    def progress(done: int, total: Optional[int]):
+        now = time.monotonic()
+        if now - last_report[0] >= 10 or done == total:
+            last_report[0] = now
+            if total:
+                print(f"  {done / 1024 / 1024:.1f} MB of {total / 1024 / 1024:.1f} MB "
+                      f"({done * 100 / total:.1f}%)", flush=True)
+            else:
+                print(f"  {done / 1024 / 1024:.1f} MB", flush=True)
+
+    cache = MetadataCache(Path(args.cache)) if args.cache else None
+    try:
+        if args.segments > 1:
+            result = segmented_download(args.url, Path(args.dest), args.segments,
+                                        max_retries=args.retries, progress=progress,
+                                        checksum=checksum, throttle=throttle, cache=cache)
+        else:
+            result = download(args.url, Path(args.dest), progress=progress, cache=cache,
+                              checksum=checksum, throttle=throttle)
+    except (HTTPDownloadError, OSError, http.client.HTTPException) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if cache:
+            cache.save()
+
+    print(f"Downloaded {result.bytes_written} bytes to {result.path}")
+    if result.digest:
+        print(f"Verified {checksum.algorithm}: {result.digest}")
+
+
+if __name__ == "__main__":
+    main()
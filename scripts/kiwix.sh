@@ -56,8 +56,9 @@ download_from_master() {
     
     if timeout 60 rsync --dry-run -v "master.download.kiwix.org::download.kiwix.org/" &>/dev/null; then
         log_info "Master mirror is accessible, starting download..."
+        report_checkpoint "master"
         
-        if rsync -vzrlptD --delete --info=progress2 "master.download.kiwix.org::download.kiwix.org/" "$kiwix_path/"; then
+        if rsync $(rate_limit_args rsync) -vzrlptD --delete --partial-dir=.rsync-partial --info=progress2 "master.download.kiwix.org::download.kiwix.org/" "$kiwix_path/"; then
             log_success "Kiwix mirror download completed successfully from master mirror!"
             return 0
         else
@@ -70,6 +71,27 @@ download_from_master() {
     fi
 }
 
+# Function to continue on the rsync mirror a failed attempt was syncing
+# from; its partial files in .rsync-partial are picked up where they stopped
+resume_from_checkpoint() {
+    local kiwix_path="$1"
+    local checkpoint="${EMERGENCY_STORAGE_CHECKPOINT:-}"
+    
+    case "$checkpoint" in
+        "rsync "*)
+            local mirror="${checkpoint#rsync }"
+            log_info "Resuming from checkpoint on rsync mirror: $mirror"
+            report_checkpoint "rsync $mirror"
+            if rsync $(rate_limit_args rsync) -vzrlptD --delete --partial-dir=.rsync-partial --info=progress2 "$mirror" "$kiwix_path/"; then
+                log_success "Kiwix mirror download completed successfully from rsync mirror: $mirror"
+                return 0
+            fi
+            log_warning "Resumed download from rsync mirror $mirror failed"
+            ;;
+    esac
+    return 1
+}
+
 # Function to try alternative rsync mirrors
 try_rsync_mirrors() {
     local kiwix_path="$1"
@@ -91,8 +113,9 @@ try_rsync_mirrors() {
         
         if timeout 60 rsync --dry-run -v "$mirror" &>/dev/null; then
             log_info "Rsync mirror $mirror is accessible, starting download..."
+            report_checkpoint "rsync $mirror"
             
-            if rsync -vzrlptD --delete --info=progress2 "$mirror" "$kiwix_path/"; then
+            if rsync $(rate_limit_args rsync) -vzrlptD --delete --partial-dir=.rsync-partial --info=progress2 "$mirror" "$kiwix_path/"; then
                 log_success "Kiwix mirror download completed successfully from rsync mirror: $mirror"
                 return 0
             else
@@ -135,7 +158,7 @@ try_ftp_mirrors() {
             
             # Use wget for recursive FTP download if available
             if command -v wget &> /dev/null; then
-                if wget -r -np -nH --cut-dirs=1 -P "$kiwix_path" "$mirror"; then
+                if wget $(rate_limit_args wget) -r -np -nH --cut-dirs=1 -P "$kiwix_path" "$mirror"; then
                     log_success "Kiwix mirror download completed successfully from FTP mirror: $mirror"
                     return 0
                 else
@@ -175,7 +198,7 @@ try_http_mirrors() {
             log_info "HTTP mirror $mirror is accessible, starting download..."
             
             if command -v wget &> /dev/null; then
-                if wget -r -np -nH --cut-dirs=1 -P "$kiwix_path" "$mirror"; then
+                if wget $(rate_limit_args wget) -r -np -nH --cut-dirs=1 -P "$kiwix_path" "$mirror"; then
                     log_success "Kiwix mirror download completed successfully from HTTP mirror: $mirror"
                     return 0
                 else
@@ -217,6 +240,11 @@ download_kiwix() {
     
     log_info "Downloading Kiwix mirror (this may take a long time)..."
     
+    # A retry after a failed mirror sync continues on that mirror
+    if [ "$allow_mirrors" = "true" ] && resume_from_checkpoint "$kiwix_path"; then
+        return 0
+    fi
+    
     # Try master mirror first
     if download_from_master "$kiwix_path"; then
         return 0
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Background Log Writer
+Part of EmergencyStorage - Queue-backed, thread-safe log files with rotation
+
+Worker threads hand log lines to a queue and return immediately; a single
+writer thread per log file drains the queue, writes everything that has
+accumulated in one batch and flushes once per batch. The file stays open
+between batches and is rotated (``log.1``, ``log.2``, ...) when it would grow
+past a size limit.
+
+Lines are written either as text, ``[YYYY-mm-dd HH:MM:SS] LEVEL: message``,
+or as JSON lines, ``{"time": ..., "level": ..., "message": ...}``, with the
+level taken from the ``ERROR:``/``SUCCESS:``/... prefix of the message.
+"""
+
+import atexit
+import json
+import queue
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+FORMATS = ("text", "json")
+LEVELS = ("ERROR", "WARNING", "SUCCESS", "INFO")
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024  # rotate at 10 MB
+DEFAULT_BACKUPS = 3
+BATCH_SIZE = 512  # lines written per batch at most
+
+_STOP = object()
+
+
+def format_record(timestamp: datetime, message: str, fmt: str = "text") -> str:
+    """
+    Render one log line (without the newline).
+
+    Args:
+        timestamp: Time the message was logged
+        message: Message, optionally prefixed with a level such as "ERROR: "
+        fmt: "text" or "json"
+    """
+    if fmt == "json":
+        level, separator, rest = message.partition(": ")
+        if separator and level in LEVELS:
+            record = {"level": level.lower(), "message": rest}
+        else:
+            record = {"level": "info", "message": message}
+        record = {"time": timestamp.isoformat(timespec="seconds"), **record}
+        return json.dumps(record, ensure_ascii=False)
+    return f"[{timestamp.strftime('%Y-%m-%d %H:%M:%S')}] {message}"
+
+
+class LogWriter:
+    """
+    Asynchronous appender for one log file.
+
+    ``write()`` never touches the disk; ``flush()`` waits until everything
+    queued so far is written and ``close()`` stops the writer thread.
+    """
+
+    def __init__(self, path: Path, fmt: str = "text", max_bytes: int = DEFAULT_MAX_BYTES,
+                 backups: int = DEFAULT_BACKUPS):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown log format '{fmt}'")
+        self.path = Path(path)
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._file = None
+        self._size = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"log-writer:{self.path.name}",
+                                        daemon=True)
+        self._thread.start()
+
+    def write(self, message: str):
+        """Queue a message; the timestamp is taken now, not when it is written."""
+        if not self._closed:
+            self._queue.put((datetime.now(), message))
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until all messages queued before this call are on disk."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Write what is queued, close the file and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            events = []
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    events.append(item)
+                else:
+                    lines.append(format_record(item[0], item[1], self.fmt) + "\n")
+            try:
+                self._write_lines(lines)
+            except OSError as e:
+                print(f"Warning: could not write log file {self.path}: {e}", file=sys.stderr)
+                self._close_file()
+            for event in events:
+                event.set()
+        self._close_file()
+
+    def _write_lines(self, lines):
+        if not lines:
+            return
+        if self._file is None:
+            self._open()
+        for line in lines:
+            data = line.encode("utf-8")
+            if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._size += len(data)
+        self._file.flush()
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _rotate(self):
+        self._close_file()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                source = self.path.with_name(f"{self.path.name}.{index}")
+                if source.exists():
+                    source.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self._open()
+
+
+_settings = {"fmt": "text", "max_bytes": DEFAULT_MAX_BYTES, "backups": DEFAULT_BACKUPS}
+_writers: Dict[Path, LogWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def configure(fmt: str = "text", max_bytes: int = DEFAULT_MAX_BYTES, backups: int = DEFAULT_BACKUPS):
+    """Set the format and rotation used by writers created from now on."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown log format '{fmt}'")
+    _settings.update(fmt=fmt, max_bytes=max_bytes, backups=backups)
+
+
+def get_writer(path: Path) -> LogWriter:
+    """Return the shared writer of a log file, starting it on first use."""
+    path = Path(path)
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = LogWriter(path, **_settings)
+        return writer
+
+
+def flush_all():
+    """Wait until every writer has written what was queued so far."""
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.flush()
+
+
+def close_all():
+    """Close every writer; later messages to the same files start new ones."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_all)
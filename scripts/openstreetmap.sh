@@ -3,10 +3,12 @@
 # OpenStreetMap Download Script
 # Part of EmergencyStorage - Downloads OpenStreetMap planet data
 # 
-# Usage: ./openstreetmap.sh <drive_path>
+# Usage: ./openstreetmap.sh <drive_path> [--segments N]
 # 
 # Arguments:
 #   drive_path - Target directory for OpenStreetMap data
+#   --segments N - Download the planet file over N concurrent range requests
+#                  using the native HTTP engine (default: single curl stream)
 
 set -e  # Exit on any error
 
@@ -20,7 +22,28 @@ source "$SCRIPT_DIR/common.sh"
 # Main function to download OpenStreetMap data
 download_openstreetmap() {
     local drive_path="$1"
+    shift
+    local segments=1
     local osm_path="$drive_path/openstreetmap"
+    local planet_url="https://planet.openstreetmap.org/pbf/planet-latest.osm.pbf"
+    
+    while [ $# -gt 0 ]; do
+        case "$1" in
+            --segments)
+                segments="${2:-1}"
+                shift 2
+                ;;
+            *)
+                log_warning "Ignoring unknown argument: $1"
+                shift
+                ;;
+        esac
+    done
+    
+    if ! [[ "$segments" =~ ^[0-9]+$ ]] || [ "$segments" -lt 1 ]; then
+        log_error "--segments must be a positive integer"
+        return 1
+    fi
     
     log_info "Starting OpenStreetMap download..."
     log_info "Target directory: $osm_path"
@@ -55,7 +78,18 @@ download_openstreetmap() {
     fi
     
     # Download the planet file with resume support
-    if curl -C - -L -o planet-latest.osm.pbf https://planet.openstreetmap.org/pbf/planet-latest.osm.pbf; then
+    local download_ok=false
+    if [ "$segments" -gt 1 ] && command -v python3 &> /dev/null; then
+        log_info "Using segmented download with $segments connections"
+        if python3 "$SCRIPT_DIR/http_engine.py" --segments "$segments" --cache .http_cache.json \
+                "$planet_url" planet-latest.osm.pbf; then
+            download_ok=true
+        fi
+    elif curl $(rate_limit_args curl) -C - -L -o planet-latest.osm.pbf "$planet_url"; then
+        download_ok=true
+    fi
+    
+    if [ "$download_ok" = true ]; then
         log_success "OpenStreetMap download completed successfully!"
         
         # Create a README file with information about the download
@@ -95,8 +129,8 @@ For more information, visit: https://planet.openstreetmap.org/"
 if [[ "${BASH_SOURCE[0]}" == "${0}" ]]; then
     # Script is being executed directly
     if [ $# -lt 1 ]; then
-        log_error "Usage: $0 <drive_path>"
-        log_info "Example: $0 /mnt/external_drive"
+        log_error "Usage: $0 <drive_path> [--segments N]"
+        log_info "Example: $0 /mnt/external_drive --segments 8"
         exit 1
     fi
     
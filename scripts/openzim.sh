@@ -49,7 +49,7 @@ download_openzim() {
     fi
     
     # Perform the actual sync
-    if rsync -vzrlptD --delete --info=progress2 download.openzim.org::download.openzim.org/ "$openzim_path/"; then
+    if rsync $(rate_limit_args rsync) -vzrlptD --delete --info=progress2 download.openzim.org::download.openzim.org/ "$openzim_path/"; then
         log_success "OpenZIM download completed successfully!"
         
         # Create a README file with information about the collection
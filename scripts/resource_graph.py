@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Resource Dependency Graph
+Part of EmergencyStorage - Runs auto-update resources concurrently in dependency order
+
+Each resource in ``auto_update_config.json`` may declare:
+
+- ``"depends_on"``: resource ids that must finish successfully first. If one
+  of them fails, the dependent resource is skipped and counted as failed.
+- ``"concurrency_group"``: a name shared by resources that must not run at
+  the same time, e.g. two mirrors writing to the same disk. Groups run one
+  resource at a time unless ``global_settings.concurrency_groups`` gives a
+  higher limit.
+
+Everything else runs concurrently, up to ``global_settings.max_parallel``
+resources at once. Ready resources start in configuration order.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+
+class GraphError(Exception):
+    """Raised for unknown dependencies, cycles or malformed settings."""
+
+
+def depends_on(resource_id: str, resource_config: Dict) -> List[str]:
+    """
+    The ``depends_on`` list of a resource (a single id is accepted too).
+
+    Raises:
+        GraphError: If the value isn't an id or a list of ids
+    """
+    value = resource_config.get("depends_on", [])
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise GraphError(f"depends_on of {resource_id} must be a resource id or a list of them")
+    return value
+
+
+def validate(resources: Dict[str, Dict]):
+    """
+    Check the dependencies of every configured resource.
+
+    Raises:
+        GraphError: If a resource depends on an unknown resource or on itself
+            (directly or through others)
+    """
+    graph = {}
+    for resource_id, resource_config in resources.items():
+        deps = depends_on(resource_id, resource_config)
+        for dep in deps:
+            if dep not in resources:
+                raise GraphError(f"{resource_id} depends on unknown resource '{dep}'")
+        graph[resource_id] = deps
+
+    # Kahn's algorithm: whatever can't be ordered is part of a cycle
+    remaining = {resource_id: len(deps) for resource_id, deps in graph.items()}
+    ready = [resource_id for resource_id, count in remaining.items() if count == 0]
+    while ready:
+        done = ready.pop()
+        del remaining[done]
+        for resource_id, deps in graph.items():
+            if resource_id in remaining and done in deps:
+                remaining[resource_id] -= deps.count(done)
+                if remaining[resource_id] == 0:
+                    ready.append(resource_id)
+    if remaining:
+        raise GraphError(f"Dependency cycle between {', '.join(sorted(remaining))}")
+
+
+def group_limits(value) -> Dict[str, int]:
+    """
+    Parse ``global_settings.concurrency_groups``: group name -> resources at once.
+
+    Raises:
+        GraphError: If a limit isn't a positive number
+    """
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise GraphError("concurrency_groups must map group names to limits")
+    for group, limit in value.items():
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+            raise GraphError(f"Limit of concurrency group '{group}' must be a positive number, not {limit!r}")
+    return dict(value)
+
+
+def run_graph(
+    order: List[str],
+    deps: Dict[str, List[str]],
+    groups: Dict[str, Optional[str]],
+    run: Callable[[str], bool],
+    max_parallel: int = 1,
+    limits: Optional[Dict[str, int]] = None,
+    on_start: Optional[Callable[[str], None]] = None,
+    on_skip: Optional[Callable[[str, str], None]] = None
+) -> Dict[str, bool]:
+    """
+    Run jobs as soon as their dependencies have succeeded.
+
+    Args:
+        order: Job ids, in the order ready jobs are started
+        deps: Job id -> ids it waits for (ids not in ``order`` are ignored)
+        groups: Job id -> concurrency group or None
+        run: Called in a worker thread with a job id; returns success
+        max_parallel: Jobs running at once at most
+        limits: Group -> jobs of that group running at once (default 1)
+        on_start: Called in the calling thread right before a job starts
+        on_skip: Called with (job id, failed dependency) for skipped jobs
+
+    Returns:
+        Job id -> success, in ``order``; skipped jobs count as failed
+    """
+    limits = limits or {}
+    results: Dict[str, bool] = {}
+    pending = list(order)
+    waits_for = {job: [dep for dep in deps.get(job, []) if dep in order and dep != job] for job in order}
+    running: Dict[Future, str] = {}
+    busy: Dict[str, int] = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for job in list(pending):
+                    failed = next((dep for dep in waits_for[job] if results.get(dep) is False), None)
+                    if failed:
+                        pending.remove(job)
+                        results[job] = False
+                        changed = True
+                        if on_skip:
+                            on_skip(job, failed)
+                        continue
+                    if len(running) >= max(1, max_parallel):
+                        continue
+                    if not all(results.get(dep) for dep in waits_for[job]):
+                        continue
+                    group = groups.get(job)
+                    if group and busy.get(group, 0) >= limits.get(group, 1):
+                        continue
+                    pending.remove(job)
+                    if group:
+                        busy[group] = busy.get(group, 0) + 1
+                    if on_start:
+                        on_start(job)
+                    running[executor.submit(run, job)] = job
+
+            if not running:
+                # Nothing can start any more: the rest wait on each other
+                for job in pending:
+                    results[job] = False
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                group = groups.get(job)
+                if group:
+                    busy[group] -= 1
+                try:
+                    results[job] = bool(future.result())
+                except Exception:
+                    results[job] = False
+
+    return {job: results.get(job, False) for job in order}
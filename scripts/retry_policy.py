@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Retry Policy
+Part of EmergencyStorage - Classifies failed update runs and spaces out retries
+
+A failed run is classified from its exit code and the tail of its output:
+
+- **permanent**: retrying can't help (disk full, read-only or unwritable
+  target, permission denied, missing tool, HTTP 401/403/404). The resource
+  fails immediately.
+- **transient**: the network or the remote side failed (connection reset or
+  refused, DNS failure, timeouts, HTTP 5xx/429, rsync socket errors, a
+  stalled transfer stopped by the watchdog). The run is retried after an
+  exponentially growing, jittered delay.
+
+Output that matches neither is treated as transient, so unknown failures
+are still retried, only no longer back to back.
+
+Resource scripts can report progress by printing ``CHECKPOINT: <token>``
+lines; the last token of a failed attempt is handed to the next attempt in
+the ``EMERGENCY_STORAGE_CHECKPOINT`` environment variable so it can resume
+there instead of starting over.
+"""
+
+import random
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+CHECKPOINT_ENV = "EMERGENCY_STORAGE_CHECKPOINT"
+
+DEFAULT_BASE_DELAY = 30.0  # seconds before the first retry
+DEFAULT_MAX_DELAY = 900.0
+DEFAULT_MULTIPLIER = 2.0
+DEFAULT_JITTER = 0.5  # delays are shortened by up to this fraction at random
+
+# Checked first: one of these anywhere in the output makes the failure permanent
+PERMANENT_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"No space left on device|not enough (?:free )?space", re.I), "disk full"),
+    (re.compile(r"Disk quota exceeded", re.I), "disk quota exceeded"),
+    (re.compile(r"Read-only file system", re.I), "read-only file system"),
+    (re.compile(r"Permission denied|is not writable|Cannot create directory", re.I), "target not writable"),
+    (re.compile(r"command not found|is required but not installed", re.I), "required tool missing"),
+    (re.compile(r"returned error: 40[134]|HTTP(?: error)? 40[134]\b|\b40[134] (?:Unauthorized|Forbidden|Not Found)",
+                re.I), "HTTP 4xx from server"),
+    (re.compile(r"@ERROR: Unknown module", re.I), "rsync module does not exist"),
+]
+
+TRANSIENT_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"Connection (?:reset|refused|closed)|Broken pipe", re.I), "connection failed"),
+    (re.compile(r"Could not resolve host|Temporary failure in name resolution|Name or service not known",
+                re.I), "DNS failure"),
+    (re.compile(r"Network is unreachable|No route to host", re.I), "network unreachable"),
+    (re.compile(r"timed? ?out", re.I), "timeout"),
+    (re.compile(r"returned error: (?:5\d\d|429)|HTTP(?: error)? (?:5\d\d|429)\b|Too Many Requests|"
+                r"Service Unavailable|Bad Gateway", re.I), "server busy or failing"),
+    (re.compile(r"@ERROR: max connections", re.I), "rsync server full"),
+    (re.compile(r"rsync error: (?:error in socket IO|timeout|error in rsync protocol data stream)", re.I),
+     "rsync connection failed"),
+    (re.compile(r"Cannot connect|not accessible", re.I), "server not reachable"),
+]
+
+# Exit codes that mean the script itself couldn't start
+PERMANENT_EXIT_CODES = {126: "script not executable", 127: "command not found"}
+
+
+@dataclass
+class Failure:
+    kind: str  # TRANSIENT or PERMANENT
+    reason: str
+
+    @property
+    def transient(self) -> bool:
+        return self.kind == TRANSIENT
+
+
+def classify(returncode: Optional[int], output: List[str], timed_out: bool = False,
+             abort_reason: Optional[str] = None) -> Failure:
+    """
+    Classify a failed run.
+
+    Args:
+        returncode: Exit code (None or negative if the process was killed)
+        output: Last lines of the run's output
+        timed_out: True if the watchdog stopped the run
+        abort_reason: The watchdog's reason
+    """
+    if timed_out:
+        return Failure(TRANSIENT, abort_reason or "stalled")
+    text = "\n".join(output)
+    for pattern, reason in PERMANENT_PATTERNS:
+        if pattern.search(text):
+            return Failure(PERMANENT, reason)
+    if returncode in PERMANENT_EXIT_CODES:
+        return Failure(PERMANENT, PERMANENT_EXIT_CODES[returncode])
+    for pattern, reason in TRANSIENT_PATTERNS:
+        if pattern.search(text):
+            return Failure(TRANSIENT, reason)
+    if returncode is None or returncode < 0:
+        return Failure(TRANSIENT, "killed")
+    return Failure(TRANSIENT, f"exit code {returncode}")
+
+
+@dataclass
+class RetryPolicy:
+    """How often and how far apart transient failures are retried."""
+    attempts: int = 3
+    base_delay: float = DEFAULT_BASE_DELAY
+    max_delay: float = DEFAULT_MAX_DELAY
+    multiplier: float = DEFAULT_MULTIPLIER
+    jitter: float = DEFAULT_JITTER
+
+    @classmethod
+    def from_config(cls, global_settings: Dict, *configs: Optional[Dict]) -> "RetryPolicy":
+        """
+        Build a policy from ``retry_failed``/``max_retries`` and ``retry`` objects.
+
+        Later ``retry`` objects override earlier ones, so a resource can
+        layer its own settings over the global ones.
+
+        Raises:
+            ValueError: If a setting is out of range
+        """
+        attempts = global_settings.get("max_retries", 3) if global_settings.get("retry_failed", True) else 1
+        if isinstance(attempts, bool) or not isinstance(attempts, int) or attempts < 1:
+            raise ValueError(f"Invalid max_retries: {attempts!r}")
+        policy = cls(attempts)
+        for config in configs:
+            for key in ("base_delay", "max_delay", "multiplier", "jitter"):
+                if key not in (config or {}):
+                    continue
+                value = config[key]
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError(f"Invalid retry setting {key}: {value!r}")
+                if key == "jitter" and value > 1:
+                    raise ValueError("Retry setting jitter must be between 0 and 1")
+                if key == "multiplier" and value < 1:
+                    raise ValueError("Retry setting multiplier must be at least 1")
+                setattr(policy, key, float(value))
+        return policy
+
+    def delay(self, failures: int, rng: Optional[random.Random] = None) -> float:
+        """
+        Seconds to wait after the ``failures``-th failed attempt.
+
+        The delay grows by ``multiplier`` per failure up to ``max_delay`` and
+        is shortened by a random fraction of up to ``jitter``, so resources
+        that failed together don't all retry at the same moment.
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** max(0, failures - 1))
+        return delay * (1 - self.jitter * (rng or random).random())
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Run Metrics Store
+Part of EmergencyStorage - Append-only history of every download job, with trends and Prometheus export
+
+``auto_update.py``, ``download_git_repos.py`` and ``download_manual_sources.py``
+record one row per job (resource, repository or manual source) in a local
+SQLite database: when it started, how long it took, bytes transferred,
+throughput, retries and exit status. Rows are only ever inserted.
+
+The database is ``logs/run_history.db`` in the repository unless
+``EMERGENCY_STORAGE_METRICS_DB`` names another file (``off`` disables
+recording). If ``EMERGENCY_STORAGE_METRICS_TEXTFILE`` is set, the latest run
+of every job is also written there in the Prometheus text format after each
+run, for node_exporter's textfile collector.
+
+Usage:
+    python3 scripts/run_metrics.py trends [--tool TOOL] [--job JOB] [--runs N]
+    python3 scripts/run_metrics.py history --job JOB [--tool TOOL] [--limit N]
+    python3 scripts/run_metrics.py export --textfile PATH
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from state_store import atomic_write_text
+from stream_runner import format_bytes, format_duration, format_rate
+
+DB_ENV = "EMERGENCY_STORAGE_METRICS_DB"
+TEXTFILE_ENV = "EMERGENCY_STORAGE_METRICS_TEXTFILE"
+DEFAULT_DB = Path(__file__).resolve().parent.parent / "logs" / "run_history.db"
+METRIC_PREFIX = "emergency_storage_job"
+DEFAULT_BASELINE_RUNS = 5  # earlier successful runs the latest one is compared with
+SLOWER_FACTOR = 1.5  # flag a job whose duration grew, or throughput shrank, by this factor
+MIN_TREND_DURATION = 10.0  # seconds; shorter runs are too noisy to flag
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    job TEXT NOT NULL,
+    action TEXT,
+    started TEXT NOT NULL,
+    duration REAL,
+    bytes INTEGER,
+    throughput REAL,
+    retries INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    exit_code INTEGER,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_job ON runs (tool, job, id);
+"""
+
+
+def _warn(message: str):
+    print(f"Warning: {message}", file=sys.stderr)
+
+
+def database_path() -> Optional[Path]:
+    """The database to use, or None if recording is switched off."""
+    value = os.environ.get(DB_ENV)
+    if value is None:
+        return DEFAULT_DB
+    if value.strip().lower() in ("", "off", "none"):
+        return None
+    return Path(value)
+
+
+class MetricsStore:
+    """
+    Connection to the run history; safe to share between worker threads.
+
+    Recording never raises: a database problem is reported once as a
+    warning and the download carries on.
+    """
+
+    def __init__(self, path: Path, tool: Optional[str] = None):
+        self.path = Path(path)
+        self.tool = tool
+        self.run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{os.getpid()}"
+        self._lock = threading.Lock()
+        self._warned = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Several scripts may write at once (e.g. auto_update running the
+        # manual sources script); WAL lets them append without blocking readers
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def record(self, job: str, status: str, duration: Optional[float] = None,
+               bytes_transferred: Optional[int] = None, retries: int = 0,
+               exit_code: Optional[int] = None, action: Optional[str] = None,
+               detail: Optional[str] = None, started: Optional[datetime] = None):
+        """
+        Append one job's outcome.
+
+        Args:
+            job: Resource ID, repository name or source ID
+            status: "success" or "failed"
+            duration: Seconds the job took, retries included
+            bytes_transferred: Bytes downloaded, if known
+            retries: Attempts after the first
+            exit_code: Exit code of the last attempt, if there was a process
+            action: What was done (e.g. "clone", "update")
+            detail: Short error message or note
+            started: When the job started (default: now minus duration)
+        """
+        now = datetime.now(timezone.utc)
+        if started is None:
+            started = now if duration is None else datetime.fromtimestamp(now.timestamp() - duration, timezone.utc)
+        throughput = None
+        if bytes_transferred is not None and duration and duration > 0:
+            throughput = bytes_transferred / duration
+        row = (self.run_id, self.tool or "unknown", job, action, started.isoformat(timespec="seconds"),
+               duration, bytes_transferred, throughput, retries, status, exit_code, detail)
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO runs (run_id, tool, job, action, started, duration, bytes, throughput,"
+                    " retries, status, exit_code, detail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        except sqlite3.Error as e:
+            if not self._warned:
+                self._warned = True
+                _warn(f"could not record run metrics in {self.path}: {e}")
+
+    def runs(self, tool: Optional[str] = None, job: Optional[str] = None,
+             limit: Optional[int] = None) -> List[sqlite3.Row]:
+        """Recorded runs, newest first."""
+        query = "SELECT * FROM runs WHERE 1=1"
+        params: List = []
+        if tool:
+            query += " AND tool = ?"
+            params.append(tool)
+        if job:
+            query += " AND job = ?"
+            params.append(job)
+        query += " ORDER BY id DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def latest(self) -> List[sqlite3.Row]:
+        """The newest run of every job."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT runs.* FROM runs JOIN (SELECT MAX(id) AS id FROM runs GROUP BY tool, job) AS newest"
+                " ON runs.id = newest.id ORDER BY tool, job").fetchall()
+
+    def totals(self) -> List[sqlite3.Row]:
+        """Run counts per job and status."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT tool, job, status, COUNT(*) AS count FROM runs GROUP BY tool, job, status"
+                " ORDER BY tool, job, status").fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_store(tool: str, path: Optional[Path] = None) -> Optional[MetricsStore]:
+    """
+    Open the run history for a tool, or return None if recording is off or
+    the database can't be opened (after a warning).
+    """
+    path = path or database_path()
+    if path is None:
+        return None
+    try:
+        return MetricsStore(path, tool)
+    except (sqlite3.Error, OSError) as e:
+        _warn(f"run metrics disabled, could not open {path}: {e}")
+        return None
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_textfile(store: MetricsStore) -> str:
+    """The latest run of every job and run counts, in the Prometheus text format."""
+    gauges = [
+        ("last_run_timestamp_seconds", "Start time of the job's last run",
+         lambda row: datetime.fromisoformat(row["started"]).timestamp()),
+        ("last_duration_seconds", "Duration of the job's last run, retries included", lambda row: row["duration"]),
+        ("last_bytes", "Bytes transferred by the job's last run", lambda row: row["bytes"]),
+        ("last_throughput_bytes_per_second", "Average throughput of the job's last run",
+         lambda row: row["throughput"]),
+        ("last_retries", "Retries in the job's last run", lambda row: row["retries"]),
+        ("last_success", "1 if the job's last run succeeded, else 0",
+         lambda row: 1 if row["status"] == "success" else 0),
+    ]
+    latest = store.latest()
+    lines = []
+    for name, help_text, value_of in gauges:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for row in latest:
+            value = value_of(row)
+            if value is not None:
+                labels = f'tool="{_label(row["tool"])}",job="{_label(row["job"])}"'
+                lines.append(f"{METRIC_PREFIX}_{name}{{{labels}}} {value}")
+    lines.append(f"# HELP {METRIC_PREFIX}_runs_total Recorded runs of the job by status")
+    lines.append(f"# TYPE {METRIC_PREFIX}_runs_total counter")
+    for row in store.totals():
+        lines.append(f'{METRIC_PREFIX}_runs_total{{tool="{_label(row["tool"])}",job="{_label(row["job"])}",'
+                     f'status="{_label(row["status"])}"}} {row["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(store: MetricsStore, path: Path):
+    """Write the Prometheus textfile atomically, so node_exporter never reads half of it."""
+    atomic_write_text(path, render_textfile(store), mode=0o644)
+
+
+def export_textfile(store: Optional[MetricsStore]):
+    """Write the textfile named by EMERGENCY_STORAGE_METRICS_TEXTFILE, if any."""
+    target = os.environ.get(TEXTFILE_ENV)
+    if store is None or not target:
+        return
+    try:
+        write_textfile(store, Path(target))
+    except (sqlite3.Error, OSError) as e:
+        _warn(f"could not write metrics textfile {target}: {e}")
+
+
+def trend(rows: List[sqlite3.Row], baseline_runs: int = DEFAULT_BASELINE_RUNS) -> Dict:
+    """
+    Compare a job's newest run with the median of its earlier successful runs.
+
+    Args:
+        rows: The job's runs, newest first
+
+    Returns:
+        Dict with the newest run, baseline duration/throughput (None without
+        history) and ``slower`` (True if it regressed by SLOWER_FACTOR)
+    """
+    newest = rows[0]
+    earlier = [row for row in rows[1:] if row["status"] == "success"][:baseline_runs]
+    durations = [row["duration"] for row in earlier if row["duration"]]
+    rates = [row["throughput"] for row in earlier if row["throughput"]]
+    base_duration = statistics.median(durations) if durations else None
+    base_rate = statistics.median(rates) if rates else None
+    slower = False
+    if newest["status"] == "success" and (newest["duration"] or 0) >= MIN_TREND_DURATION:
+        if base_rate and newest["throughput"]:
+            slower = newest["throughput"] * SLOWER_FACTOR < base_rate
+        elif base_duration and newest["duration"]:
+            slower = newest["duration"] > base_duration * SLOWER_FACTOR
+    return {"newest": newest, "duration": base_duration, "throughput": base_rate, "slower": slower}
+
+
+def _change(new: Optional[float], base: Optional[float]) -> str:
+    if not new or not base:
+        return ""
+    return f" ({(new - base) / base * 100:+.0f}%)"
+
+
+def show_trends(store: MetricsStore, tool: Optional[str], job: Optional[str], baseline_runs: int) -> int:
+    jobs: Dict = {}
+    for row in store.runs(tool, job):
+        jobs.setdefault((row["tool"], row["job"]), []).append(row)
+    if not jobs:
+        print("No runs recorded")
+        return 0
+    print(f"Latest run of each job against the median of up to {baseline_runs} earlier successful runs")
+    print()
+    regressions = 0
+    for (tool_name, job_name), rows in sorted(jobs.items()):
+        result = trend(rows, baseline_runs)
+        newest = result["newest"]
+        duration = format_duration(newest["duration"]) if newest["duration"] is not None else "-"
+        rate = format_rate(newest["throughput"]) if newest["throughput"] else "-"
+        flag = "  << slower than usual" if result["slower"] else ""
+        regressions += result["slower"]
+        print(f"{tool_name}/{job_name}: {newest['status']} on {newest['started'][:16].replace('T', ' ')}, "
+              f"{len(rows)} run(s){flag}")
+        print(f"    duration   {duration}{_change(newest['duration'], result['duration'])}"
+              + (f", usually {format_duration(result['duration'])}" if result["duration"] else ""))
+        print(f"    throughput {rate}{_change(newest['throughput'], result['throughput'])}"
+              + (f", usually {format_rate(result['throughput'])}" if result["throughput"] else ""))
+        if newest["bytes"] is not None:
+            print(f"    transferred {format_bytes(newest['bytes'])}, retries {newest['retries']}")
+    if regressions:
+        print()
+        print(f"{regressions} job(s) slower than usual")
+    return 0
+
+
+def show_history(store: MetricsStore, tool: Optional[str], job: Optional[str], limit: int) -> int:
+    rows = store.runs(tool, job, limit)
+    if not rows:
+        print("No runs recorded")
+        return 0
+    print(f"{'started':<17} {'tool/job':<32} {'status':<8} {'duration':>10} {'bytes':>10} {'rate':>12} retries")
+    for row in rows:
+        print(f"{row['started'][:16].replace('T', ' '):<17} {row['tool'] + '/' + row['job']:<32.32} "
+              f"{row['status']:<8} "
+              f"{format_duration(row['duration']) if row['duration'] is not None else '-':>10} "
+              f"{format_bytes(row['bytes']) if row['bytes'] is not None else '-':>10} "
+              f"{format_rate(row['throughput']) if row['throughput'] else '-':>12} {row['retries']}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show and export the recorded download run history")
+    parser.add_argument("--db", default=None, help=f"History database (default: ${DB_ENV} or {DEFAULT_DB})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trends = commands.add_parser("trends", help="Compare each job's latest run with its earlier runs")
+    trends.add_argument("--tool", help="auto_update, git_repos or manual_sources")
+    trends.add_argument("--job", help="Resource ID, repository name or source ID")
+    trends.add_argument("--runs", type=int, default=DEFAULT_BASELINE_RUNS,
+                        help=f"Earlier successful runs to compare with (default: {DEFAULT_BASELINE_RUNS})")
+    history = commands.add_parser("history", help="List recorded runs, newest first")
+    history.add_argument("--tool")
+    history.add_argument("--job")
+    history.add_argument("--limit", type=int, default=20, help="Runs to show (default: 20)")
+    export = commands.add_parser("export", help="Write the Prometheus textfile")
+    export.add_argument("--textfile", required=True, help="Target .prom file")
+    args = parser.parse_args()
+
+    path = Path(args.db) if args.db else database_path()
+    if path is None or not path.exists():
+        print(f"Error: No run history at {path or DEFAULT_DB}", file=sys.stderr)
+        sys.exit(1)
+    store = MetricsStore(path)
+    try:
+        if args.command == "trends":
+            sys.exit(show_trends(store, args.tool, args.job, max(1, args.runs)))
+        if args.command == "history":
+            sys.exit(show_history(store, args.tool, args.job, args.limit))
+        write_textfile(store, Path(args.textfile))
+        print(f"Wrote {args.textfile}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -53,6 +53,7 @@ print_header "EmergencyStorage - Automatic Update Setup"
 
 print_info "This script will set up automatic resource updates on your Linux system."
 print_info "Updates will run daily at 02:00 and persist through system restarts."
+print_info "Each run updates only the resources whose update_frequency is due."
 echo
 
 # Check if running on Linux with systemd
@@ -61,7 +62,7 @@ if ! command -v systemctl &> /dev/null; then
     echo
     print_info "Alternative setup options:"
     print_info "  1. Use cron: Run 'crontab -e' and add:"
-    print_info "     0 2 * * * cd $REPO_ROOT && python3 scripts/auto_update.py >> logs/cron.log 2>&1"
+    print_info "     0 2 * * * cd $REPO_ROOT && python3 scripts/auto_update.py --due >> logs/cron.log 2>&1"
     echo
     print_info "See docs/AUTO_UPDATE.md for more information."
     exit 1
@@ -151,7 +152,7 @@ Wants=network-online.target
 Type=oneshot
 User=$CURRENT_USER
 WorkingDirectory=$REPO_ROOT
-ExecStart=/usr/bin/python3 $REPO_ROOT/scripts/auto_update.py
+ExecStart=/usr/bin/python3 $REPO_ROOT/scripts/auto_update.py --due
 StandardOutput=append:$REPO_ROOT/logs/auto_update.log
 StandardError=append:$REPO_ROOT/logs/auto_update.log
 
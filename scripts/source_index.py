@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Manual Source Index
+Part of EmergencyStorage - Stable IDs, tags and constant-time lookups for manual sources
+
+``manual_sources.json`` holds a list of sources, each with a stable ``id``,
+the download ``method`` and optional ``tags``:
+
+    {"sources": [{"id": "research-data", "method": "wget", "tags": ["datasets"],
+                  "url": "-c https://example.com/data.tar.gz", ...}]}
+
+The older layout keyed by method name (one source per tool) is still read;
+there the method name doubles as the ID. Either way the index maps IDs and
+tags to the JSON objects in place, and every source knows its own key path
+in the document, so a status change is journaled for that one entry only.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+KeyPath = List[Union[str, int]]
+
+
+@dataclass
+class Source:
+    """One configured source and where it lives in the config document."""
+    id: str
+    method: str
+    info: Dict
+    key_path: KeyPath
+    order: int  # position in the config file
+
+    @property
+    def tags(self) -> List[str]:
+        return list(self.info.get("tags", []))
+
+
+def is_legacy(data: Any) -> bool:
+    """True for the old layout keyed by method name."""
+    return isinstance(data, dict) and not isinstance(data.get("sources"), list)
+
+
+def migrate(data: Dict) -> Dict:
+    """
+    Convert the method-keyed layout to the list layout.
+
+    Args:
+        data: Config document in either layout
+
+    Returns:
+        Config document in the list layout (unchanged if it already is one)
+    """
+    if not is_legacy(data):
+        return data
+    sources = []
+    for method, info in data.items():
+        entry = {"id": method, "method": method}
+        if isinstance(info, dict):
+            entry.update({k: v for k, v in info.items() if k not in ("id", "method")})
+        sources.append(entry)
+    return {"sources": sources}
+
+
+class SourceIndex:
+    """
+    In-memory index over the sources of a config document.
+
+    ``sources`` keeps config order; ``get()`` and ``tagged()`` are dictionary
+    lookups. Entries that cannot be indexed are reported in ``errors``.
+    """
+
+    def __init__(self, data: Any):
+        self.legacy = is_legacy(data)
+        self.sources: List[Source] = []
+        self.errors: List[str] = []
+        self._by_id: Dict[str, Source] = {}
+        self._by_tag: Dict[str, List[Source]] = {}
+
+        if self.legacy:
+            entries = [(method, method, info, [method]) for method, info in data.items()]
+        elif isinstance(data, dict):
+            entries = []
+            for position, info in enumerate(data["sources"]):
+                if not isinstance(info, dict):
+                    self.errors.append(f"sources[{position}] is not an object")
+                    continue
+                entries.append((info.get("id"), info.get("method"), info, ["sources", position]))
+        else:
+            raise ValueError("Configuration must be a JSON object")
+
+        for source_id, method, info, key_path in entries:
+            label = source_id or f"sources[{key_path[-1]}]"
+            if not isinstance(info, dict):
+                self.errors.append(f"Invalid structure for source '{label}'")
+            elif not source_id or not isinstance(source_id, str):
+                self.errors.append(f"Source {label} has no id")
+            elif not method:
+                self.errors.append(f"Source '{label}' has no method")
+            elif source_id in self._by_id:
+                self.errors.append(f"Duplicate source id '{source_id}'")
+            elif "url" not in info:
+                self.errors.append(f"No URL for source '{label}'")
+            elif not isinstance(info.get("tags", []), list):
+                self.errors.append(f"Tags of source '{label}' must be a list")
+            else:
+                self._add(Source(source_id, method, info, key_path, len(self.sources)))
+
+    def _add(self, source: Source):
+        self.sources.append(source)
+        self._by_id[source.id] = source
+        for tag in source.tags:
+            self._by_tag.setdefault(tag, []).append(source)
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def __iter__(self) -> Iterator[Source]:
+        return iter(self.sources)
+
+    def get(self, source_id: str) -> Optional[Source]:
+        return self._by_id.get(source_id)
+
+    def tagged(self, tag: str) -> List[Source]:
+        return list(self._by_tag.get(tag, []))
+
+    @property
+    def tags(self) -> List[str]:
+        return sorted(self._by_tag)
+
+    def select(self, ids: Optional[Iterable[str]] = None,
+               tags: Optional[Iterable[str]] = None) -> List[Source]:
+        """
+        Resolve a selection by IDs and/or tags.
+
+        Only the requested IDs and tags are looked up; with neither, every
+        source is selected. Each source appears once, in config order.
+
+        Args:
+            ids: Source IDs to include
+            tags: Tags whose sources to include
+
+        Returns:
+            Selected sources
+
+        Raises:
+            KeyError: If an ID or tag is unknown
+        """
+        if not ids and not tags:
+            return list(self.sources)
+        chosen: Dict[str, Source] = {}
+        for source_id in ids or ():
+            if source_id not in self._by_id:
+                raise KeyError(f"Unknown source id '{source_id}'")
+            chosen[source_id] = self._by_id[source_id]
+        for tag in tags or ():
+            if tag not in self._by_tag:
+                raise KeyError(f"No sources tagged '{tag}'")
+            for source in self._by_tag[tag]:
+                chosen[source.id] = source
+        return sorted(chosen.values(), key=lambda source: source.order)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+State Persistence Helpers
+Part of EmergencyStorage - Crash-safe storage for JSON configuration and state files
+
+Status changes are appended to a small journal file next to the JSON file and
+compacted into it with a single atomic temp-file-plus-rename. A crash at any
+point leaves either the old or the new JSON on disk, never a truncated one;
+journaled changes that were not compacted yet are replayed on the next load.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+
+def atomic_write_json(path: Path, data: Any, indent: int = 2):
+    """
+    Write JSON to a file atomically.
+
+    The data is written to a temporary file in the same directory, flushed to
+    disk and then renamed over the target, so readers never see a partial file.
+
+    Args:
+        path: Target JSON file
+        data: JSON-serialisable data
+        indent: Indentation passed to json.dump
+    """
+    atomic_write_text(path, json.dumps(data, indent=indent) + "\n")
+
+
+def atomic_write_text(path: Path, text: str, mode: Optional[int] = None):
+    """
+    Write a text file atomically (temporary file, fsync, rename).
+
+    Args:
+        path: Target file
+        text: Complete new content
+        mode: Permissions for a new file (default: private to the owner);
+            an existing file keeps its permissions
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if path.exists():
+            os.chmod(tmp_name, path.stat().st_mode & 0o777)
+        elif mode is not None:
+            os.chmod(tmp_name, mode)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def journal_path(path: Path) -> Path:
+    """Return the journal file belonging to a JSON file."""
+    path = Path(path)
+    return path.with_name(path.name + ".journal")
+
+
+def _apply(data: Any, key_path: List[Union[str, int]], value: Any):
+    """Set ``value`` at ``key_path`` inside nested dicts/lists."""
+    target = data
+    for key in key_path[:-1]:
+        target = target[key]
+    target[key_path[-1]] = value
+
+
+class ConfigStore:
+    """
+    Journaled JSON document.
+
+    ``data`` holds the in-memory document. ``record()`` applies a change to it
+    and appends the change to the journal; ``compact()`` writes the whole
+    document once, atomically, and removes the journal.
+    """
+
+    def __init__(self, path: Path, data: Any):
+        self.path = Path(path)
+        self.data = data
+        self.lock = threading.RLock()
+        self.pending = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "ConfigStore":
+        """
+        Load a JSON file, replaying any journal left behind by an interrupted run.
+
+        Args:
+            path: Path to the JSON file
+
+        Returns:
+            ConfigStore holding the up-to-date document
+        """
+        with open(path, 'r') as f:
+            store = cls(path, json.load(f))
+        if store.replay():
+            store.compact()
+        return store
+
+    def replay(self) -> int:
+        """
+        Apply journaled changes to the in-memory document.
+
+        A torn last line (from a crash mid-append) is ignored.
+
+        Returns:
+            Number of changes applied
+        """
+        journal = journal_path(self.path)
+        if not journal.exists():
+            return 0
+
+        applied = 0
+        with open(journal, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    _apply(self.data, entry["path"], entry["value"])
+                    applied += 1
+                except (ValueError, KeyError, IndexError, TypeError):
+                    continue
+        return applied
+
+    def record(self, key_path: List[Union[str, int]], value: Any):
+        """
+        Apply a change and append it to the journal.
+
+        Args:
+            key_path: Keys/indices leading to the value, e.g. ["wget", "downloaded"]
+            value: New JSON-serialisable value
+        """
+        line = json.dumps({"path": list(key_path), "value": value})
+        with self.lock:
+            _apply(self.data, key_path, value)
+            with open(journal_path(self.path), 'a') as f:
+                f.write(line + "\n")
+            self.pending += 1
+
+    def compact(self):
+        """Write the document atomically and drop the journal."""
+        with self.lock:
+            atomic_write_json(self.path, self.data)
+            try:
+                journal_path(self.path).unlink()
+            except FileNotFoundError:
+                pass
+            self.pending = 0
+
+
+def load_json_state(path: Path, default: Any = None) -> Any:
+    """
+    Load a JSON state file, returning ``default`` if it is missing or unreadable.
+
+    Args:
+        path: Path to the state file
+        default: Value returned when the file cannot be loaded
+
+    Returns:
+        Parsed JSON data or the default
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {} if default is None else default
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+Streaming Subprocess Runner
+Part of EmergencyStorage - Runs download tools with live progress and throughput reporting
+
+Child output is read incrementally instead of being buffered until the
+process exits. Progress lines from wget, curl, rsync and git are parsed into
+bytes transferred, rate and ETA, reported periodically while the job runs,
+and summarised in a per-job throughput record when it ends. Only the last
+lines of ordinary output are kept, in a bounded ring buffer.
+
+Instead of a fixed timeout, jobs can be supervised by a throughput watchdog:
+a transfer is only aborted when it makes no progress, or moves less than a
+configurable floor of bytes per second, for a whole configurable window. A
+slow but steady multi-gigabyte transfer therefore runs to completion while a
+stuck one is killed once the window has passed.
+"""
+
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional
+
+DEFAULT_REPORT_INTERVAL = 10.0  # seconds between live progress lines
+DEFAULT_TAIL_LINES = 50
+RATE_WINDOW = 10.0  # seconds of samples used to compute a rate when the tool doesn't report one
+DEFAULT_MIN_RATE = 1024  # bytes/s; slower than this for a whole window counts as stalled
+DEFAULT_STALL_WINDOW = 60.0  # seconds a transfer may stay below the floor before it is killed
+AUTO_TOOLS = ("rsync", "curl", "wget", "git")  # parsers tried on output of wrapper scripts
+
+_UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4, "P": 1024 ** 5}
+
+WGET_LENGTH = re.compile(r"^Length:\s+(\d+)")
+WGET_DOTS = re.compile(r"^\s*(\d+)K\s[.\s]+?(\d+)%\s+([\d.]+[KMG]?)")
+CURL_METER = re.compile(
+    r"^\s*(\d+)\s+([\d.]+[kMGTP]?)\s+(\d+)\s+([\d.]+[kMGTP]?)\s+\d+\s+[\d.]+[kMGTP]?\s+([\d.]+[kMGTP]?)\s")
+RSYNC_PROGRESS = re.compile(r"^\s*([\d,]+)\s+(\d+)%\s+([\d.]+)([kKMGT]?)B/s"
+                            r"(?:.*\((xfr#\d+, (?:ir|to)-chk=\d+/\d+)\))?")
+GIT_PROGRESS = re.compile(
+    r"^(?:remote: )?(Receiving objects|Resolving deltas|Counting objects|Compressing objects|"
+    r"Updating files|Checking out files):\s+(\d+)% \((\d+)/(\d+)\)"
+    r"(?:, ([\d.]+) (bytes|[KMGT]iB))?(?: \| ([\d.]+) (bytes|[KMGT]iB)/s)?")
+CHECKPOINT_LINE = re.compile(r"^CHECKPOINT:\s*(.+?)\s*$")  # resume point reported by a script
+
+
+def parse_size(text: str) -> int:
+    """Convert sizes like ``1.5M``, ``512k`` or ``2,048`` to bytes."""
+    match = re.match(r"^([\d.,]+)\s*([kKMGTP]?)", text.strip())
+    if not match:
+        return 0
+    return int(float(match.group(1).replace(",", "")) * _UNITS[match.group(2).upper()])
+
+
+def _git_unit(unit: str) -> int:
+    """Multiplier for git's ``bytes``/``KiB``/``MiB`` units."""
+    return 1 if unit == "bytes" else _UNITS[unit[0]]
+
+
+def format_rate(bytes_per_second: Optional[float]) -> str:
+    """Format a transfer rate for humans."""
+    if bytes_per_second is None:
+        return "? B/s"
+    for unit in ("B", "KB", "MB", "GB"):
+        if bytes_per_second < 1024:
+            return f"{bytes_per_second:.1f} {unit}/s"
+        bytes_per_second /= 1024
+    return f"{bytes_per_second:.1f} TB/s"
+
+
+def format_bytes(num_bytes: Optional[float]) -> str:
+    """Format a byte count for humans."""
+    if num_bytes is None:
+        return "?"
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Format seconds as H:MM:SS."""
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressParser:
+    """
+    Turns progress lines of one tool into byte counts.
+
+    ``feed()`` returns True if the line was a progress line (those are kept
+    out of the output tail) and updates ``bytes_done``, ``total`` and
+    ``rate`` where the tool reports them (``objects`` for git, ``files`` for
+    rsync's transfer and check counters); ``measured`` tells whether the last
+    line carried a byte count. Output of other commands (e.g. the
+    wrapper shell scripts) is matched against every known tool.
+    """
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.bytes_done: Optional[int] = None
+        self.total: Optional[int] = None
+        self.rate: Optional[float] = None
+        self.objects: Optional[int] = None
+        self.files: Optional[str] = None  # rsync's "xfr#N, ir-chk=M/T" counters
+        self.measured = False
+        self._base = 0  # bytes of files rsync already finished
+        self._last_file_bytes = 0
+
+    def feed(self, line: str) -> bool:
+        self.measured = False
+        tools = (self.tool,) if self.tool in AUTO_TOOLS else AUTO_TOOLS
+        return any(getattr(self, f"_{tool}")(line) for tool in tools)
+
+    def _wget(self, line: str) -> bool:
+        match = WGET_LENGTH.match(line)
+        if match:
+            self.total = int(match.group(1))
+            return False
+        match = WGET_DOTS.match(line)
+        if not match:
+            return False
+        percent = int(match.group(2))
+        if self.total:
+            self.bytes_done = self.total * percent // 100
+        else:
+            self.bytes_done = int(match.group(1)) * 1024
+        self.rate = float(parse_size(match.group(3)))
+        self.measured = True
+        return True
+
+    def _curl(self, line: str) -> bool:
+        if "% Total" in line or "Dload" in line:
+            return True
+        match = CURL_METER.match(line)
+        if not match:
+            return False
+        total = parse_size(match.group(2))
+        self.total = total or self.total
+        self.bytes_done = parse_size(match.group(4))
+        self.rate = float(parse_size(match.group(5)))
+        self.measured = True
+        return True
+
+    def _rsync(self, line: str) -> bool:
+        match = RSYNC_PROGRESS.match(line)
+        if not match:
+            return False
+        file_bytes = int(match.group(1).replace(",", ""))
+        if file_bytes < self._last_file_bytes:
+            # --progress restarts the counter for every file
+            self._base += self._last_file_bytes
+        self._last_file_bytes = file_bytes
+        self.bytes_done = self._base + file_bytes
+        self.rate = float(match.group(3)) * _UNITS[match.group(4).upper()]
+        self.files = match.group(5) or self.files
+        self.measured = True
+        return True
+
+    def _git(self, line: str) -> bool:
+        match = GIT_PROGRESS.match(line)
+        if not match:
+            return False
+        if match.group(1) == "Receiving objects":
+            self.objects = int(match.group(4))
+        if match.group(1) == "Receiving objects" and match.group(5):
+            self.bytes_done = int(float(match.group(5)) * _git_unit(match.group(6)))
+            if match.group(7):
+                self.rate = float(match.group(7)) * _git_unit(match.group(8))
+            self.measured = True
+        return True
+
+
+class ProgressTracker:
+    """
+    Live progress of one job: bytes, rate, ETA and time since the last activity.
+
+    Progress is either a growing byte count or a sign of work that carries no
+    byte count: ordinary output lines, or progress lines that changed (such as
+    git's "Resolving deltas"). Repeated meter lines with an unchanged byte
+    count are activity but not progress, unless rsync's file counters moved:
+    while rsync only checks files its byte count stands still for a long
+    time, so that counts as progress without a byte count.
+    """
+
+    def __init__(self, label: str, tool: str = ""):
+        self.label = label
+        self.parser = ProgressParser(tool)
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.last_progress = self.started
+        self.last_unmeasured = self.started  # last progress that carried no byte count
+        self._last_line = ""
+        self._samples: Deque = deque()
+        self._lock = threading.Lock()
+
+    def feed(self, line: str) -> bool:
+        """Record a line of output; returns True if it was a progress line."""
+        with self._lock:
+            now = time.monotonic()
+            self.last_activity = now
+            before = self.parser.bytes_done
+            files_before = self.parser.files
+            is_progress = self.parser.feed(line)
+            done = self.parser.bytes_done
+            if self.parser.measured:
+                if before is not None and done < before:
+                    # a new transfer started (next file of a wrapper script)
+                    self._samples.clear()
+                if done != before:
+                    self.last_progress = now
+                    self._samples.append((now, done))
+                    while self._samples and now - self._samples[0][0] > RATE_WINDOW:
+                        self._samples.popleft()
+                elif self.parser.files != files_before:
+                    self.last_progress = self.last_unmeasured = now
+            elif line != self._last_line:
+                self.last_progress = self.last_unmeasured = now
+            self._last_line = line
+            return is_progress
+
+    def snapshot(self) -> Dict:
+        """Current bytes, total, rate (bytes/s), ETA (s) and idle time (s)."""
+        with self._lock:
+            now = time.monotonic()
+            rate = self.parser.rate
+            if self._samples and now - self._samples[-1][0] > RATE_WINDOW:
+                rate = 0.0
+            elif len(self._samples) >= 2:
+                (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+                if t1 > t0:
+                    rate = (b1 - b0) / (t1 - t0)
+            done, total = self.parser.bytes_done, self.parser.total
+            eta = None
+            if rate and total and done is not None and total >= done:
+                eta = (total - done) / rate
+            return {
+                "bytes": done,
+                "total": total,
+                "rate": rate,
+                "eta": eta,
+                "elapsed": now - self.started,
+                "idle": now - self.last_activity,
+                "stalled": now - self.last_progress,
+                "unmeasured": now - self.last_unmeasured,
+                "objects": self.parser.objects,
+            }
+
+    def status_line(self) -> str:
+        snap = self.snapshot()
+        of_total = f" of {format_bytes(snap['total'])}" if snap["total"] else ""
+        line = (f"  [{self.label}] {format_bytes(snap['bytes'])}{of_total} at "
+                f"{format_rate(snap['rate'])}, ETA {format_duration(snap['eta'])}, "
+                f"elapsed {format_duration(snap['elapsed'])}")
+        if snap["stalled"] >= DEFAULT_REPORT_INTERVAL:
+            line += f" (no progress for {int(snap['stalled'])}s)"
+        return line
+
+
+@dataclass
+class WatchdogPolicy:
+    """
+    When a transfer counts as stuck.
+
+    A job is aborted when it makes no progress at all for ``window`` seconds,
+    or when fewer than ``min_rate`` bytes per second arrive over a whole
+    window in which nothing else happened. ``max_duration`` is an optional
+    hard limit on top of that.
+    """
+    min_rate: float = DEFAULT_MIN_RATE
+    window: float = DEFAULT_STALL_WINDOW
+    max_duration: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, *configs: Optional[Dict]) -> "WatchdogPolicy":
+        """
+        Build a policy from ``watchdog`` config objects.
+
+        Later objects override earlier ones, so per-source settings can be
+        layered over global defaults. ``min_rate`` accepts a number of bytes
+        per second or a size string such as ``"10K"``.
+
+        Args:
+            configs: Dicts with optional min_rate, window and max_duration keys
+
+        Returns:
+            WatchdogPolicy
+
+        Raises:
+            ValueError: If a setting is not a positive number
+        """
+        policy = cls()
+        for config in configs:
+            for key in ("min_rate", "window", "max_duration"):
+                if key not in (config or {}):
+                    continue
+                value = config[key]
+                if key == "min_rate" and isinstance(value, str):
+                    value = parse_size(value)
+                if key == "max_duration" and value is None:
+                    policy.max_duration = None
+                    continue
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError(f"Invalid watchdog setting {key}: {value!r}")
+                if key != "min_rate" and value == 0:
+                    raise ValueError(f"Watchdog setting {key} must be greater than zero")
+                setattr(policy, key, float(value))
+        return policy
+
+    def describe(self) -> str:
+        text = f"below {format_rate(self.min_rate)} for {int(self.window)}s"
+        if self.max_duration:
+            text += f", at most {format_duration(self.max_duration)}"
+        return text
+
+
+class Watchdog:
+    """Applies a WatchdogPolicy to the progress of one running job."""
+
+    def __init__(self, policy: WatchdogPolicy):
+        self.policy = policy
+        self.started = time.monotonic()
+        self._samples: Deque = deque()
+
+    def check(self, bytes_done: Optional[int], stalled: float,
+              unmeasured: Optional[float] = None) -> Optional[str]:
+        """
+        Decide whether the job should be aborted.
+
+        Args:
+            bytes_done: Bytes transferred so far (None if the tool reports none)
+            stalled: Seconds since the job last made any progress
+            unmeasured: Seconds since the last progress without a byte count
+                (None if the caller only tracks bytes)
+
+        Returns:
+            The reason to abort, or None while the job is healthy
+        """
+        now = time.monotonic()
+        policy = self.policy
+        elapsed = now - self.started
+        if policy.max_duration and elapsed > policy.max_duration:
+            return f"exceeded the maximum duration of {format_duration(policy.max_duration)}"
+        if bytes_done is not None:
+            if self._samples and bytes_done < self._samples[-1][1]:
+                self._samples.clear()
+            self._samples.append((now, bytes_done))
+            # keep one sample at least a window old as the reference point
+            while len(self._samples) > 1 and now - self._samples[1][0] >= policy.window:
+                self._samples.popleft()
+        if elapsed < policy.window:
+            return None
+        if stalled >= policy.window:
+            return f"no progress for {int(stalled)}s"
+        if bytes_done is None or (unmeasured is not None and unmeasured < policy.window):
+            return None
+        since, reference = self._samples[0]
+        if now - since < policy.window:
+            return None
+        rate = (bytes_done - reference) / (now - since)
+        if rate < policy.min_rate:
+            return (f"throughput {format_rate(rate)} below {format_rate(policy.min_rate)} "
+                    f"for {int(now - since)}s")
+        return None
+
+
+@dataclass
+class RunResult:
+    """Final record of a streamed job."""
+    command: List[str]
+    returncode: Optional[int]
+    duration: float
+    bytes_transferred: Optional[int]
+    output_tail: List[str] = field(default_factory=list)
+    timed_out: bool = False
+    abort_reason: Optional[str] = None
+    objects: Optional[int] = None  # objects received, for git
+    checkpoint: Optional[str] = None  # last "CHECKPOINT: ..." token the job printed
+
+    @property
+    def output(self) -> str:
+        """The retained tail of non-progress output."""
+        return "\n".join(self.output_tail)
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Average bytes per second over the whole job."""
+        if self.bytes_transferred is None or self.duration <= 0:
+            return None
+        return self.bytes_transferred / self.duration
+
+    def summary(self) -> str:
+        if self.bytes_transferred is None:
+            return f"finished in {format_duration(self.duration)}"
+        return (f"{format_bytes(self.bytes_transferred)} in {format_duration(self.duration)} "
+                f"({format_rate(self.throughput)})")
+
+
+def _read_lines(stream, on_line: Callable[[str], None]):
+    """Split raw child output on both newlines and carriage returns."""
+    pending = b""
+    while True:
+        chunk = stream.read1(65536) if hasattr(stream, "read1") else stream.read(65536)
+        if not chunk:
+            break
+        pending += chunk
+        parts = re.split(rb"[\r\n]", pending)
+        pending = parts.pop()
+        for part in parts:
+            if part.strip():
+                on_line(part.decode("utf-8", "replace"))
+    if pending.strip():
+        on_line(pending.decode("utf-8", "replace"))
+
+
+def run_streaming(command: List[str], label: Optional[str] = None,
+                  watchdog: Optional[WatchdogPolicy] = None,
+                  report_interval: float = DEFAULT_REPORT_INTERVAL,
+                  tail_lines: int = DEFAULT_TAIL_LINES, report=None,
+                  env: Optional[Dict[str, str]] = None, echo=None) -> RunResult:
+    """
+    Run a command, streaming and parsing its output while it runs.
+
+    stdout and stderr are merged and read incrementally. Every
+    ``report_interval`` seconds a live status line (bytes, rate, ETA) is
+    written to stderr, which stays unbuffered when jobs run in parallel.
+
+    The command runs in its own session, so stopping it (watchdog abort or
+    an interrupt of this process) also stops whatever it started, e.g. the
+    rsync or wget a download script runs.
+
+    Args:
+        command: Command and arguments
+        label: Name shown in progress lines (defaults to the tool name)
+        watchdog: Policy deciding when a stuck job is killed (None = never)
+        report_interval: Seconds between live progress lines (0 disables them)
+        tail_lines: Number of non-progress output lines to keep
+        report: Stream for progress lines (defaults to sys.stderr)
+        env: Environment for the child process
+        echo: Stream to copy non-progress output lines to as they arrive
+
+    Returns:
+        RunResult with exit code, duration, bytes and the output tail
+    """
+    tool = Path(command[0]).name
+    tracker = ProgressTracker(label or tool, tool)
+    tail: Deque[str] = deque(maxlen=tail_lines)
+    report = report or sys.stderr
+    checkpoint = []
+
+    def on_line(line: str):
+        if not tracker.feed(line):
+            match = CHECKPOINT_LINE.match(line)
+            if match:
+                checkpoint.append(match.group(1))
+            tail.append(line.rstrip())
+            if echo is not None:
+                print(line.rstrip(), file=echo, flush=True)
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, env=env, start_new_session=True)
+    reader = threading.Thread(target=_read_lines, args=(process.stdout, on_line), daemon=True)
+    reader.start()
+
+    guard = Watchdog(watchdog) if watchdog else None
+    abort_reason = None
+    next_report = time.monotonic() + report_interval
+    try:
+        while True:
+            try:
+                process.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            now = time.monotonic()
+            if guard:
+                snap = tracker.snapshot()
+                abort_reason = guard.check(snap["bytes"], snap["stalled"], snap["unmeasured"])
+                if abort_reason:
+                    print(f"  [{tracker.label}] watchdog: {abort_reason}, stopping", file=report, flush=True)
+                    terminate(process)
+                    break
+            if report_interval and now >= next_report:
+                next_report = now + report_interval
+                print(tracker.status_line(), file=report, flush=True)
+    except BaseException:
+        # Its own session doesn't get the terminal's Ctrl-C: pass it on
+        terminate(process)
+        raise
+
+    reader.join(timeout=5)
+    snap = tracker.snapshot()
+    return RunResult(command, None if abort_reason else process.returncode, snap["elapsed"],
+                     snap["bytes"], list(tail), abort_reason is not None, abort_reason, snap["objects"],
+                     checkpoint[-1] if checkpoint else None)
+
+
+def terminate(process: subprocess.Popen, grace: float = 5.0):
+    """
+    Stop a child started by run_streaming and its whole process group.
+
+    SIGTERM goes to the group first; whatever is left of it after ``grace``
+    seconds gets SIGKILL. Stopping the group also closes every copy of the
+    output pipe, so the reader thread ends right away.
+    """
+    deadline = time.monotonic() + grace
+    signal_group(process, signal.SIGTERM)
+    try:
+        process.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        pass
+    while time.monotonic() < deadline and signal_group(process, 0):
+        time.sleep(0.1)
+    signal_group(process, signal.SIGKILL)
+    process.wait()
+
+
+def signal_group(process: subprocess.Popen, sig: int) -> bool:
+    """Send ``sig`` to the process group led by ``process``; False if none of it is left."""
+    try:
+        os.killpg(process.pid, sig)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
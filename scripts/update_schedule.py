@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Update Schedule
+Part of EmergencyStorage - Decides which auto-update resources are due
+
+A resource's ``update_frequency`` names an entry of the ``schedule`` section
+of ``auto_update_config.json`` (``daily``, ``weekly``, ``monthly``, each a
+cron expression) or is a cron expression itself. The most recent time that
+expression fired is the resource's current window:
+
+- A resource whose last successful update is older than the current window
+  (or that never succeeded) is due. Missed windows therefore collapse into a
+  single catch-up run, however long the machine was off.
+- A resource that failed in the current window is retried after
+  ``retry_interval`` seconds rather than immediately.
+
+Last success and last attempt times are kept in a small JSON state file.
+"""
+
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from state_store import atomic_write_json, load_json_state
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python < 3.9: schedules are read in UTC
+    ZoneInfo = None
+
+DEFAULT_RETRY_INTERVAL = 3600  # seconds before a failed resource is retried
+SEARCH_DAYS = 366 * 5  # how far to look for a matching day (covers Feb 29)
+
+# (name, lowest, highest) of the five cron fields
+CRON_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31),
+               ("month", 1, 12), ("day of week", 0, 7)]
+
+
+def _parse_field(text: str, name: str, low: int, high: int) -> Set[int]:
+    values = set()
+    for part in text.split(","):
+        spec, _, step = part.partition("/")
+        try:
+            step = int(step) if step else 1
+            if spec == "*":
+                start, end = low, high
+            elif "-" in spec:
+                start, end = (int(value) for value in spec.split("-", 1))
+            else:
+                start = end = int(spec)
+        except ValueError:
+            raise ValueError(f"Invalid {name} '{part}' in cron expression")
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"{name.capitalize()} '{part}' is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """A five-field cron expression (``minute hour day month weekday``)."""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' must have 5 fields")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(text, *spec) for text, spec in zip(fields, CRON_FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}  # 0 and 7 are both Sunday
+        # As in cron: if both day fields are restricted, either one matching is enough
+        self.any_day = fields[2] != "*" and fields[4] != "*"
+        self._times = sorted(dtime(hour, minute) for hour in self.hours for minute in self.minutes)
+
+    def matches_day(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = day.isoweekday() % 7 in self.weekdays
+        return (in_month or in_week) if self.any_day else (in_month and in_week)
+
+    def previous(self, moment: datetime) -> datetime:
+        """The latest time at or before ``moment`` the expression fires."""
+        moment = moment.replace(second=0, microsecond=0)
+        for offset in range(SEARCH_DAYS):
+            day = moment.date() - timedelta(days=offset)
+            if not self.matches_day(day):
+                continue
+            for at in reversed(self._times):
+                if offset or at <= moment.time():
+                    return datetime.combine(day, at, moment.tzinfo)
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+    def next(self, moment: datetime) -> datetime:
+        """The first time after ``moment`` the expression fires."""
+        start = moment.replace(second=0, microsecond=0)
+        for offset in range(SEARCH_DAYS):
+            day = start.date() + timedelta(days=offset)
+            if not self.matches_day(day):
+                continue
+            for at in self._times:
+                candidate = datetime.combine(day, at, moment.tzinfo)
+                if candidate > moment:
+                    return candidate
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+
+def schedule_timezone(schedule: Dict):
+    """
+    The timezone of the schedule section (UTC by default).
+
+    Raises:
+        ValueError: If the timezone is unknown
+    """
+    name = schedule.get("timezone", "UTC")
+    if name in ("UTC", "Z"):
+        return timezone.utc
+    if ZoneInfo is None:
+        raise ValueError(f"Timezone '{name}' needs Python 3.9 or newer; use UTC")
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone '{name}' in schedule")
+
+
+def resource_schedule(resource_id: str, resource_config: Dict, schedule: Dict) -> CronSchedule:
+    """
+    The cron schedule a resource's ``update_frequency`` refers to.
+
+    Raises:
+        ValueError: If the frequency is missing, unknown or not a valid cron expression
+    """
+    frequency = resource_config.get("update_frequency")
+    if not isinstance(frequency, str) or not frequency.strip():
+        raise ValueError(f"{resource_id} has no update_frequency")
+    expression = schedule.get(frequency, frequency)
+    if not isinstance(expression, str) or len(expression.split()) != 5:
+        raise ValueError(f"Unknown update_frequency '{frequency}' for {resource_id}")
+    return CronSchedule(expression)
+
+
+def _parse_time(value) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+    if parsed is not None and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class ScheduleState:
+    """Last success and last attempt per resource, persisted as JSON."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data = load_json_state(self.path, None) or {"version": 1, "resources": {}}
+
+    def entry(self, resource_id: str) -> Dict:
+        return self.data["resources"].get(resource_id, {})
+
+    def last_success(self, resource_id: str) -> Optional[datetime]:
+        return _parse_time(self.entry(resource_id).get("last_success"))
+
+    def last_attempt(self, resource_id: str) -> Optional[datetime]:
+        return _parse_time(self.entry(resource_id).get("last_attempt"))
+
+    def record(self, resource_id: str, success: bool, when: Optional[datetime] = None):
+        when = (when or datetime.now(timezone.utc)).isoformat(timespec="seconds")
+        entry = self.data["resources"].setdefault(resource_id, {})
+        entry["last_attempt"] = when
+        entry["last_result"] = "success" if success else "failed"
+        if success:
+            entry["last_success"] = when
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self.path, self.data)
+
+
+def plan(
+    resources: Dict[str, Dict],
+    schedule: Dict,
+    state: ScheduleState,
+    now: datetime,
+    retry_interval: float = DEFAULT_RETRY_INTERVAL
+) -> Tuple[List[str], Dict[str, datetime], Dict[str, str]]:
+    """
+    Work out which resources are due.
+
+    Args:
+        resources: Resource id -> configuration (only these are considered)
+        schedule: The ``schedule`` section
+        state: Recorded run times
+        now: Current time (timezone-aware)
+        retry_interval: Seconds between attempts of a failing resource
+
+    Returns:
+        Tuple of (due resource ids in configuration order,
+        next due time of every resource that isn't due,
+        resource id -> error for resources with an invalid schedule)
+
+    Raises:
+        ValueError: If the schedule's timezone is unknown
+    """
+    tz = schedule_timezone(schedule)
+    local_now = now.astimezone(tz)
+    due: List[str] = []
+    upcoming: Dict[str, datetime] = {}
+    errors: Dict[str, str] = {}
+    for resource_id, resource_config in resources.items():
+        try:
+            cron = resource_schedule(resource_id, resource_config, schedule)
+            window = cron.previous(local_now)
+            following = cron.next(local_now)
+        except ValueError as e:
+            errors[resource_id] = str(e)
+            continue
+        last_success = state.last_success(resource_id)
+        if last_success is not None and last_success >= window:
+            upcoming[resource_id] = following
+            continue
+        last_attempt = state.last_attempt(resource_id)
+        if (last_attempt is not None and last_attempt >= window
+                and now - last_attempt < timedelta(seconds=retry_interval)):
+            upcoming[resource_id] = last_attempt + timedelta(seconds=retry_interval)
+            continue
+        due.append(resource_id)
+    return due, upcoming, errors
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Local HTTP test server
+Part of EmergencyStorage test suite - Serves a directory over HTTP/1.1 with Range support
+
+Used by the test scripts to exercise the native download engine without
+network access. Prints the port it listens on, then serves until killed.
+
+Responses carry ETag/Last-Modified validators and honour If-None-Match,
+If-Modified-Since and If-Range, so conditional requests can be tested.
+
+Files requested under /flaky/ drop the connection halfway through the first
+response for every distinct range end, to exercise retry logic. Files under
+/slow/ are answered after a short delay, to exercise latency racing.
+
+POST .../info/lfs/objects/batch is a minimal Git LFS batch API: objects are
+served from lfs/<oid> in the directory (through /flaky/ if the batch
+endpoint was under /flaky/).
+
+Usage: python3 tests/http_test_server.py <directory> [port_file]
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with keep-alive and single byte-range support."""
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    flaky_seen = set()
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.endswith("/info/lfs/objects/batch"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prefix = "/flaky" if self.path.startswith("/flaky/") else ""
+        base = f"http://{self.headers.get('Host')}{prefix}/lfs/"
+        objects = []
+        for obj in request.get("objects", []):
+            if os.path.isfile(self.translate_path(f"/lfs/{obj['oid']}")):
+                objects.append({**obj, "actions": {"download": {"href": base + obj["oid"],
+                                                                "header": {"X-Test": "lfs"}}}})
+            else:
+                objects.append({**obj, "error": {"code": 404, "message": "Object does not exist"}})
+        body = json.dumps({"transfer": "basic", "objects": objects}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.git-lfs+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET(head_only=True)
+
+    def do_GET(self, head_only=False):
+        if self.path == "/_stats":
+            body = f"connections={type(self).connections}\n".encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        request_path = self.path
+        flaky = request_path.startswith("/flaky/")
+        if flaky:
+            request_path = request_path[len("/flaky"):]
+        if request_path.startswith("/slow/"):
+            request_path = request_path[len("/slow"):]
+            time.sleep(0.5)
+
+        path = self.translate_path(request_path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = formatdate(int(stat.st_mtime), usegmt=True)
+        start, end = 0, size - 1
+        status = 200
+
+        if self.not_modified(etag, int(stat.st_mtime)):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range not in (etag, last_modified):
+            match = None
+        if match:
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            elif match.group(2):
+                start = max(0, size - int(match.group(2)))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head_only:
+            return
+
+        fail_after = None
+        if flaky and (request_path, end) not in self.flaky_seen and end > start:
+            type(self).flaky_seen.add((request_path, end))
+            fail_after = (end - start + 1) // 2
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            if fail_after is not None:
+                self.wfile.write(f.read(fail_after))
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            while remaining > 0:
+                chunk = f.read(min(65536, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+    def not_modified(self, etag, mtime):
+        """Evaluate If-None-Match / If-Modified-Since preconditions."""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+def main():
+    directory = sys.argv[1]
+    os.chdir(directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    port = server.server_address[1]
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as f:
+            f.write(str(port))
+    print(port, flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
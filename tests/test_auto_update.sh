@@ -7,6 +7,10 @@ set -e
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 REPO_ROOT="$(dirname "$SCRIPT_DIR")"
 
+# Keep the run history of the test runs out of the working tree
+METRICS_TMP="$(mktemp -d)"
+export EMERGENCY_STORAGE_METRICS_DB="$METRICS_TMP/run_history.db"
+
 # Colors for output
 RED='\033[0;31m'
 GREEN='\033[0;32m'
@@ -143,6 +147,10 @@ assert 'global_settings' in config
 assert 'schedule' in config
 assert 'resource1' in config['resources']
 assert 'enabled' in config['resources']['resource1']
+# kiwix.sh and openzim.sh probe mirrors silently for up to 60 seconds
+window = config['global_settings']['watchdog']['window']
+for resource in config['resources'].values():
+    assert resource.get('watchdog', {}).get('window', window) >= 120
 " 2>/dev/null; then
         print_result "Configuration structure is valid" "PASS"
     else
@@ -161,6 +169,411 @@ test_logs_directory() {
     fi
 }
 
+# Test 14: Independent resources run concurrently, dependents wait
+test_parallel_dependencies() {
+    local tmp
+    tmp=$(mktemp -d)
+    mkdir -p "$tmp/dest"
+    cat > "$tmp/slow.sh" <<'SCRIPT'
+#!/bin/bash
+echo "slow output"
+sleep 1
+touch "$1/slow.done"
+SCRIPT
+    cat > "$tmp/after.sh" <<'SCRIPT'
+#!/bin/bash
+echo "after output"
+[ -f "$1/slow.done" ]
+SCRIPT
+    cat > "$tmp/other.sh" <<'SCRIPT'
+#!/bin/bash
+echo "other output"
+sleep 1
+SCRIPT
+    cat > "$tmp/config.json" <<CONFIG
+{
+  "resources": {
+    "slow": {"enabled": true, "script": "$tmp/slow.sh"},
+    "after": {"enabled": true, "script": "$tmp/after.sh", "depends_on": ["slow"]},
+    "other": {"enabled": true, "script": "$tmp/other.sh"}
+  },
+  "global_settings": {"destination_path": "$tmp/dest", "max_parallel": 3, "state_file": "$tmp/state.json",
+                      "metrics_db": "$tmp/history.db", "resource_log_dir": "$tmp/logs", "retry_failed": false}
+}
+CONFIG
+    local start end
+    start=$(date +%s.%N)
+    if python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" >"$tmp/out.txt" 2>&1; then
+        end=$(date +%s.%N)
+        if python3 -c "import sys; sys.exit(0 if $end - $start < 1.9 else 1)" \
+            && grep -q "slow output" "$tmp/logs/slow.log" \
+            && grep -q "after output" "$tmp/logs/after.log" \
+            && ! grep -q "slow output" "$tmp/logs/other.log" \
+            && ! grep -q "other output" "$tmp/out.txt"; then
+            print_result "Resources run in parallel with separate logs" "PASS"
+        else
+            print_result "Resources run in parallel with separate logs" "FAIL"
+        fi
+    else
+        print_result "Resources run in parallel with separate logs" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
+# Test 15: Failed dependencies skip dependents; cycles and groups
+test_dependency_failures() {
+    local tmp
+    tmp=$(mktemp -d)
+    cat > "$tmp/fail.sh" <<'SCRIPT'
+#!/bin/bash
+exit 3
+SCRIPT
+    cat > "$tmp/ok.sh" <<'SCRIPT'
+#!/bin/bash
+sleep 0.5
+SCRIPT
+    cat > "$tmp/config.json" <<CONFIG
+{
+  "resources": {
+    "broken": {"enabled": true, "script": "$tmp/fail.sh"},
+    "needs_broken": {"enabled": true, "script": "$tmp/ok.sh", "depends_on": "broken"},
+    "disk_a": {"enabled": true, "script": "$tmp/ok.sh", "concurrency_group": "disk"},
+    "disk_b": {"enabled": true, "script": "$tmp/ok.sh", "concurrency_group": "disk"}
+  },
+  "global_settings": {"destination_path": "$tmp", "max_parallel": 4, "state_file": "$tmp/state.json",
+                      "metrics_db": "$tmp/history.db", "resource_log_dir": "$tmp/logs", "retry_failed": false}
+}
+CONFIG
+    cat > "$tmp/cycle.json" <<CONFIG
+{
+  "resources": {
+    "a": {"enabled": true, "script": "$tmp/ok.sh", "depends_on": ["b"]},
+    "b": {"enabled": true, "script": "$tmp/ok.sh", "depends_on": ["a"]}
+  },
+  "global_settings": {"destination_path": "$tmp", "state_file": "$tmp/state.json", "metrics_db": "$tmp/history.db"}
+}
+CONFIG
+    local start end
+    start=$(date +%s.%N)
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" >"$tmp/out.txt" 2>&1 || true
+    end=$(date +%s.%N)
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/cycle.json" >"$tmp/cycle.txt" 2>&1 || true
+    if grep -q "Skipping needs_broken: broken failed" "$tmp/out.txt" \
+        && [ ! -f "$tmp/logs/needs_broken.log" ] \
+        && grep -q "Successful: 2" "$tmp/out.txt" \
+        && python3 -c "import sys; sys.exit(0 if $end - $start >= 1.0 else 1)" \
+        && grep -q "Dependency cycle between a, b" "$tmp/cycle.txt" \
+        && ! grep -q "Starting update" "$tmp/cycle.txt"; then
+        print_result "Failed dependencies, cycles and concurrency groups are handled" "PASS"
+    else
+        print_result "Failed dependencies, cycles and concurrency groups are handled" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
+# Test 16: --due runs only resources whose update_frequency window has come
+test_due_resources() {
+    local tmp
+    tmp=$(mktemp -d)
+    cat > "$tmp/count.sh" <<'SCRIPT'
+#!/bin/bash
+echo run >> "$1/$2.count"
+SCRIPT
+    local recent old
+    recent=$(python3 -c "from datetime import datetime, timezone; print(datetime.now(timezone.utc).isoformat(timespec='seconds'))")
+    old=$(python3 -c "from datetime import datetime, timedelta, timezone; print((datetime.now(timezone.utc) - timedelta(days=40)).isoformat(timespec='seconds'))")
+    cat > "$tmp/config.json" <<CONFIG
+{
+  "resources": {
+    "fresh": {"enabled": true, "script": "$tmp/count.sh", "args": ["fresh"], "update_frequency": "weekly"},
+    "stale": {"enabled": true, "script": "$tmp/count.sh", "args": ["stale"], "update_frequency": "monthly"},
+    "new": {"enabled": true, "script": "$tmp/count.sh", "args": ["new"], "update_frequency": "daily"},
+    "failing": {"enabled": true, "script": "$tmp/count.sh", "args": ["failing"], "update_frequency": "daily"}
+  },
+  "global_settings": {"destination_path": "$tmp", "state_file": "$tmp/state.json", "metrics_db": "$tmp/history.db",
+                      "resource_log_dir": "$tmp/logs", "retry_failed": false, "retry_interval": 3600},
+  "schedule": {"timezone": "UTC", "daily": "0 2 * * *", "weekly": "0 2 * * 0", "monthly": "0 2 1 * *"}
+}
+CONFIG
+    cat > "$tmp/state.json" <<STATE
+{"version": 1, "resources": {
+  "fresh": {"last_success": "$recent", "last_attempt": "$recent", "last_result": "success"},
+  "stale": {"last_success": "$old", "last_attempt": "$old", "last_result": "success"},
+  "failing": {"last_attempt": "$recent", "last_result": "failed"}
+}}
+STATE
+    local first=0 second=0
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" --due >"$tmp/first.txt" 2>&1 || first=$?
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" --due >"$tmp/second.txt" 2>&1 || second=$?
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" --daemon --dry-run >"$tmp/daemon.txt" 2>&1 || true
+    if [ $first -eq 0 ] && [ $second -eq 0 ] \
+        && [ ! -f "$tmp/fresh.count" ] && [ ! -f "$tmp/failing.count" ] \
+        && [ "$(wc -l < "$tmp/stale.count")" -eq 1 ] && [ "$(wc -l < "$tmp/new.count")" -eq 1 ] \
+        && grep -q "new is due (never updated)" "$tmp/first.txt" \
+        && grep -q "Nothing is due" "$tmp/second.txt" \
+        && ! grep -q "Starting update" "$tmp/second.txt" \
+        && grep -q "Nothing is due" "$tmp/daemon.txt" \
+        && python3 -c "
+import json
+state = json.load(open('$tmp/state.json'))['resources']
+assert state['new']['last_result'] == 'success' and state['stale']['last_success'] != '$old'
+"; then
+        print_result "Only due resources run and missed windows are caught up" "PASS"
+    else
+        print_result "Only due resources run and missed windows are caught up" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
+# Test 17: Transient failures back off and resume, permanent ones fail fast
+test_retry_classification() {
+    local tmp
+    tmp=$(mktemp -d)
+    cat > "$tmp/flaky.sh" <<'SCRIPT'
+#!/bin/bash
+echo "checkpoint=${EMERGENCY_STORAGE_CHECKPOINT:-none}" >> "$1/flaky.attempts"
+if [ "$(wc -l < "$1/flaky.attempts")" -lt 3 ]; then
+    echo "CHECKPOINT: part$(wc -l < "$1/flaky.attempts")"
+    echo "rsync: read error: Connection reset by peer (104)"
+    exit 12
+fi
+echo "done"
+SCRIPT
+    cat > "$tmp/full.sh" <<'SCRIPT'
+#!/bin/bash
+echo run >> "$1/full.attempts"
+echo "cannot write file: No space left on device" >&2
+exit 11
+SCRIPT
+    cat > "$tmp/config.json" <<CONFIG
+{
+  "resources": {
+    "flaky": {"enabled": true, "script": "$tmp/flaky.sh"},
+    "full": {"enabled": true, "script": "$tmp/full.sh"}
+  },
+  "global_settings": {"destination_path": "$tmp", "max_parallel": 2, "state_file": "$tmp/state.json",
+                      "metrics_db": "$tmp/history.db", "resource_log_dir": "$tmp/logs", "retry_failed": true,
+                      "max_retries": 4,
+                      "retry": {"base_delay": 0.3, "multiplier": 2, "jitter": 0}}
+}
+CONFIG
+    local start end
+    start=$(date +%s.%N)
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" >"$tmp/out.txt" 2>&1 || true
+    end=$(date +%s.%N)
+    if [ "$(wc -l < "$tmp/flaky.attempts")" -eq 3 ] \
+        && [ "$(wc -l < "$tmp/full.attempts")" -eq 1 ] \
+        && [ "$(sed -n 1p "$tmp/flaky.attempts")" = "checkpoint=none" ] \
+        && [ "$(sed -n 3p "$tmp/flaky.attempts")" = "checkpoint=part2" ] \
+        && grep -q "Transient failure of flaky (connection failed), retrying in 0s" "$tmp/out.txt" \
+        && grep -q "Permanent failure of full (disk full), not retrying" "$tmp/out.txt" \
+        && grep -q "resuming from checkpoint 'part2'" "$tmp/out.txt" \
+        && python3 -c "import sys; sys.exit(0 if $end - $start >= 0.9 else 1)"; then
+        print_result "Retries are classified, backed off and resumed from checkpoints" "PASS"
+    else
+        print_result "Retries are classified, backed off and resumed from checkpoints" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
+# Test 18: Runs are recorded in the metrics history and exported
+test_run_metrics() {
+    local tmp
+    tmp=$(mktemp -d)
+    cat > "$tmp/ok.sh" <<'SCRIPT'
+#!/bin/bash
+echo "          2,048 100%    1.95MB/s    0:00:00"
+SCRIPT
+    cat > "$tmp/bad.sh" <<'SCRIPT'
+#!/bin/bash
+echo "cannot write file: No space left on device" >&2
+exit 11
+SCRIPT
+    cat > "$tmp/config.json" <<CONFIG
+{
+  "resources": {
+    "ok": {"enabled": true, "script": "$tmp/ok.sh"},
+    "bad": {"enabled": true, "script": "$tmp/bad.sh"}
+  },
+  "global_settings": {"destination_path": "$tmp", "state_file": "$tmp/state.json",
+                      "resource_log_dir": "$tmp/logs", "retry_failed": false,
+                      "metrics_db": "$tmp/history.db", "metrics_textfile": "$tmp/emergency_storage.prom"}
+}
+CONFIG
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" >"$tmp/out.txt" 2>&1 || true
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" >"$tmp/out.txt" 2>&1 || true
+    local trends recorded=0
+    trends=$(python3 "$REPO_ROOT/scripts/run_metrics.py" --db "$tmp/history.db" trends 2>&1) || true
+    python3 - "$tmp/history.db" <<'CHECK' || recorded=$?
+import sqlite3, sys
+rows = sqlite3.connect(sys.argv[1]).execute(
+    "SELECT job, status, bytes, exit_code, detail FROM runs WHERE tool = 'auto_update' ORDER BY id").fetchall()
+by_job = {job: (status, size, code, detail) for job, status, size, code, detail in rows}
+sys.exit(0 if len(rows) == 4 and by_job["ok"][:3] == ("success", 2048, 0)
+         and by_job["bad"][0] == "failed" and by_job["bad"][2] == 11 and "disk full" in by_job["bad"][3] else 1)
+CHECK
+    if [ "$recorded" -eq 0 ] \
+        && grep -q 'emergency_storage_job_last_success{tool="auto_update",job="ok"} 1' "$tmp/emergency_storage.prom" \
+        && grep -q 'emergency_storage_job_last_success{tool="auto_update",job="bad"} 0' "$tmp/emergency_storage.prom" \
+        && grep -q 'emergency_storage_job_runs_total{tool="auto_update",job="ok",status="success"} 2' "$tmp/emergency_storage.prom" \
+        && echo "$trends" | grep -q "ok"; then
+        print_result "Runs are recorded in the metrics history and exported" "PASS"
+    else
+        print_result "Runs are recorded in the metrics history and exported" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
+# Test 19: Preflight skips resources that don't fit, or refuses the run
+test_preflight_capacity() {
+    local tmp
+    tmp=$(mktemp -d)
+    mkdir -p "$tmp/served" "$tmp/dest"
+    truncate -s 64M "$tmp/served/big.bin"
+    truncate -s 64K "$tmp/served/small.bin"
+    python3 "$REPO_ROOT/tests/http_test_server.py" "$tmp/served" "$tmp/port" > /dev/null 2>&1 &
+    local server=$!
+    for _ in $(seq 50); do [ -s "$tmp/port" ] && break; sleep 0.1; done
+    local url="http://127.0.0.1:$(cat "$tmp/port")"
+    cat > "$tmp/ran.sh" <<'SCRIPT'
+#!/bin/bash
+echo "$0" >> "$1/ran.txt"
+SCRIPT
+    cp "$tmp/ran.sh" "$tmp/small.sh"; cp "$tmp/ran.sh" "$tmp/big.sh"; cp "$tmp/ran.sh" "$tmp/after.sh"
+    # Leave 16 MB above the reserve: the small file fits, the big one doesn't
+    local reserve
+    reserve=$(python3 -c "import shutil; print(shutil.disk_usage('$tmp/dest').free - 16 * 1024 * 1024)")
+    local policy
+    for policy in skip refuse; do
+        cat > "$tmp/$policy.json" <<CONFIG
+{
+  "resources": {
+    "small": {"enabled": true, "script": "$tmp/small.sh", "size_probe": {"url": "$url/small.bin"}},
+    "big": {"enabled": true, "script": "$tmp/big.sh", "size_probe": {"url": "$url/big.bin", "path": "big.bin"}},
+    "after_big": {"enabled": true, "script": "$tmp/after.sh", "depends_on": "big"}
+  },
+  "global_settings": {"destination_path": "$tmp/dest", "max_parallel": 2, "retry_failed": false,
+                      "state_file": "$tmp/state.json", "resource_log_dir": "$tmp/logs", "metrics_db": "off",
+                      "preflight": {"reserve": $reserve, "on_shortfall": "$policy"}}
+}
+CONFIG
+    done
+    local skip_code=0 refuse_code=0 plan_code=0
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/skip.json" >"$tmp/skip.txt" 2>&1 || skip_code=$?
+    local ran_after_skip
+    ran_after_skip=$(cat "$tmp/dest/ran.txt" 2>/dev/null)
+    rm -f "$tmp/dest/ran.txt"
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/refuse.json" >"$tmp/refuse.txt" 2>&1 || refuse_code=$?
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/refuse.json" --plan >"$tmp/plan.txt" 2>&1 || plan_code=$?
+    kill $server 2>/dev/null || true
+    if [ "$skip_code" -eq 1 ] && [ "$ran_after_skip" = "$tmp/small.sh" ] \
+        && grep -q "Skipping big: needs 70.4 MB" "$tmp/skip.txt" \
+        && grep -q "Skipping after_big: depends on big, which is skipped" "$tmp/skip.txt" \
+        && grep -q "small: 64.0 KB (http) -> run" "$tmp/skip.txt" \
+        && [ "$refuse_code" -eq 1 ] && [ "$plan_code" -eq 1 ] && [ ! -f "$tmp/dest/ran.txt" ] \
+        && grep -q "Refusing to start: 2 resource(s) don't fit" "$tmp/refuse.txt" \
+        && grep -q "big: 64.0 MB (http) -> SKIP" "$tmp/plan.txt" \
+        && ! grep -q "Starting update" "$tmp/refuse.txt" "$tmp/plan.txt"; then
+        print_result "Preflight skips resources that don't fit, or refuses the run" "PASS"
+    else
+        print_result "Preflight skips resources that don't fit, or refuses the run" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
+test_bandwidth_budget() {
+    local tmp
+    tmp=$(mktemp -d)
+    cat > "$tmp/share.sh" <<'SCRIPT'
+#!/bin/bash
+echo "${EMERGENCY_STORAGE_BANDWIDTH:-unlimited}" > "$1/$(basename "$0" .sh).txt"
+SCRIPT
+    cp "$tmp/share.sh" "$tmp/one.sh"; cp "$tmp/share.sh" "$tmp/two.sh"; cp "$tmp/share.sh" "$tmp/last.sh"
+    mkdir -p "$tmp/dest"
+    # The two windows cover the whole day, so the 4M default never applies
+    cat > "$tmp/config.json" <<CONFIG
+{
+  "resources": {
+    "one": {"enabled": true, "script": "$tmp/one.sh"},
+    "two": {"enabled": true, "script": "$tmp/two.sh"},
+    "last": {"enabled": true, "script": "$tmp/last.sh", "depends_on": ["one", "two"]}
+  },
+  "global_settings": {"destination_path": "$tmp/dest", "max_parallel": 2, "retry_failed": false,
+                      "state_file": "$tmp/state.json", "resource_log_dir": "$tmp/logs", "metrics_db": "off",
+                      "bandwidth": {"limit": "4M", "windows": [{"start": "00:00", "end": "12:00", "limit": "1M"},
+                                                               {"start": "12:00", "end": "00:00", "limit": "1M"}]}}
+}
+CONFIG
+    local code=0
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" >"$tmp/out.txt" 2>&1 || code=$?
+    local rsync_args
+    rsync_args=$(EMERGENCY_STORAGE_BANDWIDTH=524288 bash -c "source '$REPO_ROOT/scripts/common.sh'; rate_limit_args rsync")
+    # 50 KB at 100 KB/s takes about half a second
+    local paced
+    paced=$(cd "$REPO_ROOT/scripts" && python3 -c "
+import time
+from bandwidth import Throttle
+throttle = Throttle(lambda: 100000)
+start = time.monotonic()
+for _ in range(50):
+    throttle.consume(1000)
+print(0.4 <= time.monotonic() - start < 1.0)")
+    # Queued jobs count until they finish; the share grows as the run drains
+    local shares
+    shares=$(cd "$REPO_ROOT/scripts" && python3 -c "
+from bandwidth import BandwidthSchedule, Governor
+governor = Governor(BandwidthSchedule(900000, min_share=0), slots=2)
+shares = [governor.share()]
+governor.register(3)
+throttle = governor.throttle()
+for _ in range(3):
+    shares.append(throttle._rate_of())
+    governor.unregister()
+print(shares)")
+    if [ "$code" -eq 0 ] && [ "$(cat "$tmp/dest/one.txt" 2>/dev/null)" = "524288" ] \
+        && [ "$(cat "$tmp/dest/two.txt" 2>/dev/null)" = "524288" ] \
+        && [ "$(cat "$tmp/dest/last.txt" 2>/dev/null)" = "1048576" ] \
+        && [ "$shares" = "[450000, 450000, 450000, 900000]" ] \
+        && grep -q "Bandwidth share of one: 512 KB/s" "$tmp/out.txt" \
+        && [ "$rsync_args" = "--bwlimit=512" ] && [ "$paced" = "True" ]; then
+        print_result "Bandwidth budget is shared between parallel resources" "PASS"
+    else
+        print_result "Bandwidth budget is shared between parallel resources" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
+# Test 21: retry_interval counts from the end of a failed run, not its start
+test_retry_after_failed_run() {
+    local tmp
+    tmp=$(mktemp -d)
+    cat > "$tmp/slow_fail.sh" <<'SCRIPT'
+#!/bin/bash
+echo run >> "$1/slow_fail.count"
+sleep 6
+exit 1
+SCRIPT
+    cat > "$tmp/config.json" <<CONFIG
+{
+  "resources": {
+    "slow_fail": {"enabled": true, "script": "$tmp/slow_fail.sh", "update_frequency": "daily"}
+  },
+  "global_settings": {"destination_path": "$tmp", "state_file": "$tmp/state.json", "metrics_db": "$tmp/history.db",
+                      "resource_log_dir": "$tmp/logs", "retry_failed": false, "retry_interval": 5},
+  "schedule": {"timezone": "UTC", "daily": "0 2 * * *"}
+}
+CONFIG
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" --due >"$tmp/first.txt" 2>&1 || true
+    # The run took longer than retry_interval; its failure must not be due at once
+    python3 "$REPO_ROOT/scripts/auto_update.py" --config "$tmp/config.json" --due >"$tmp/second.txt" 2>&1 || true
+    if [ "$(wc -l < "$tmp/slow_fail.count")" -eq 1 ] && grep -q "Nothing is due" "$tmp/second.txt"; then
+        print_result "Failed resources wait retry_interval after the run ended" "PASS"
+    else
+        print_result "Failed resources wait retry_interval after the run ended" "FAIL"
+    fi
+    rm -rf "$tmp"
+}
+
 # Main test execution
 echo "=========================================="
 echo "Auto-Update System Test Suite"
@@ -181,6 +594,15 @@ test_documentation_exists
 test_quick_ref_exists
 test_config_structure
 test_logs_directory
+test_parallel_dependencies
+test_dependency_failures
+test_due_resources
+test_retry_classification
+test_run_metrics
+test_preflight_capacity
+test_bandwidth_budget
+test_retry_after_failed_run
+rm -rf "$METRICS_TMP"
 
 # Print summary
 echo ""
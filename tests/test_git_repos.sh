@@ -8,6 +8,10 @@ REPO_ROOT="$(cd "$SCRIPT_DIR/.." && pwd)"
 
 cd "$REPO_ROOT"
 
+# Keep the run history of the test runs out of the working tree
+METRICS_TMP="$(mktemp -d)"
+export EMERGENCY_STORAGE_METRICS_DB="$METRICS_TMP/run_history.db"
+
 echo "========================================"
 echo "Testing Git Repositories Manager"
 echo "========================================"
@@ -95,7 +99,7 @@ echo "Test 6: Testing dry run execution..."
 if python3 scripts/download_git_repos.py --dry-run --dest /tmp/test_git_repos > /tmp/git_repos_test.log 2>&1; then
     echo "✓ Dry run executed successfully"
     # Check if output contains expected text
-    if grep -q "Starting clone operation" /tmp/git_repos_test.log && grep -q "Starting update operation" /tmp/git_repos_test.log; then
+    if grep -q "Starting clone-or-update operation" /tmp/git_repos_test.log; then
         echo "✓ Output contains expected operations"
     else
         echo "✗ Output missing expected operations"
@@ -204,9 +208,360 @@ else
 fi
 echo
 
+# Test 11: Clone and update a local repository with streamed output
+echo "Test 11: Testing clone and update against a local bare repository..."
+GIT_TMP="$(mktemp -d)"
+git init -q --bare "$GIT_TMP/upstream.git"
+git clone -q "$GIT_TMP/upstream.git" "$GIT_TMP/work" 2>/dev/null
+echo "one" > "$GIT_TMP/work/file.txt"
+git -C "$GIT_TMP/work" add file.txt
+git -C "$GIT_TMP/work" -c user.name=test -c user.email=test@example.com commit -q -m "one"
+git -C "$GIT_TMP/work" push -q origin HEAD 2>/dev/null
+cat > "$GIT_TMP/config.json" << EOF
+{
+  "repositories": [
+    {"url": "file://$GIT_TMP/upstream.git", "name": "upstream", "clone_args": [], "enabled": true},
+    {"url": "file://$GIT_TMP/upstream.git", "name": "verified", "clone_args": [], "enabled": true, "verify": true}
+  ]
+}
+EOF
+push_commit() {
+    echo "$1" > "$GIT_TMP/work/file.txt"
+    git -C "$GIT_TMP/work" -c user.name=test -c user.email=test@example.com commit -q -am "$1"
+    git -C "$GIT_TMP/work" push -q origin HEAD 2>/dev/null
+}
+run_mirror() {
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/config.json" --dest "$GIT_TMP/mirror" > "$GIT_TMP/run.log" 2>&1
+}
+if run_mirror \
+    && [ "$(cat "$GIT_TMP/mirror/upstream/file.txt")" = "one" ] \
+    && [ "$(cat "$GIT_TMP/mirror/verified/file.txt")" = "one" ] \
+    && [ "$(grep -c "SUCCESS: Cloned file://$GIT_TMP/upstream.git" "$GIT_TMP/mirror/gitlog.txt")" = "2" ] \
+    && ! grep -q "SUCCESS: Updated" "$GIT_TMP/mirror/gitlog.txt" \
+    && push_commit two \
+    && run_mirror \
+    && grep -q "2 to update" "$GIT_TMP/run.log" \
+    && [ "$(cat "$GIT_TMP/mirror/upstream/file.txt")" = "two" ] \
+    && grep -q "SUCCESS: Updated file://$GIT_TMP/upstream.git" "$GIT_TMP/mirror/gitlog.txt"; then
+    echo "✓ Local repository cloned once, then updated on the next run"
+else
+    echo "✗ Local clone/update failed"
+    cat "$GIT_TMP/run.log"
+    exit 1
+fi
+echo
+
+# Test 12: Repositories with unchanged remote refs are not pulled
+echo "Test 12: Testing remote-change detection..."
+UPDATES_BEFORE="$(grep -c "SUCCESS: Updated" "$GIT_TMP/mirror/gitlog.txt")"
+if [ -f "$GIT_TMP/mirror/githeads.json" ] \
+    && run_mirror \
+    && grep -q "No repositories to clone-or-update" "$GIT_TMP/run.log" \
+    && [ "$(grep -c "Skipping file://$GIT_TMP/upstream.git - unchanged upstream" "$GIT_TMP/mirror/gitlog.txt")" = "2" ] \
+    && [ "$(grep -c "SUCCESS: Updated" "$GIT_TMP/mirror/gitlog.txt")" = "$UPDATES_BEFORE" ] \
+    && push_commit three \
+    && run_mirror \
+    && grep -q "2 to update" "$GIT_TMP/run.log" \
+    && [ "$(cat "$GIT_TMP/mirror/verified/file.txt")" = "three" ] \
+    && python3 scripts/download_git_repos.py --config "$GIT_TMP/config.json" --dest "$GIT_TMP/mirror" --always-pull > "$GIT_TMP/run.log" 2>&1 \
+    && grep -q "2 to update" "$GIT_TMP/run.log"; then
+    echo "✓ Unchanged repositories skipped, changed ones pulled"
+else
+    echo "✗ Remote-change detection failed"
+    cat "$GIT_TMP/run.log"
+    exit 1
+fi
+echo
+
+# Test 13: Family members share one object store
+echo "Test 13: Testing shared object stores for repository families..."
+git clone -q --bare "$GIT_TMP/upstream.git" "$GIT_TMP/fork.git" 2>/dev/null
+cat > "$GIT_TMP/family.json" << EOF
+{
+  "repositories": [
+    {"url": "file://$GIT_TMP/upstream.git", "name": "main", "clone_args": [], "enabled": true, "family": "proj"},
+    {"url": "file://$GIT_TMP/fork.git", "name": "fork", "clone_args": [], "enabled": true, "family": "proj"},
+    {"url": "file://$GIT_TMP/upstream.git", "name": "shallow", "clone_args": ["--depth", "1"], "enabled": true, "family": "proj"}
+  ]
+}
+EOF
+run_family() {
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/family.json" --dest "$GIT_TMP/family" --max-workers 1 > "$GIT_TMP/run.log" 2>&1
+}
+STORE="$GIT_TMP/family/.families/proj.git"
+if run_family \
+    && [ "$(git --git-dir "$STORE" config gc.pruneExpire)" = "never" ] \
+    && git --git-dir "$STORE" rev-parse -q --verify refs/members/fork/heads/master >/dev/null \
+    && grep -q "proj.git/objects" "$GIT_TMP/family/main/.git/objects/info/alternates" \
+    && grep -q "proj.git/objects" "$GIT_TMP/family/fork/.git/objects/info/alternates" \
+    && [ ! -f "$GIT_TMP/family/shallow/.git/objects/info/alternates" ] \
+    && grep -q "WARNING: .* Shallow clones can't share" "$GIT_TMP/family/gitlog.txt" \
+    && [ "$(git -C "$GIT_TMP/family/fork" count-objects -v | awk '/^(count|in-pack):/ {n += $2} END {print n}')" = "0" ] \
+    && rm -rf "$GIT_TMP/family/main" \
+    && git -C "$GIT_TMP/family/fork" fsck --no-progress >/dev/null 2>&1 \
+    && [ "$(cat "$GIT_TMP/family/fork/file.txt")" = "three" ]; then
+    echo "✓ Family members share the store and survive deletion of a sibling"
+else
+    echo "✗ Family object store failed"
+    cat "$GIT_TMP/run.log"
+    exit 1
+fi
+echo
+
+# Test 14: Background log writer (concurrency, JSON lines, rotation)
+echo "Test 14: Testing the background log writer..."
+if python3 - "$GIT_TMP" << 'EOF'
+import json, sys, threading
+from pathlib import Path
+sys.path.insert(0, "scripts")
+import log_writer
+
+tmp = Path(sys.argv[1])
+writer = log_writer.LogWriter(tmp / "threads.log")
+def work(n):
+    for i in range(500):
+        writer.write(f"INFO: worker {n} line {i}")
+threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+for t in threads: t.start()
+for t in threads: t.join()
+writer.close()
+lines = (tmp / "threads.log").read_text().splitlines()
+assert len(lines) == 4000 and all(l.startswith("[") and " INFO: worker " in l for l in lines)
+
+writer = log_writer.LogWriter(tmp / "rotate.jsonl", fmt="json", max_bytes=400, backups=2)
+for i in range(40):
+    writer.write(f"ERROR: failure {i}")
+writer.write("plain message")
+writer.flush()
+records = [json.loads(l) for l in (tmp / "rotate.jsonl").read_text().splitlines()]
+assert records[-1] == {"time": records[-1]["time"], "level": "info", "message": "plain message"}
+assert (tmp / "rotate.jsonl.2").exists() and not (tmp / "rotate.jsonl.3").exists()
+assert all(p.stat().st_size <= 400 for p in tmp.glob("rotate.jsonl*"))
+first = json.loads((tmp / "rotate.jsonl.1").read_text().splitlines()[0])
+assert first["level"] == "error" and first["message"].startswith("failure ")
+writer.close()
+EOF
+then
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/config.json" --dest "$GIT_TMP/mirror" --log-format json > "$GIT_TMP/run.log" 2>&1
+    if python3 -c "import json,sys; [json.loads(l) for l in open(sys.argv[1])]" "$GIT_TMP/mirror/gitlog.jsonl" \
+        && grep -q '"message": "Skipping file://.* - unchanged upstream"' "$GIT_TMP/mirror/gitlog.jsonl"; then
+        echo "✓ Log lines are complete, rotated and optionally written as JSON lines"
+    else
+        echo "✗ JSON log output failed"
+        cat "$GIT_TMP/run.log"
+        exit 1
+    fi
+else
+    echo "✗ Background log writer failed"
+    exit 1
+fi
+echo
+
+# Test 15: Partial clone, sparse checkout and progressive deepening
+echo "Test 15: Testing partial, sparse and progressive clones..."
+git init -q --bare "$GIT_TMP/big.git"
+git -C "$GIT_TMP/big.git" config uploadpack.allowFilter true
+git clone -q "$GIT_TMP/big.git" "$GIT_TMP/bigwork" 2>/dev/null
+mkdir -p "$GIT_TMP/bigwork/docs" "$GIT_TMP/bigwork/src"
+for i in 1 2 3 4 5; do
+    echo "$i" > "$GIT_TMP/bigwork/docs/readme.txt"
+    echo "$i" > "$GIT_TMP/bigwork/src/main.c"
+    git -C "$GIT_TMP/bigwork" add -A
+    git -C "$GIT_TMP/bigwork" -c user.name=test -c user.email=test@example.com commit -q -m "commit $i"
+done
+git -C "$GIT_TMP/bigwork" push -q origin HEAD 2>/dev/null
+cat > "$GIT_TMP/big.json" << EOF
+{
+  "repositories": [
+    {"url": "file://$GIT_TMP/big.git", "name": "blobless", "clone_args": [], "enabled": true, "partial": "blobless"},
+    {"url": "file://$GIT_TMP/big.git", "name": "sparse", "clone_args": [], "enabled": true, "sparse": ["docs"]},
+    {"url": "file://$GIT_TMP/big.git", "name": "progressive", "clone_args": [], "enabled": true, "deepen": 2}
+  ]
+}
+EOF
+run_big() {
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/big.json" --dest "$GIT_TMP/big" > "$GIT_TMP/run.log" 2>&1
+}
+depth() {
+    git -C "$GIT_TMP/big/progressive" rev-list --count HEAD
+}
+if run_big \
+    && [ "$(git -C "$GIT_TMP/big/blobless" config remote.origin.partialclonefilter)" = "blob:none" ] \
+    && [ -f "$GIT_TMP/big/sparse/docs/readme.txt" ] && [ ! -e "$GIT_TMP/big/sparse/src" ] \
+    && [ "$(depth)" = "2" ] \
+    && run_big && grep -q "1 to update" "$GIT_TMP/run.log" && [ "$(depth)" = "4" ] \
+    && run_big && [ "$(depth)" = "5" ] && [ ! -f "$GIT_TMP/big/progressive/.git/shallow" ] \
+    && grep -q "INFO: progressive now has its full history" "$GIT_TMP/big/gitlog.txt" \
+    && run_big && grep -q "No repositories to clone-or-update" "$GIT_TMP/run.log"; then
+    echo "✓ Partial, sparse and progressive repositories handled"
+else
+    echo "✗ Partial/sparse/progressive clone failed"
+    cat "$GIT_TMP/run.log"
+    exit 1
+fi
+echo
+
+# Test 16: Run history drives longest-first scheduling and the worker suggestion
+echo "Test 16: Testing longest-job-first scheduling from run history..."
+if python3 - "$GIT_TMP" << 'EOF'
+import json, sys
+from pathlib import Path
+sys.path.insert(0, "scripts")
+from download_git_repos import RunHistory, schedule_jobs, suggest_workers
+
+tmp = Path(sys.argv[1])
+history = RunHistory(tmp / "history.json")
+history.record("small", "update", 10, True, {})
+history.record("giant", "update", 400, True, {"bytes": 1000, "objects": 5})
+history.record("medium", "clone", 50, False, {})
+history.save()
+history = RunHistory(tmp / "history.json")
+assert history.data["giant"]["update"] == {**history.data["giant"]["update"], "bytes": 1000, "objects": 5, "outcome": "success"}
+jobs = [({"name": n}, "update") for n in ("small", "new", "medium", "giant")]
+scheduled = schedule_jobs(jobs, history)
+assert [job[0]["name"] for job in scheduled] == ["giant", "new", "medium", "small"], scheduled
+assert scheduled[1][2] == 50  # median of the known durations
+assert suggest_workers([job[2] for job in scheduled]) == 2
+assert suggest_workers([10, 10, 10, 10]) == 4 and suggest_workers([]) is None
+EOF
+then
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/big.json" --dest "$GIT_TMP/big2" --max-workers auto > "$GIT_TMP/run.log" 2>&1
+    if grep -q "Max parallel workers: auto" "$GIT_TMP/run.log" \
+        && grep -q "Using 4 worker(s)" "$GIT_TMP/run.log" \
+        && python3 -c "import json,sys; h=json.load(open(sys.argv[1])); assert h['blobless']['clone']['objects'] > 0 and h['sparse']['clone']['outcome'] == 'success'" "$GIT_TMP/big2/githistory.json" \
+        && python3 scripts/download_git_repos.py --config "$GIT_TMP/big.json" --dest "$GIT_TMP/big2" --max-workers auto --always-pull > "$GIT_TMP/run.log" 2>&1 \
+        && grep -q "Suggested --max-workers from run history" "$GIT_TMP/run.log"; then
+        echo "✓ Jobs ordered longest-first and worker count suggested from history"
+    else
+        echo "✗ Run history was not recorded or used"
+        cat "$GIT_TMP/run.log"
+        exit 1
+    fi
+else
+    echo "✗ Longest-first scheduling failed"
+    exit 1
+fi
+echo
+
+# Test 17: Full and incremental bundle snapshots, restored without network
+echo "Test 17: Testing git bundle snapshots..."
+BUNDLES="$GIT_TMP/mirror/.bundles"
+run_bundle() {
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/config.json" --dest "$GIT_TMP/mirror" --bundle "$@" > "$GIT_TMP/run.log" 2>&1
+}
+if run_bundle && grep -q "Bundles: 2 full, 0 incremental" "$GIT_TMP/run.log" \
+    && push_commit four \
+    && run_bundle && grep -q "Bundles: 0 full, 2 incremental" "$GIT_TMP/run.log" \
+    && run_bundle && grep -q "Bundles: 0 full, 0 incremental, 2 unchanged" "$GIT_TMP/run.log" \
+    && [ -f "$BUNDLES/upstream/0001-full.bundle" ] && [ -f "$BUNDLES/upstream/0002-incremental.bundle" ] \
+    && python3 -c "import json,sys; e=json.load(open(sys.argv[1]))['repositories']['upstream']; assert [b['kind'] for b in e['bundles']] == ['full', 'incremental'] and len(e['bundles'][1]['sha256']) == 64" "$BUNDLES/index.json" \
+    && python3 scripts/download_git_repos.py --dest "$GIT_TMP/mirror" --restore upstream --restore-to "$GIT_TMP/restored" > "$GIT_TMP/run.log" 2>&1 \
+    && [ "$(cat "$GIT_TMP/restored/file.txt")" = "four" ] \
+    && [ "$(git -C "$GIT_TMP/restored" remote get-url origin)" = "file://$GIT_TMP/upstream.git" ] \
+    && run_bundle --bundle-full && grep -q "Bundles: 2 full" "$GIT_TMP/run.log" \
+    && [ ! -f "$BUNDLES/upstream/0001-full.bundle" ] && [ -f "$BUNDLES/upstream/0003-full.bundle" ]; then
+    echo "✓ Bundles written incrementally and restored offline"
+else
+    echo "✗ Bundle snapshots failed"
+    cat "$GIT_TMP/run.log"
+    exit 1
+fi
+echo "corrupt" >> "$BUNDLES/verified/0003-full.bundle"
+if python3 scripts/download_git_repos.py --dest "$GIT_TMP/mirror" --restore verified --restore-to "$GIT_TMP/restored2" > "$GIT_TMP/run.log" 2>&1; then
+    echo "✗ Restore from a damaged bundle succeeded"
+    exit 1
+elif grep -q "missing or truncated" "$GIT_TMP/run.log" && [ ! -e "$GIT_TMP/restored2" ]; then
+    echo "✓ Damaged bundle detected before restoring"
+else
+    echo "✗ Damaged bundle not reported"
+    cat "$GIT_TMP/run.log"
+    exit 1
+fi
+echo
+
+# Test 18: Budgeted maintenance after updates
+echo "Test 18: Testing the maintenance stage..."
+push_commit five
+run_maintenance() {
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/config.json" --dest "$GIT_TMP/mirror" --maintenance --maintenance-repos 1 "$@" > "$GIT_TMP/run.log" 2>&1
+}
+MAINT="$GIT_TMP/mirror/gitmaintenance.json"
+if run_maintenance && grep -q "Maintaining 1 of 2 repositories" "$GIT_TMP/run.log" \
+    && python3 -c "import json,sys; s=json.load(open(sys.argv[1])); assert list(s) == ['upstream'] and s['upstream']['outcome'] == 'success' and 'commit-graph' in s['upstream']['steps'] and s['upstream']['loose_after'] == 0, s" "$MAINT" \
+    && ls "$GIT_TMP/mirror/upstream/.git/objects/pack/" | grep -q "multi-pack-index" \
+    && [ -f "$GIT_TMP/mirror/upstream/.git/objects/info/commit-graphs/commit-graph-chain" ] \
+    && run_maintenance && python3 -c "import json,sys; s=json.load(open(sys.argv[1])); assert sorted(s) == ['upstream', 'verified']" "$MAINT" \
+    && run_maintenance --maintenance-time 0 && grep -q "Time box used up" "$GIT_TMP/run.log"; then
+    echo "✓ Maintenance ran within its budget and recorded what it did"
+else
+    echo "✗ Maintenance stage failed"
+    cat "$GIT_TMP/run.log"
+    cat "$MAINT" 2>/dev/null
+    exit 1
+fi
+echo
+
+# Test 19: Parallel Git LFS fetch against a local stand-in LFS server
+echo "Test 19: Testing Git LFS object fetch..."
+LFS_SERVER="$GIT_TMP/lfsserver"
+mkdir -p "$LFS_SERVER/lfs"
+python3 tests/http_test_server.py "$LFS_SERVER" "$LFS_SERVER/port" > /dev/null 2>&1 &
+LFS_PID=$!
+trap 'kill $LFS_PID 2>/dev/null || true' EXIT
+git init -q --bare "$GIT_TMP/lfs.git"
+git clone -q "$GIT_TMP/lfs.git" "$GIT_TMP/lfswork" 2>/dev/null
+python3 - "$LFS_SERVER/lfs" "$GIT_TMP/lfswork" << 'EOF'
+import hashlib, os, sys
+server, work = sys.argv[1:]
+for name, size in (("model.bin", 1024 * 1024 + 7), ("data.csv", 5000), ("tiny.txt", 12)):
+    content = os.urandom(size)
+    oid = hashlib.sha256(content).hexdigest()
+    open(os.path.join(server, oid), "wb").write(content)
+    with open(os.path.join(work, name), "w") as f:
+        f.write(f"version https://git-lfs.github.com/spec/v1\noid sha256:{oid}\nsize {size}\n")
+EOF
+git -C "$GIT_TMP/lfswork" add -A
+git -C "$GIT_TMP/lfswork" -c user.name=test -c user.email=test@example.com commit -q -m "lfs pointers"
+git -C "$GIT_TMP/lfswork" push -q origin HEAD 2>/dev/null
+for _ in $(seq 50); do [ -s "$LFS_SERVER/port" ] && break; sleep 0.1; done
+cat > "$GIT_TMP/lfs.json" << EOF
+{
+  "repositories": [
+    {"url": "file://$GIT_TMP/lfs.git", "name": "lfsrepo", "clone_args": [], "enabled": true,
+     "lfs": {"concurrency": 3, "url": "http://127.0.0.1:$(cat "$LFS_SERVER/port")/flaky/lfs.git/info/lfs"}}
+  ]
+}
+EOF
+run_lfs() {
+    python3 scripts/download_git_repos.py --config "$GIT_TMP/lfs.json" --dest "$GIT_TMP/lfsmirror" "$@" > "$GIT_TMP/run.log" 2>&1 || true
+}
+count_lfs_objects() {
+    find "$GIT_TMP/lfsmirror/lfsrepo/.git/lfs/objects" -type f 2>/dev/null | wc -l
+}
+# The flaky endpoint drops every object halfway the first time; the next run resumes
+run_lfs
+if grep -q "LFS fetch incomplete: 0 fetched, 0 already present, 3 failed" "$GIT_TMP/lfsmirror/gitlog.txt" \
+    && [ "$(find "$GIT_TMP/lfsmirror/lfsrepo/.git/lfs/incomplete" -type f -size +0 | wc -l)" = "3" ] \
+    && run_lfs && grep -q "LFS objects of lfsrepo: 3 fetched, 0 already present" "$GIT_TMP/lfsmirror/gitlog.txt" \
+    && [ "$(count_lfs_objects)" = "3" ] \
+    && for object in "$LFS_SERVER"/lfs/*; do cmp -s "$object" "$(find "$GIT_TMP/lfsmirror/lfsrepo/.git/lfs/objects" -name "$(basename "$object")")" || exit 1; done \
+    && run_lfs --always-pull && grep -q "LFS objects of lfsrepo: 0 fetched, 3 already present" "$GIT_TMP/lfsmirror/gitlog.txt"; then
+    echo "✓ LFS objects fetched in parallel, resumed and skipped when present"
+else
+    echo "✗ Git LFS fetch failed"
+    cat "$GIT_TMP/run.log"
+    cat "$GIT_TMP/lfsmirror/gitlog.txt" 2>/dev/null
+    exit 1
+fi
+kill $LFS_PID 2>/dev/null || true
+echo
+
 # Clean up test files
 rm -f /tmp/test_git_config.json
 rm -f /tmp/git_repos_*.log
+rm -rf "$GIT_TMP"
+
+rm -rf "$METRICS_TMP"
 
 echo "========================================"
 echo "All tests passed! ✓"
@@ -8,6 +8,10 @@ REPO_ROOT="$(cd "$SCRIPT_DIR/.." && pwd)"
 
 cd "$REPO_ROOT"
 
+# Keep the run history of the test runs out of the working tree
+METRICS_TMP="$(mktemp -d)"
+export EMERGENCY_STORAGE_METRICS_DB="$METRICS_TMP/run_history.db"
+
 echo "========================================"
 echo "Testing Manual Sources Download System"
 echo "========================================"
@@ -23,17 +27,19 @@ else
 fi
 echo
 
-# Test 2: Validate JSON structure (flat with methods as keys)
+# Test 2: Validate JSON structure (list of sources with stable IDs)
 echo "Test 2: Validating JSON structure..."
 if python3 -c "
 import json
 with open('data/manual_sources.json', 'r') as f:
     data = json.load(f)
-    # New structure: top-level keys are download methods
     assert isinstance(data, dict), 'Root must be a dictionary'
+    assert isinstance(data['sources'], list), 'sources must be a list'
+    ids = [source['id'] for source in data['sources']]
+    assert len(ids) == len(set(ids)), 'Source IDs must be unique'
     print(f\"✓ JSON structure valid\")
-    print(f\"  - Total download methods: {len(data)}\")
-    print(f\"  - Methods: {', '.join(data.keys())}\")
+    print(f\"  - Total sources: {len(ids)}\")
+    print(f\"  - Methods: {', '.join(source['method'] for source in data['sources'])}\")
 " 2>&1; then
     echo "✓ JSON validation passed"
 else
@@ -50,8 +56,10 @@ import json
 with open('data/manual_sources.json', 'r') as f:
     data = json.load(f)
     
-    for method, source_info in data.items():
-        assert isinstance(source_info, dict), f'Source info for {method} must be dict'
+    for source_info in data['sources']:
+        assert isinstance(source_info, dict), f'Source info must be dict'
+        method = source_info['id']
+        assert 'method' in source_info, f'method missing for {method}'
         assert 'url' in source_info, f'url missing for {method}'
         assert 'updateFile' in source_info, f'updateFile missing for {method}'
         assert 'downloaded' in source_info, f'downloaded missing for {method}'
@@ -106,7 +114,8 @@ with open('data/manual_sources.json', 'r') as f:
     data = json.load(f)
     
     # Check that URL fields contain method-specific syntax
-    for method, source_info in data.items():
+    for source_info in data['sources']:
+        method = source_info['method']
         url_field = source_info['url']
         print(f\"  {method}: {url_field}\")
         
@@ -148,7 +157,7 @@ with open('data/manual_sources.json', 'r') as f:
     has_update_true = False
     has_update_false = False
     
-    for method, source_info in data.items():
+    for source_info in data['sources']:
         if source_info['updateFile']:
             has_update_true = True
         else:
@@ -166,6 +175,583 @@ else
 fi
 echo
 
+# Test 9: Parallel execution keeps bookkeeping correct
+echo "Test 9: Testing parallel execution with --jobs..."
+TMP_CONFIG="$(mktemp -d)/manual_sources.json"
+cat > "$TMP_CONFIG" << 'EOF'
+{
+  "true": {"url": "https://a.example.com/one", "updateFile": false, "downloaded": false, "alternative": []},
+  "false": {"url": "https://b.example.com/two", "updateFile": false, "downloaded": false, "alternative": ["https://c.example.com/two"]},
+  "echo": {"url": "https://a.example.com/three", "updateFile": false, "downloaded": true, "alternative": []}
+}
+EOF
+if python3 scripts/download_manual_sources.py --config "$TMP_CONFIG" --jobs 3 --per-host 1 > /tmp/manual_sources_parallel.log 2>&1 \
+    && grep -q "Downloaded: 1" /tmp/manual_sources_parallel.log \
+    && grep -q "Skipped: 1" /tmp/manual_sources_parallel.log \
+    && grep -q "Failed: 1" /tmp/manual_sources_parallel.log \
+    && python3 -c "
+import json
+data = json.load(open('$TMP_CONFIG'))
+assert data['true']['downloaded'] is True
+assert data['false']['downloaded'] is False
+" 2>&1 \
+    && [ ! -f "$TMP_CONFIG.journal" ]; then
+    echo "✓ Parallel run counted and recorded sources correctly"
+else
+    echo "✗ Parallel run bookkeeping incorrect"
+    cat /tmp/manual_sources_parallel.log
+    exit 1
+fi
+rm -rf "$(dirname "$TMP_CONFIG")"
+echo
+
+# Test 10: Host extraction and per-host ordering
+echo "Test 10: Testing host extraction for per-host limits..."
+if python3 -c "
+import sys
+sys.path.insert(0, 'scripts')
+from download_manual_sources import HostQueue, extract_host
+from source_index import SourceIndex
+
+assert extract_host('-c https://Example.com/file.zip') == 'example.com'
+assert extract_host('-avz user@backup.host:/data/ /local/') == 'backup.host'
+assert extract_host('clone https://github.com/user/repo.git') == 'github.com'
+assert extract_host('--help') == ''
+
+config = {
+    'a1': {'url': 'https://a.com/1'},
+    'a2': {'url': 'https://a.com/2'},
+    'a3': {'url': 'https://a.com/3'},
+    'b1': {'url': 'https://b.com/1'},
+}
+sources = {source.id: source for source in SourceIndex(config).sources}
+hosts = HostQueue(list(sources.values()), per_host=1)
+# a.com's other sources wait for its slot instead of taking pool threads
+assert [source.id for source in hosts.ready(3)] == ['a1', 'b1']
+assert hosts.ready(3) == []
+hosts.done(sources['b1'])
+assert hosts.ready(3) == []
+hosts.done(sources['a1'])
+assert [source.id for source in hosts.ready(3)] == ['a2']
+print('✓ Hosts extracted, sources released as their host frees a slot')
+" 2>&1; then
+    echo "✓ Host extraction passed"
+else
+    echo "✗ Host extraction failed"
+    exit 1
+fi
+echo
+
+# Test 11: Journaled config persistence
+echo "Test 11: Testing journaled, atomic config persistence..."
+if python3 -c "
+import json, sys, tempfile
+from pathlib import Path
+sys.path.insert(0, 'scripts')
+from state_store import ConfigStore, journal_path
+
+tmp = Path(tempfile.mkdtemp()) / 'sources.json'
+tmp.write_text(json.dumps({'wget': {'url': 'a', 'downloaded': False}}))
+
+store = ConfigStore.load(tmp)
+store.record(['wget', 'downloaded'], True)
+store.record(['wget', 'url'], 'b')
+# Nothing rewritten yet, changes live in the journal
+assert json.loads(tmp.read_text())['wget']['downloaded'] is False
+assert journal_path(tmp).exists()
+
+# Simulate a crash: torn journal line, then reload replays and compacts
+with open(journal_path(tmp), 'a') as f:
+    f.write('{\"path\": [\"wget\"')
+reloaded = ConfigStore.load(tmp)
+assert reloaded.data['wget'] == {'url': 'b', 'downloaded': True}
+assert json.loads(tmp.read_text())['wget']['url'] == 'b'
+assert not journal_path(tmp).exists()
+print('✓ Journal replayed and compacted atomically')
+" 2>&1; then
+    echo "✓ Config persistence passed"
+else
+    echo "✗ Config persistence failed"
+    exit 1
+fi
+echo
+
+# Test 12: Native HTTP engine (resume and keep-alive pooling)
+echo "Test 12: Testing native http method against a local server..."
+HTTP_DIR="$(mktemp -d)"
+python3 -c "import os; open('$HTTP_DIR/payload.bin', 'wb').write(os.urandom(3 * 1024 * 1024 + 17))"
+python3 -c "open('$HTTP_DIR/small.txt', 'w').write('hello')"
+python3 tests/http_test_server.py "$HTTP_DIR" "$HTTP_DIR/port" > /dev/null 2>&1 &
+HTTP_PID=$!
+trap 'kill $HTTP_PID 2>/dev/null || true; rm -rf "$HTTP_DIR"' EXIT
+for _ in $(seq 50); do [ -s "$HTTP_DIR/port" ] && break; sleep 0.1; done
+HTTP_PORT="$(cat "$HTTP_DIR/port")"
+OUT_DIR="$(mktemp -d)"
+cat > "$OUT_DIR/sources.json" << EOF
+{
+  "http": {"url": "-O $OUT_DIR/payload.bin http://127.0.0.1:$HTTP_PORT/payload.bin", "updateFile": true, "downloaded": false, "alternative": []}
+}
+EOF
+if python3 scripts/download_manual_sources.py --config "$OUT_DIR/sources.json" > /tmp/manual_sources_http.log 2>&1 \
+    && cmp -s "$HTTP_DIR/payload.bin" "$OUT_DIR/payload.bin" \
+    && python3 -c "
+import sys
+sys.path.insert(0, 'scripts')
+import http_engine
+
+# Truncate to simulate an interrupted transfer, then resume it
+with open('$OUT_DIR/payload.bin', 'r+b') as f:
+    f.truncate(1024 * 1024)
+result = http_engine.download('http://127.0.0.1:$HTTP_PORT/payload.bin', '$OUT_DIR/payload.bin')
+assert result.resumed and result.status == 206, result
+assert result.bytes_written == 2 * 1024 * 1024 + 17, result
+assert open('$OUT_DIR/payload.bin', 'rb').read() == open('$HTTP_DIR/payload.bin', 'rb').read()
+
+# A complete file is accepted on 416; one larger than the remote file is fetched again
+result = http_engine.download('http://127.0.0.1:$HTTP_PORT/payload.bin', '$OUT_DIR/payload.bin')
+assert result.status == 416 and result.bytes_written == 0, result
+with open('$OUT_DIR/payload.bin', 'ab') as f:
+    f.write(b'stale tail')
+result = http_engine.download('http://127.0.0.1:$HTTP_PORT/payload.bin', '$OUT_DIR/payload.bin')
+assert result.status == 200 and not result.resumed, result
+assert open('$OUT_DIR/payload.bin', 'rb').read() == open('$HTTP_DIR/payload.bin', 'rb').read()
+
+# Several requests to one host share a single pooled connection
+pool = http_engine.ConnectionPool()
+before = http_engine.open_url('http://127.0.0.1:$HTTP_PORT/_stats', pool=pool)
+start = int(before.read(100).decode().split('=')[1]); before.close()
+for i in range(5):
+    http_engine.download('http://127.0.0.1:$HTTP_PORT/small.txt', '$OUT_DIR/small%d.txt' % i, pool=pool)
+after = http_engine.open_url('http://127.0.0.1:$HTTP_PORT/_stats', pool=pool)
+end = int(after.read(100).decode().split('=')[1]); after.close()
+assert end == start, (start, end)
+print('✓ Resumed partial file, replaced an oversized one and reused one connection')
+" 2>&1; then
+    echo "✓ Native HTTP engine passed"
+else
+    echo "✗ Native HTTP engine failed"
+    cat /tmp/manual_sources_http.log
+    exit 1
+fi
+rm -rf "$OUT_DIR"
+echo
+
+# Test 13: Segmented multi-connection downloads
+echo "Test 13: Testing segmented downloads with failed-segment retry..."
+OUT_DIR="$(mktemp -d)"
+if python3 -c "
+import sys
+sys.path.insert(0, 'scripts')
+import http_engine
+
+expected = open('$HTTP_DIR/payload.bin', 'rb').read()
+base = 'http://127.0.0.1:$HTTP_PORT'
+
+assert http_engine.plan_segments(100, 4, min_size=10) == [[0, 24, 0], [25, 49, 0], [50, 74, 0], [75, 99, 0]]
+assert http_engine.plan_segments(100, 2, start=40, min_size=10) == [[0, 39, 40], [40, 69, 0], [70, 99, 0]]
+
+# Every segment's first response is cut off halfway; only those ranges are retried
+result = http_engine.segmented_download(base + '/flaky/payload.bin', '$OUT_DIR/a.bin', segments=4,
+                                        min_segment_size=256 * 1024, chunk_size=64 * 1024)
+assert open('$OUT_DIR/a.bin', 'rb').read() == expected
+assert result.bytes_written == len(expected)
+assert not http_engine.segment_state_path('$OUT_DIR/a.bin').exists()
+
+# A plain partial file is only a finished leading segment if the validator cache vouches for it
+cache = http_engine.MetadataCache('$OUT_DIR/cache.json')
+open('$OUT_DIR/b.bin', 'wb').write(expected[:1000000])
+result = http_engine.segmented_download(base + '/payload.bin', '$OUT_DIR/b.bin', segments=3,
+                                        min_segment_size=256 * 1024, cache=cache)
+assert not result.resumed and result.bytes_written == len(expected), result
+result = http_engine.segmented_download(base + '/payload.bin', '$OUT_DIR/b.bin', segments=3,
+                                        min_segment_size=256 * 1024, cache=cache)
+assert result.status == 304 and result.bytes_written == 0, result
+with open('$OUT_DIR/b.bin', 'r+b') as f:
+    f.truncate(1000000)
+result = http_engine.segmented_download(base + '/payload.bin', '$OUT_DIR/b.bin', segments=3,
+                                        min_segment_size=256 * 1024, cache=cache)
+assert result.resumed and result.bytes_written == len(expected) - 1000000, result
+assert open('$OUT_DIR/b.bin', 'rb').read() == expected
+print('✓ Segmented download reassembled the file and retried failed ranges')
+
+# A download starts over if the file changed upstream: before resuming (same size
+# or grown), or between range requests (If-Range)
+import os
+changing = '$HTTP_DIR/changing.bin'
+def replace(data):
+    mtime = os.stat(changing).st_mtime_ns
+    open(changing, 'wb').write(data)
+    os.utime(changing, ns=(mtime + 2 * 10**9, mtime + 2 * 10**9))
+def interrupt(done, total):
+    raise http_engine.DownloadAborted('interrupted')
+for grow in (0, 4096):
+    open(changing, 'wb').write(os.urandom(len(expected)))
+    try:
+        http_engine.segmented_download(base + '/changing.bin', '$OUT_DIR/e.bin', segments=4,
+                                       min_segment_size=256 * 1024, chunk_size=64 * 1024, progress=interrupt)
+        raise AssertionError('download was not interrupted')
+    except http_engine.DownloadAborted:
+        pass
+    assert http_engine.segment_state_path('$OUT_DIR/e.bin').exists()
+    new = os.urandom(len(expected) + grow)
+    replace(new)
+    result = http_engine.segmented_download(base + '/changing.bin', '$OUT_DIR/e.bin', segments=4,
+                                            min_segment_size=256 * 1024)
+    assert not result.resumed and result.bytes_written == len(new), result
+    assert open('$OUT_DIR/e.bin', 'rb').read() == new
+new = os.urandom(len(expected))
+def change_once(done, total):
+    if not calls:
+        calls.append(done)
+        replace(new)
+calls = []
+# The flaky server cuts every first response short, so the retries see the new version
+result = http_engine.segmented_download(base + '/flaky/changing.bin', '$OUT_DIR/f.bin', segments=4,
+                                        min_segment_size=256 * 1024, chunk_size=64 * 1024,
+                                        progress=change_once)
+assert not result.resumed and open('$OUT_DIR/f.bin', 'rb').read() == new
+print('✓ Changed upstream files were downloaded again from the start')
+
+# A watchdog abort stops every segment at once instead of being retried
+from stream_runner import Watchdog, WatchdogPolicy
+guard = Watchdog(WatchdogPolicy(window=0.001, max_duration=0.001))
+calls = []
+def watched(done, total):
+    calls.append(done)
+    reason = guard.check(done, 0)
+    if reason:
+        raise http_engine.DownloadAborted(f'watchdog: {reason}')
+try:
+    http_engine.segmented_download(base + '/flaky/payload.bin', '$OUT_DIR/d.bin', segments=4,
+                                   min_segment_size=256 * 1024, chunk_size=64 * 1024, progress=watched)
+    raise AssertionError('watchdog abort was ignored')
+except http_engine.DownloadAborted as e:
+    assert 'watchdog' in str(e) and 'retries' not in str(e), e
+assert len(calls) <= 4, f'aborted segments were retried: {len(calls)} chunks'
+assert http_engine.segment_state_path('$OUT_DIR/d.bin').exists()
+print('✓ Watchdog abort stopped the segmented download without retries')
+" 2>&1 \
+    && python3 scripts/http_engine.py --segments 4 "http://127.0.0.1:$HTTP_PORT/payload.bin" "$OUT_DIR/c.bin" > /dev/null \
+    && cmp -s "$HTTP_DIR/payload.bin" "$OUT_DIR/c.bin"; then
+    echo "✓ Segmented downloads passed"
+else
+    echo "✗ Segmented downloads failed"
+    exit 1
+fi
+rm -rf "$OUT_DIR" "$HTTP_DIR/changing.bin"
+echo
+
+# Test 14: Conditional requests for updateFile sources
+echo "Test 14: Testing conditional-request metadata cache..."
+OUT_DIR="$(mktemp -d)"
+python3 -c "open('$HTTP_DIR/daily.txt', 'w').write('version 1')"
+cat > "$OUT_DIR/sources.json" << EOF
+{
+  "http": {"url": "-O $OUT_DIR/daily.txt http://127.0.0.1:$HTTP_PORT/daily.txt", "updateFile": true, "downloaded": false, "alternative": []},
+  "curl": {"url": "-s -f -o $OUT_DIR/curl.txt http://127.0.0.1:$HTTP_PORT/daily.txt", "updateFile": true, "downloaded": false, "alternative": []}
+}
+EOF
+run_sources() {
+    python3 scripts/download_manual_sources.py --config "$OUT_DIR/sources.json" > "$1" 2>&1
+}
+if run_sources /tmp/manual_sources_cond1.log \
+    && [ -f "$OUT_DIR/sources.http_cache.json" ] \
+    && run_sources /tmp/manual_sources_cond2.log \
+    && [ "$(grep -c "Not modified" /tmp/manual_sources_cond2.log)" = "2" ] \
+    && grep -q "Downloaded: 2" /tmp/manual_sources_cond2.log \
+    && rm "$OUT_DIR/curl.txt" \
+    && run_sources /tmp/manual_sources_cond2b.log \
+    && [ "$(grep -c "Not modified" /tmp/manual_sources_cond2b.log)" = "1" ] \
+    && [ "$(cat "$OUT_DIR/curl.txt")" = "version 1" ] \
+    && sleep 1.1 && python3 -c "open('$HTTP_DIR/daily.txt', 'w').write('version 2')" \
+    && run_sources /tmp/manual_sources_cond3.log \
+    && ! grep -q "Not modified" /tmp/manual_sources_cond3.log \
+    && [ "$(cat "$OUT_DIR/daily.txt")" = "version 2" ] \
+    && [ "$(cat "$OUT_DIR/curl.txt")" = "version 2" ]; then
+    echo "✓ Unchanged files answered with 304, changed or deleted files downloaded again"
+else
+    echo "✗ Conditional requests failed"
+    cat /tmp/manual_sources_cond*.log
+    exit 1
+fi
+rm -rf "$OUT_DIR" /tmp/manual_sources_cond*.log
+echo
+
+# Test 15: Racing main URL against alternatives
+echo "Test 15: Testing --race ordering by measured latency..."
+OUT_DIR="$(mktemp -d)"
+DEAD_URL="-O $OUT_DIR/small.txt http://127.0.0.1:1/small.txt"
+SLOW_URL="-O $OUT_DIR/small.txt http://127.0.0.1:$HTTP_PORT/slow/small.txt"
+FAST_URL="-O $OUT_DIR/small.txt http://127.0.0.1:$HTTP_PORT/small.txt"
+cat > "$OUT_DIR/sources.json" << EOF
+{
+  "http": {"url": "$DEAD_URL", "updateFile": false, "downloaded": false, "alternative": ["$SLOW_URL", "$FAST_URL"]}
+}
+EOF
+# An updateFile source whose main URL wins keeps its validators for the next run
+cat > "$OUT_DIR/update.json" << EOF
+{
+  "curl": {"url": "-s -f -o $OUT_DIR/curl.txt http://127.0.0.1:$HTTP_PORT/small.txt", "updateFile": true, "downloaded": false,
+           "alternative": ["-s -f -o $OUT_DIR/curl.txt http://127.0.0.1:$HTTP_PORT/slow/small.txt"]}
+}
+EOF
+if python3 scripts/download_manual_sources.py --config "$OUT_DIR/sources.json" --race > /tmp/manual_sources_race.log 2>&1 \
+    && grep -q "Downloaded: 1" /tmp/manual_sources_race.log \
+    && [ "$(cat "$OUT_DIR/small.txt")" = "hello" ] \
+    && python3 -c "
+import json
+source = json.load(open('$OUT_DIR/sources.json'))['http']
+assert source['url'] == '$FAST_URL', source
+assert source['alternative'] == ['$SLOW_URL', '$DEAD_URL'], source
+assert source['downloaded'] is True
+" 2>&1 \
+    && python3 scripts/download_manual_sources.py --config "$OUT_DIR/update.json" --race > /tmp/manual_sources_race2.log 2>&1 \
+    && python3 scripts/download_manual_sources.py --config "$OUT_DIR/update.json" --race > /tmp/manual_sources_race3.log 2>&1 \
+    && grep -q "Not modified" /tmp/manual_sources_race3.log; then
+    echo "✓ Fastest candidate won, URLs were reordered by latency and validators kept"
+else
+    echo "✗ Racing alternatives failed"
+    cat /tmp/manual_sources_race*.log
+    exit 1
+fi
+rm -rf "$OUT_DIR" /tmp/manual_sources_race*.log
+echo
+
+# Test 16: Streaming runner with live throughput
+echo "Test 16: Testing streaming subprocess runner..."
+FAKE_DIR="$(mktemp -d)"
+# A fake curl that writes a progress meter with carriage returns
+cat > "$FAKE_DIR/curl" << 'EOF'
+#!/usr/bin/env python3
+import sys, time
+sys.stderr.write("  % Total    % Received % Xferd  Average Speed   Time\n")
+for i in range(1, 5):
+    sys.stderr.write("\r %d  4096k  %d  %dk    0     0  1024k      0 --:--:-- --:--:-- --:--:-- 1024k" % (i * 25, i * 25, i * 1024))
+    sys.stderr.flush()
+    time.sleep(0.3)
+sys.stderr.write("\n")
+sys.stderr.flush()
+print("done")
+EOF
+chmod +x "$FAKE_DIR/curl"
+if python3 -c "
+import io, sys
+sys.path.insert(0, 'scripts')
+from stream_runner import run_streaming
+
+report = io.StringIO()
+result = run_streaming(['$FAKE_DIR/curl'], label='fake', report_interval=0.5, report=report)
+assert result.returncode == 0, result
+assert result.bytes_transferred == 4096 * 1024, result
+assert result.output_tail == ['done'], result.output_tail
+assert '[fake]' in report.getvalue() and 'ETA' in report.getvalue(), report.getvalue()
+print('✓ Progress parsed live, tail kept only regular output:', result.summary())
+" 2>&1; then
+    echo "✓ Streaming runner passed"
+else
+    echo "✗ Streaming runner failed"
+    exit 1
+fi
+rm -rf "$FAKE_DIR"
+echo
+
+# Test 17: Throughput watchdog
+echo "Test 17: Testing throughput watchdog..."
+FAKE_DIR="$(mktemp -d)"
+# A fake curl whose meter advances STEP bytes every 0.2s for COUNT updates
+cat > "$FAKE_DIR/curl" << 'EOF'
+#!/usr/bin/env python3
+import sys, time
+step, count = int(sys.argv[1]), int(sys.argv[2])
+for i in range(1, count + 1):
+    done = i * step
+    sys.stderr.write("\r 10  10M  10  %d    0     0  1024      0 --:--:-- --:--:-- --:--:-- 1024" % done)
+    sys.stderr.flush()
+    time.sleep(0.2)
+print("done")
+EOF
+chmod +x "$FAKE_DIR/curl"
+# A wrapper script that runs the fake curl as a separate child and records its PID
+printf '#!/bin/bash\necho "starting"\n"%s/curl" "$@" &\necho $! > "%s/curl.pid"\nwait\n' \
+    "$FAKE_DIR" "$FAKE_DIR" > "$FAKE_DIR/wrapper.sh"
+# A fake rsync --info=progress2 that only checks files for 4s: the byte count
+# stands still while the ir-chk counter moves, then it transfers the rest
+cat > "$FAKE_DIR/rsync" << 'EOF'
+#!/usr/bin/env python3
+import sys, time
+for i in range(20):
+    sys.stdout.write("\r  1,048,576  10%%    0.00kB/s    0:00:00 (xfr#1, ir-chk=%d/5000)" % (4000 - i))
+    sys.stdout.flush()
+    time.sleep(0.2)
+sys.stdout.write("\r 10,485,760 100%   50.00MB/s    0:00:00 (xfr#2, to-chk=0/5000)\n")
+print("done")
+EOF
+chmod +x "$FAKE_DIR/rsync"
+if python3 -c "
+import io, os, sys, time
+sys.path.insert(0, 'scripts')
+from stream_runner import WatchdogPolicy, run_streaming
+
+policy = WatchdogPolicy(min_rate=1024, window=2)
+run = lambda *cmd: run_streaming(list(cmd), watchdog=policy, report=io.StringIO())
+
+# Steady transfer: 50 KB/s for 4s, twice the window, must not be killed
+result = run('$FAKE_DIR/curl', '10240', '20')
+assert result.returncode == 0 and not result.timed_out, result
+print('✓ Healthy transfer completed:', result.summary())
+
+# Stuck at 0 B/s while still printing meter lines
+start = time.monotonic()
+result = run('$FAKE_DIR/curl', '0', '1000')
+assert result.timed_out and 'no progress' in result.abort_reason, result
+assert time.monotonic() - start < 6, 'stalled transfer was not killed promptly'
+print('✓ Stalled transfer killed:', result.abort_reason)
+
+# Trickling below the floor (500 B/s)
+result = run('$FAKE_DIR/curl', '100', '1000')
+assert result.timed_out and 'throughput' in result.abort_reason, result
+print('✓ Slow transfer killed:', result.abort_reason)
+
+# A long rsync check phase moves no bytes but is not a stall
+result = run('$FAKE_DIR/rsync')
+assert result.returncode == 0 and not result.timed_out, result
+assert result.bytes_transferred == 10485760, result
+print('✓ rsync check phase not killed:', result.summary())
+
+# Progress of tools run by a wrapper script is recognised too, and the
+# abort stops the tool along with the script
+start = time.monotonic()
+result = run('bash', '$FAKE_DIR/wrapper.sh', '0', '1000')
+assert result.timed_out and result.output_tail == ['starting'], result
+assert time.monotonic() - start < 6, 'aborting the wrapper script took too long'
+pid = int(open('$FAKE_DIR/curl.pid').read())
+try:
+    state = open(f'/proc/{pid}/stat').read().rsplit(')', 1)[1].split()[0]
+except FileNotFoundError:
+    state = None
+assert state in (None, 'Z'), f'the wrapped curl survived the abort ({state})'
+print('✓ Stalled transfer inside wrapper script killed with its whole process group')
+
+# Per-source settings layer over defaults
+policy = WatchdogPolicy.from_config({'min_rate': 2048, 'window': 30}, {'min_rate': '10K'})
+assert (policy.min_rate, policy.window, policy.max_duration) == (10240, 30, None), policy
+try:
+    WatchdogPolicy.from_config({'window': 0})
+    raise AssertionError('window 0 accepted')
+except ValueError:
+    pass
+print('✓ Policies layer and validate')
+" 2>&1; then
+    echo "✓ Throughput watchdog passed"
+else
+    echo "✗ Throughput watchdog failed"
+    exit 1
+fi
+rm -rf "$FAKE_DIR"
+echo
+
+# Test 18: Checksums verified while downloading
+echo "Test 18: Testing checksum verification..."
+OUT_DIR="$(mktemp -d)"
+printf 'hellO' > "$HTTP_DIR/tampered.txt"
+GOOD_SHA=$(python3 -c "import hashlib; print(hashlib.sha256(b'hello').hexdigest())")
+BAD_MD5=00000000000000000000000000000000
+cat > "$OUT_DIR/sources.json" << EOF
+{
+  "http": {"url": "-O $OUT_DIR/a.txt http://127.0.0.1:$HTTP_PORT/tampered.txt", "updateFile": false, "downloaded": false,
+           "alternative": ["-O $OUT_DIR/a.txt http://127.0.0.1:$HTTP_PORT/small.txt"], "sha256": "$GOOD_SHA"},
+  "curl": {"url": "-s -f -o $OUT_DIR/b.txt http://127.0.0.1:$HTTP_PORT/tampered.txt", "updateFile": false, "downloaded": false,
+           "alternative": ["-s -f -o $OUT_DIR/b.txt http://127.0.0.1:$HTTP_PORT/small.txt"], "sha256": "$GOOD_SHA"},
+  "wget": {"url": "-q -O $OUT_DIR/c.txt http://127.0.0.1:$HTTP_PORT/small.txt", "updateFile": false, "downloaded": false,
+           "alternative": [], "md5": "$BAD_MD5"}
+}
+EOF
+python3 scripts/download_manual_sources.py --config "$OUT_DIR/sources.json" > /tmp/manual_sources_sum.log 2>&1
+if grep -q "Downloaded: 2" /tmp/manual_sources_sum.log \
+    && grep -q "Failed: 1" /tmp/manual_sources_sum.log \
+    && [ "$(grep -c "sha256 mismatch" /tmp/manual_sources_sum.log)" = "2" ] \
+    && grep -q "md5 mismatch" /tmp/manual_sources_sum.log \
+    && [ "$(cat "$OUT_DIR/a.txt")" = "hello" ] \
+    && [ "$(cat "$OUT_DIR/b.txt")" = "hello" ] \
+    && [ ! -f "$OUT_DIR/c.txt" ] \
+    && grep -q "Warning: sha256 needs a second read of the file (curl writes the file itself)" /tmp/manual_sources_sum.log \
+    && grep -q "Warning: md5 needs a second read of the file (wget writes the file itself)" /tmp/manual_sources_sum.log \
+    && [ "$(grep -c "needs a second read" /tmp/manual_sources_sum.log)" = "2" ] \
+    && python3 -c "
+import json, sys
+config = json.load(open('$OUT_DIR/sources.json'))
+assert config['http']['url'].endswith('/small.txt') and config['http']['downloaded'], config['http']
+assert config['curl']['url'].endswith('/small.txt') and config['curl']['downloaded'], config['curl']
+assert not config['wget']['downloaded'], config['wget']
+sys.path.insert(0, 'scripts')
+from download_manual_sources import second_read
+assert second_read('http', '--segments 4 -O x.bin http://example.com/x.bin') == 'segments arrive out of order'
+assert second_read('http', '-O x.bin http://example.com/x.bin') is None
+"; then
+    echo "✓ Mismatching downloads failed over to alternatives, bad files were removed"
+    echo "✓ Checksums needing a second read of the file were warned about"
+else
+    echo "✗ Checksum verification failed"
+    cat /tmp/manual_sources_sum.log
+    exit 1
+fi
+rm -rf "$OUT_DIR" /tmp/manual_sources_sum.log "$HTTP_DIR/tampered.txt"
+echo
+
+# Test 19: Indexed source list, selection and legacy layout
+echo "Test 19: Testing indexed source list with --id/--tag..."
+OUT_DIR="$(mktemp -d)"
+cat > "$OUT_DIR/sources.json" << 'EOF'
+{
+  "sources": [
+    {"id": "one", "method": "true", "tags": ["maps"], "url": "https://a.example.com/1", "updateFile": false, "downloaded": false, "alternative": []},
+    {"id": "two", "method": "true", "tags": ["maps", "docs"], "url": "https://b.example.com/2", "updateFile": false, "downloaded": false, "alternative": []},
+    {"id": "three", "method": "true", "url": "https://c.example.com/3", "updateFile": false, "downloaded": false, "alternative": []},
+    {"id": "two", "method": "true", "url": "https://d.example.com/dup"}
+  ]
+}
+EOF
+if python3 scripts/download_manual_sources.py --config "$OUT_DIR/sources.json" --id three --tag docs > "$OUT_DIR/run.log" 2>&1 \
+    && grep -q "Duplicate source id 'two'" "$OUT_DIR/run.log" \
+    && grep -q "Selected 2 of 3" "$OUT_DIR/run.log" \
+    && grep -q "Downloaded: 2" "$OUT_DIR/run.log" \
+    && ! python3 scripts/download_manual_sources.py --config "$OUT_DIR/sources.json" --tag nope > /dev/null 2>&1 \
+    && python3 -c "
+import json, sys
+sys.path.insert(0, 'scripts')
+from source_index import SourceIndex, migrate
+
+data = json.load(open('$OUT_DIR/sources.json'))
+assert [s['downloaded'] for s in data['sources'][:3]] == [False, True, True], data
+
+index = SourceIndex(data)
+assert index.get('two').key_path == ['sources', 1]
+assert [s.id for s in index.tagged('maps')] == ['one', 'two']
+assert [s.id for s in index.select(['three'], ['maps'])] == ['one', 'two', 'three']
+
+legacy = {'wget': {'url': 'https://x/1', 'downloaded': False}, 'bad': 'nope'}
+index = SourceIndex(legacy)
+assert index.legacy and index.get('wget').key_path == ['wget'] and len(index.errors) == 1
+converted = migrate(legacy)
+assert converted['sources'][0] == {'id': 'wget', 'method': 'wget', 'url': 'https://x/1', 'downloaded': False}
+" 2>&1 \
+    && printf '{"wget": {"url": "https://x/1", "downloaded": false}}' > "$OUT_DIR/legacy.json" \
+    && python3 scripts/download_manual_sources.py --config "$OUT_DIR/legacy.json" --migrate > /dev/null \
+    && python3 -c "
+import json
+assert json.load(open('$OUT_DIR/legacy.json'))['sources'][0]['id'] == 'wget'
+"; then
+    echo "✓ Sources selected by ID and tag, only selected entries updated, legacy layout migrated"
+else
+    echo "✗ Indexed source list failed"
+    cat "$OUT_DIR/run.log"
+    exit 1
+fi
+rm -rf "$OUT_DIR"
+echo
+
+rm -rf "$METRICS_TMP"
+
 echo "========================================"
 echo "All tests passed! ✓"
 echo "========================================"